@@ -0,0 +1,83 @@
+"""
+Накладные расходы на подготовку параметров одного запроса статусов (STATUS_BATCH_SIZE sms):
+проверяемая модель pydantic, dataclass с asdict и доверенный путь Status.as_payload.
+
+    python -m benchmarks.bench_models --repeat 10000
+"""
+
+import argparse
+import time
+from dataclasses import asdict
+from enum import IntEnum
+
+from pydantic import BaseModel, conint, constr, field_serializer
+
+from mchs_sms.smsc_api import STATUS_BATCH_SIZE, Status
+
+
+class ValidatedStatus(BaseModel):
+    """Проверяемая модель параметров запроса статуса одной sms, как до появления Status.as_payload"""
+
+    class Number(IntEnum):
+        """
+        Формат ответа сервера:
+            0 – (по умолчанию) в виде строки (Status = 1, check_time = 10.10.2010 10:10:10).
+            1 – в виде номера статуса и штампа времени через запятую (1,1286524541).
+            2 – в xml формате.
+            3 – в json формате.
+        """
+
+        ZERO = 0
+        ONE = 1
+        TWO = 2
+        THREE = 3
+
+    phone: constr(pattern=r"^[+]?\d{10,11}$")
+    id: conint(ge=0)
+    fmt: Number = Number.THREE
+
+    @field_serializer("id")
+    def serialize_id(self, id: int, _info):
+        return str(id)
+
+
+def measure_time(func, repeat):
+    started_at = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started_at) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=10000)
+    args = parser.parse_args()
+
+    sms_list = [
+        (430 + number, "+7999999%04d" % number) for number in range(STATUS_BATCH_SIZE)
+    ]
+    phones = ",".join(phone for _, phone in sms_list)
+    sms_ids = ",".join(str(sms_id) for sms_id, _ in sms_list)
+
+    def validated():
+        return [
+            ValidatedStatus(phone=phone, id=sms_id).model_dump()
+            for sms_id, phone in sms_list
+        ]
+
+    def dataclass_asdict():
+        return asdict(Status(phone=phones, id=sms_ids))
+
+    def trusted():
+        return Status(phone=phones, id=sms_ids).as_payload()
+
+    for name, func in (
+        ("pydantic Status per sms", validated),
+        ("dataclass + asdict", dataclass_asdict),
+        ("Status.as_payload", trusted),
+    ):
+        print("%-24s %8.2f us per poll" % (name, measure_time(func, args.repeat) * 1e6))
+
+
+if __name__ == "__main__":
+    main()
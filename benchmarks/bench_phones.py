@@ -0,0 +1,167 @@
+"""
+Сравнение хранения списка номеров: список строк с проверкой pydantic при каждой отправке
+и упакованный PhoneList, проверенный при загрузке. Кроме проверки, измеряется процессорное время
+всей отправки от /send/ до запросов к sms-сервису: модель сообщения, постановка в очередь и отправка
+частей обработчиком. Sms-сервис и Redis заменены заглушками, их время не учитывается.
+
+    python -m benchmarks.bench_phones --count 1000000
+"""
+
+import argparse
+import gc
+import time
+import tracemalloc
+from unittest.mock import patch
+
+import trio
+from pydantic import BaseModel, constr, conint
+
+from mchs_sms.phones import PhoneList
+from mchs_sms.sender import MailingSender, MailingWorker
+from mchs_sms.server import Message
+from mchs_sms.smsc_api import SmscResponse
+
+
+class ListMessage(BaseModel):
+    """Сообщение со списком строк, как до появления PhoneList"""
+
+    phones: list[constr(pattern=r"^[+]?\d{10,11}$")]
+    mes: constr(min_length=5)
+    valid: conint(ge=1, le=24)
+
+
+class NullDatabase:
+    """Заглушка базы данных: задания на отправку хранятся в списке, остальное не сохраняется"""
+
+    def __init__(self):
+        self.jobs = []
+
+    async def create_sms_mailing(self, *args):
+        pass
+
+    async def enqueue_sms_mailing_job(self, sms_id, **job):
+        self.jobs.append((sms_id, {"sms_id": sms_id, **job}))
+
+    async def add_sms_mailing_chunk(self, *args):
+        pass
+
+    async def add_failed_sms_mailing_chunk(self, *args):
+        pass
+
+    async def get_done_sms_mailing_chunks(self, sms_id):
+        return set()
+
+    async def touch_sms_mailing_job(self, *args):
+        pass
+
+    async def ack_sms_mailing_job(self, job_id):
+        pass
+
+
+async def fake_request_smsc(http_method, api_method, *, payload):
+    return SmscResponse(content={"id": 430, "cnt": 1}, status_code=200)
+
+
+def measure_cpu(func, repeat):
+    started_at = time.process_time()
+    for _ in range(repeat):
+        func()
+    return (time.process_time() - started_at) / repeat
+
+
+def send_list(phone_strings):
+    """Отправка списка строк: проверка pydantic и отправка частей"""
+
+    async def send():
+        db = NullDatabase()
+        sender = MailingSender(db)
+        ListMessage(phones=phone_strings, mes="Завтра гроза", valid=1)
+        progress = await sender.create_mailing(len(phone_strings), "Завтра гроза")
+        await sender.send(progress, phone_strings, "Завтра гроза", 1)
+
+    trio.run(send)
+
+
+def send_phone_list(worker: MailingWorker):
+    """Отправка PhoneList: модель сообщения, задание в очереди и его обработка"""
+
+    async def send():
+        message = Message(phones=worker.phones, mes="Завтра гроза", valid=1)
+        await worker.sender.enqueue_mailing(message.phones, message.mes, message.valid)
+        job_id, job = worker.db.jobs.pop()
+        await worker.process(job_id, job)
+
+    trio.run(send)
+
+
+def measure_memory(build):
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size
+
+
+def measure_time(func, repeat):
+    started_at = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started_at) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    def build_phones():
+        return ["+7%010d" % number for number in range(args.count)]
+
+    phone_strings, strings_size = measure_memory(build_phones)
+    phone_list, packed_size = measure_memory(
+        lambda: PhoneList.from_phones(build_phones())
+    )
+    print(
+        "memory: list of str %.1f MB, PhoneList %.1f MB"
+        % (strings_size / 2**20, packed_size / 2**20)
+    )
+
+    list_send = measure_time(
+        lambda: ListMessage(phones=phone_strings, mes="Завтра гроза", valid=1),
+        args.repeat,
+    )
+    packed_send = measure_time(
+        lambda: Message(phones=phone_list, mes="Завтра гроза", valid=1),
+        args.repeat,
+    )
+    print(
+        "/send/ validation: list of str %.3f s, PhoneList %.6f s"
+        % (list_send, packed_send)
+    )
+
+    list_serialize = measure_time(lambda: ",".join(phone_strings), args.repeat)
+    packed_serialize = measure_time(phone_list.to_smsc, args.repeat)
+    print(
+        "serialization: list of str %.3f s, PhoneList %.3f s"
+        % (list_serialize, packed_serialize)
+    )
+
+    with patch("mchs_sms.sender.request_smsc", fake_request_smsc):
+        list_cpu = measure_cpu(lambda: send_list(phone_strings), args.repeat)
+
+        db = NullDatabase()
+        started_at = time.process_time()
+        worker = MailingWorker(db, MailingSender(db), phone_list, "bench")
+        worker_start_cpu = time.process_time() - started_at
+        packed_cpu = measure_cpu(lambda: send_phone_list(worker), args.repeat)
+    print(
+        "/send/ -> SMSC CPU: list of str %.3f s, PhoneList %.3f s "
+        "(worker start %.3f s, once per process)"
+        % (list_cpu, packed_cpu, worker_start_cpu)
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Задержка вызовов Database из trio: клиент Redis на trio (--client trio) и aioredis через мост trio_asyncio
+(--client aioredis, как сервер работал раньше). Для каждого вызова выводятся медиана и 99-й перцентиль задержки
+при последовательных вызовах и количество вызовов в секунду при --concurrency одновременных задачах.
+Бенчмарк очищает базу --redis.
+
+    python -m benchmarks.bench_redis_calls --redis redis://localhost/15 --client aioredis --output before.json
+    python -m benchmarks.bench_redis_calls --redis redis://localhost/15 --client trio --output after.json
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import time
+
+import trio
+
+from mchs_sms.db import Database
+
+MAILINGS_COUNT = 50
+PHONES_PER_MAILING = 100
+
+
+async def open_client(args):
+    """Возвращает подключение к Redis и функцию, которая делает корутину Database вызываемой из trio"""
+    if args.client == "trio":
+        from mchs_sms.redis_client import from_url
+
+        return from_url(args.redis, max_connections=args.concurrency), lambda fn: fn
+
+    import aioredis
+    import trio_asyncio
+
+    return (
+        aioredis.from_url(args.redis, decode_responses=True),
+        trio_asyncio.aio_as_trio,
+    )
+
+
+async def fill_database(db, bridge):
+    phones = ["+7999%07d" % number for number in range(PHONES_PER_MAILING)]
+    for index in range(MAILINGS_COUNT):
+        await bridge(db.add_sms_mailing)(str(index + 1), phones, "Завтра гроза")
+
+
+def get_calls(db, bridge) -> dict:
+    sms_ids = [str(index + 1) for index in range(MAILINGS_COUNT)]
+    statuses = [("1", "+7999%07d" % number, "pending") for number in range(10)]
+    return {
+        "get": lambda: bridge(db.redis.get)("sms_mailing_1"),
+        "page_sms_mailings": lambda: bridge(db.page_sms_mailings)(),
+        "get_mailing_summaries": lambda: bridge(db.get_mailing_summaries)(*sms_ids),
+        "get_due_sms_list": lambda: bridge(db.get_due_sms_list)(None, 100),
+        "get_pending_phones": lambda: bridge(db.get_pending_phones)(*sms_ids[:10]),
+        "update_sms_status_in_bulk": lambda: bridge(db.update_sms_status_in_bulk)(
+            statuses
+        ),
+    }
+
+
+async def measure_latency(call, repeat: int) -> list:
+    latencies = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        await call()
+        latencies.append(time.perf_counter() - started_at)
+    return latencies
+
+
+async def measure_throughput(call, repeat: int, concurrency: int) -> float:
+    async def run_calls():
+        for _ in range(repeat):
+            await call()
+
+    started_at = time.perf_counter()
+    async with trio.open_nursery() as nursery:
+        for _ in range(concurrency):
+            nursery.start_soon(run_calls)
+    return repeat * concurrency / (time.perf_counter() - started_at)
+
+
+async def measure(args) -> dict:
+    redis, bridge = await open_client(args)
+    await bridge(redis.flushdb)()
+    db = Database(redis)
+    await fill_database(db, bridge)
+
+    results = {}
+    for name, call in get_calls(db, bridge).items():
+        await measure_latency(call, 10)
+        latencies = sorted(await measure_latency(call, args.repeat))
+        results[name] = {
+            "median_seconds": statistics.median(latencies),
+            "p99_seconds": latencies[int(len(latencies) * 0.99) - 1],
+            "calls_per_second": await measure_throughput(
+                call, args.repeat // args.concurrency or 1, args.concurrency
+            ),
+        }
+        print(
+            "%-26s median %7.1f µs, p99 %7.1f µs, %8.0f calls/s with %d tasks"
+            % (
+                name,
+                results[name]["median_seconds"] * 1e6,
+                results[name]["p99_seconds"] * 1e6,
+                results[name]["calls_per_second"],
+                args.concurrency,
+            ),
+            file=sys.stderr,
+        )
+
+    await bridge(redis.flushdb)()
+    await bridge(redis.close)()
+    return {"client": args.client, "concurrency": args.concurrency, "calls": results}
+
+
+async def run(args) -> dict:
+    if args.client == "trio":
+        return await measure(args)
+
+    import trio_asyncio
+
+    async with trio_asyncio.open_loop():
+        return await measure(args)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--redis", default="redis://localhost/15")
+    parser.add_argument("--client", choices=["trio", "aioredis"], default="trio")
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--output", help="Файл для результатов, по умолчанию stdout.")
+    args = parser.parse_args()
+
+    report = trio.run(run, args)
+    if args.output:
+        with open(args.output, "w") as fd:
+            json.dump(report, fd, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
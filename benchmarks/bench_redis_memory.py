@@ -0,0 +1,106 @@
+"""
+Память Redis, занимаемая рассылкой: статусы телефонов строками в одном хэше рассылки
+и кодами в хэшах частей рассылки (Database(compact_phones=True)). Выводится прирост used_memory
+на получателя и его основные части: статусы телефонов, множества недоставленных SMS и расписание
+опроса статусов sms_status_checks. Половина SMS рассылки доставлена, остальные ждут доставки.
+Бенчмарк записывает данные в базу --redis и удаляет их после замера.
+
+    python -m benchmarks.bench_redis_memory --redis redis://localhost/15 --phones 100000
+"""
+
+import argparse
+import math
+
+import trio
+
+from mchs_sms.db import Database
+from mchs_sms.redis_client import from_url
+from mchs_sms.sender import DEFAULT_CHUNK_SIZE
+from mchs_sms.smsc_api import chunked
+
+
+async def get_used_memory(redis) -> int:
+    return int((await redis.info("memory"))["used_memory"])
+
+
+async def get_keys_memory(redis, keys) -> int:
+    pipe = redis.pipeline()
+    for key in keys:
+        pipe.memory_usage(key, samples=0)
+    return sum(size or 0 for size in await pipe.execute())
+
+
+async def measure_mailing(redis, sms_id, phones, chunk_size, compact_phones) -> dict:
+    db = Database(redis, compact_phones=compact_phones)
+    used_memory = await get_used_memory(redis)
+    await db.create_sms_mailing(
+        sms_id, "Завтра гроза", len(phones), math.ceil(len(phones) / chunk_size)
+    )
+    for chunk_index, chunk in enumerate(chunked(phones, chunk_size)):
+        smsc_id = f"{sms_id}{chunk_index:06}"
+        await db.add_sms_mailing_chunk(sms_id, smsc_id, chunk, chunk_index)
+        # половина SMS доставлена
+        await db.update_sms_status_in_bulk(
+            [(smsc_id, phone, "delivered") for phone in chunk[::2]]
+        )
+
+    total = await get_used_memory(redis) - used_memory
+
+    if compact_phones:
+        keys = [key async for key in redis.scan_iter(match="phones_for_smsc_id_*")]
+    else:
+        keys = [f"phones_for_sms_mailing_{sms_id}"]
+    pending_keys = [
+        key async for key in redis.scan_iter(match="pending_phones_for_smsc_id_*")
+    ]
+    sizes = {
+        "total": total,
+        "statuses": await get_keys_memory(redis, keys),
+        "pending": await get_keys_memory(redis, pending_keys),
+        "checks": await get_keys_memory(redis, ["sms_status_checks"]),
+    }
+
+    encodings = {await redis.object("encoding", key) for key in keys}
+    await db.compact_sms_mailing(sms_id)
+    await redis.zrem("sms_mailings", sms_id)
+    await redis.zrem("compacted_sms_mailings", sms_id)
+    await redis.delete(f"sms_mailing_{sms_id}", f"stats_for_sms_mailing_{sms_id}")
+    return sizes, encodings
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--redis", default="redis://localhost/15")
+    parser.add_argument("--phones", type=int, default=100_000)
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    redis = from_url(args.redis)
+    phones = ["+7999%07d" % number for number in range(args.phones)]
+    try:
+        for name, sms_id, compact_phones in (
+            ("mailing hash, string statuses", "1", False),
+            ("chunk hashes, status codes", "2", True),
+        ):
+            sizes, encodings = await measure_mailing(
+                redis, sms_id, phones, args.chunk_size, compact_phones
+            )
+            print(
+                "%-30s used_memory +%8.1f KB, %5.1f bytes per phone: statuses %5.1f (%s), "
+                "pending sets %5.1f, status checks %5.1f"
+                % (
+                    name,
+                    sizes["total"] / 1024,
+                    sizes["total"] / len(phones),
+                    sizes["statuses"] / len(phones),
+                    ", ".join(encodings),
+                    sizes["pending"] / len(phones),
+                    sizes["checks"] / len(phones),
+                )
+            )
+    finally:
+        await redis.close()
+
+
+if __name__ == "__main__":
+    trio.run(main)
@@ -0,0 +1,264 @@
+"""
+Сквозной замер пропускной способности для рассылок разного размера: запросы /send/ и /ws идут в приложение сервера
+через тестовый клиент Quart, рассылку отправляет MailingWorker в локальный имитатор sms-сервиса, данные хранятся
+в локальном Redis. Для каждого размера замеряются:
+
+    sends_per_second — номеров в секунду от запроса /send/ до отправки всех частей рассылки;
+    status_updates_per_second — изменившихся статусов в секунду за один цикл StatusRefresher по всем SMS рассылки;
+    ws_first_message_seconds — время до первого сообщения /ws (сводка строится заново);
+    ws_payload_build_seconds — время сборки сводки по последним рассылкам;
+    redis_bytes_per_recipient — прирост памяти Redis на один номер после отправки.
+
+Результаты выводятся в JSON. С --baseline результаты сравниваются с сохранённым ранее замером, и при ухудшении
+больше чем на --tolerance бенчмарк завершается с ошибкой. Бенчмарк очищает базу --redis.
+
+    python -m benchmarks.bench_throughput --redis redis://localhost/15 --sizes 1000,10000,100000 --output base.json
+    python -m benchmarks.bench_throughput --redis redis://localhost/15 --baseline base.json
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from functools import partial
+
+import trio
+
+from mchs_sms.db import Database
+from mchs_sms.phones import PhoneList
+from mchs_sms.poller import StatusPoller, StatusRefresher
+from mchs_sms.redis_client import from_url
+from mchs_sms.sender import DEFAULT_CHUNK_SIZE, MailingSender, MailingWorker
+from mchs_sms.server import app, build_mailings_page_message
+from mchs_sms.simulator import QUEUED_SECONDS
+from mchs_sms.smsc_api import SmscClient, smsc_client, smsc_login, smsc_password
+from mchs_sms.updates import MailingSnapshotCache, MailingUpdatesFeed
+
+# для этих показателей больше — лучше, для остальных — меньше
+HIGHER_IS_BETTER = ("sends_per_second", "status_updates_per_second")
+LOWER_IS_BETTER = (
+    "ws_first_message_seconds",
+    "ws_payload_build_seconds",
+    "redis_bytes_per_recipient",
+)
+DELIVERY_TIME = 0.2
+
+
+async def start_simulator(nursery, port):
+    """Запускает имитатор sms-сервиса без задержек и ошибок и дожидается, пока он начнёт принимать соединения"""
+    await nursery.start(
+        partial(
+            trio.run_process,
+            [
+                sys.executable,
+                "-m",
+                "mchs_sms.simulator",
+                "--port",
+                str(port),
+                "--latency",
+                "0",
+                "--delivery-time",
+                str(DELIVERY_TIME),
+            ],
+            stderr=subprocess.DEVNULL,
+        )
+    )
+    while True:
+        try:
+            stream = await trio.open_tcp_stream("127.0.0.1", port)
+        except OSError:
+            await trio.sleep(0.1)
+            continue
+        await stream.aclose()
+        return
+
+
+async def wait_sent(db, sms_id):
+    while True:
+        [summary] = await db.get_mailing_summaries(sms_id)
+        if summary["chunks_sent"] + summary["chunks_failed"] >= summary["chunks_count"]:
+            return summary
+        await trio.sleep(0.01)
+
+
+async def get_used_memory(redis):
+    info = await redis.info("memory")
+    return info["used_memory"]
+
+
+async def measure(redis, size, args) -> dict:
+    await redis.flushdb()
+    phones = PhoneList.from_phones("+7%010d" % number for number in range(size))
+
+    db = Database(redis)
+    sender = MailingSender(db, args.chunk_size, args.send_concurrency)
+    feed = MailingUpdatesFeed(db)
+    refresher = StatusRefresher(db, StatusPoller(args.poll_concurrency, args.poll_rate))
+    app.config.update(
+        VALID=1,
+        PHONES=phones,
+        REDIS_DB=db,
+        MAILING_SENDER=sender,
+        UPDATES_FEED=feed,
+        SNAPSHOT_CACHE=MailingSnapshotCache(
+            feed, partial(build_mailings_page_message, db), 0
+        ),
+        WS_UPDATE_INTERVAL=1.0,
+    )
+    used_memory = await get_used_memory(redis)
+
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(feed.run)
+        nursery.start_soon(MailingWorker(db, sender, phones, "bench").run)
+
+        async with app.test_app() as test_app:
+            client = test_app.test_client()
+
+            started_at = time.perf_counter()
+            response = await client.post("/send/", form={"text": "Завтра гроза"})
+            mailing = await response.get_json()
+            summary = await wait_sent(db, mailing["mailingId"])
+            send_seconds = time.perf_counter() - started_at
+            redis_bytes = await get_used_memory(redis) - used_memory
+
+            # все SMS получают окончательный статус в имитаторе и опрашиваются за один цикл
+            await trio.sleep(QUEUED_SECONDS + DELIVERY_TIME * 20)
+            started_at = time.perf_counter()
+            status_updates = await refresher.refresh()
+            status_seconds = time.perf_counter() - started_at
+
+            started_at = time.perf_counter()
+            async with client.websocket("/ws") as websocket:
+                payload = await websocket.receive()
+            ws_first_message_seconds = time.perf_counter() - started_at
+
+        build_times = []
+        for _ in range(args.repeat):
+            started_at = time.perf_counter()
+            await build_mailings_page_message(db)
+            build_times.append(time.perf_counter() - started_at)
+
+        nursery.cancel_scope.cancel()
+
+    return {
+        "recipients": size,
+        "chunks_sent": summary["chunks_sent"],
+        "chunks_failed": summary["chunks_failed"],
+        "send_seconds": send_seconds,
+        "sends_per_second": size / send_seconds,
+        "status_updates": status_updates,
+        "status_seconds": status_seconds,
+        "status_updates_per_second": status_updates / status_seconds,
+        "ws_first_message_seconds": ws_first_message_seconds,
+        "ws_payload_build_seconds": statistics.median(build_times),
+        "ws_payload_bytes": len(payload.encode()),
+        "redis_bytes_per_recipient": redis_bytes / size,
+    }
+
+
+def find_regressions(results: list, baseline: dict, tolerance: float) -> list:
+    """Показатели, ухудшившиеся относительно baseline больше чем на tolerance, для рассылок одного размера"""
+    baseline_results = {result["recipients"]: result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        base = baseline_results.get(result["recipients"])
+        if not base:
+            continue
+        for name in HIGHER_IS_BETTER:
+            if result[name] < base[name] * (1 - tolerance):
+                regressions.append(
+                    (result["recipients"], name, base[name], result[name])
+                )
+        for name in LOWER_IS_BETTER:
+            if result[name] > base[name] * (1 + tolerance):
+                regressions.append(
+                    (result["recipients"], name, base[name], result[name])
+                )
+    return regressions
+
+
+async def run(args) -> dict:
+    smsc_login.set("bench")
+    smsc_password.set("bench")
+    redis = from_url(args.redis)
+    results = []
+    async with trio.open_nursery() as nursery:
+        await start_simulator(nursery, args.simulator_port)
+        async with SmscClient(f"http://127.0.0.1:{args.simulator_port}") as client:
+            smsc_client.set(client)
+            for size in args.sizes:
+                result = await measure(redis, size, args)
+                print(
+                    "%8d recipients: %9.0f sends/s, %9.0f status updates/s, "
+                    "ws first message %.4f s, %5.1f Redis bytes per recipient"
+                    % (
+                        size,
+                        result["sends_per_second"],
+                        result["status_updates_per_second"],
+                        result["ws_first_message_seconds"],
+                        result["redis_bytes_per_recipient"],
+                    ),
+                    file=sys.stderr,
+                )
+                results.append(result)
+
+        redis_info = await redis.info("server")
+        await redis.close()
+        nursery.cancel_scope.cancel()
+
+    return {
+        "python": platform.python_version(),
+        "redis": redis_info["redis_version"],
+        "chunk_size": args.chunk_size,
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--redis", default="redis://localhost/15")
+    parser.add_argument(
+        "--sizes",
+        type=lambda value: [int(size) for size in value.split(",")],
+        default=[1000, 10_000, 100_000],
+        help="Размеры рассылок через запятую, например 1000,10000,100000,1000000.",
+    )
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--send-concurrency", type=int, default=10)
+    parser.add_argument("--poll-concurrency", type=int, default=20)
+    parser.add_argument("--poll-rate", type=float, default=1000.0)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--simulator-port", type=int, default=8765)
+    parser.add_argument("--output", help="Файл для результатов, по умолчанию stdout.")
+    parser.add_argument("--baseline", help="Результаты предыдущего замера.")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    report = trio.run(run, args)
+    if args.output:
+        with open(args.output, "w") as fd:
+            json.dump(report, fd, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as fd:
+            baseline = json.load(fd)
+        regressions = find_regressions(report["results"], baseline, args.tolerance)
+        for size, name, base_value, value in regressions:
+            print(
+                "regression at %d recipients: %s %.6g -> %.6g"
+                % (size, name, base_value, value),
+                file=sys.stderr,
+            )
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
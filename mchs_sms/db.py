@@ -1,6 +1,74 @@
+import collections
 import time
 import json
-from typing import Optional
+from typing import Callable, Optional
+
+from mchs_sms.metrics import REDIS_CALL_SECONDS, timed
+from mchs_sms.redis_client import ResponseError
+
+SMS_STATUSES = ("pending", "delivered", "failed")
+SMS_MAILING_PROGRESS_FIELDS = ("chunks_sent", "chunks_failed")
+UPDATES_CHANNEL = "sms_mailings_updates"
+SMS_MAILING_JOBS_STREAM = "sms_mailing_jobs"
+SMS_MAILING_JOBS_GROUP = "sms_mailing_senders"
+SMS_MAILINGS_PAGE_SIZE = 50
+# SMSC keeps trying to deliver SMS for at most 24 hours
+MAX_SMS_VALID_SECONDS = 24 * 60 * 60
+
+# statuses are stored as single digits, compact hash encoding (listpack) keeps them as one byte integers
+SMS_STATUS_CODES = {"pending": "0", "delivered": "1", "failed": "2"}
+SMS_CODE_STATUSES = {code: status for status, code in SMS_STATUS_CODES.items()}
+
+# KEYS: mailing phones hash, pending phones set of SMSC id, mailing stats hash, pending SMSC ids index by deadline,
+#       phones hash of SMSC id, status checks schedule
+# ARGV: SMSC id key, mailing sms_id key, updates channel, then pairs of phone and new status
+# If phones hash of SMSC id exists, statuses are stored there as codes, otherwise as strings in mailing phones hash
+UPDATE_SMS_STATUSES_SCRIPT = (
+    """
+local status_codes = {pending = "0", delivered = "1", failed = "2"}
+local code_statuses = {["0"] = "pending", ["1"] = "delivered", ["2"] = "failed"}
+local max_valid_seconds = %d
+local phones_key, codes = KEYS[1], nil
+if redis.call("EXISTS", KEYS[5]) == 1 then
+    phones_key, codes = KEYS[5], status_codes
+end
+local changed = 0
+for i = 4, #ARGV, 2 do
+    local phone, status = ARGV[i], ARGV[i + 1]
+    local old_status = redis.call("HGET", phones_key, phone)
+    if old_status and codes then
+        old_status = code_statuses[old_status]
+    end
+    if old_status and old_status ~= status then
+        redis.call("HSET", phones_key, phone, codes and codes[status] or status)
+        redis.call("HINCRBY", KEYS[3], old_status, -1)
+        redis.call("HINCRBY", KEYS[3], status, 1)
+        if status == "pending" then
+            local valid_until = redis.call("HGET", KEYS[3], "valid_until")
+                or tonumber(redis.call("TIME")[1]) + max_valid_seconds
+            redis.call("SADD", KEYS[2], phone)
+            redis.call("ZADD", KEYS[4], "NX", valid_until, ARGV[1])
+            redis.call("ZADD", KEYS[6], "NX", redis.call("TIME")[1], ARGV[1] .. ":" .. phone)
+        else
+            redis.call("SREM", KEYS[2], phone)
+            redis.call("ZREM", KEYS[6], ARGV[1] .. ":" .. phone)
+        end
+        changed = changed + 1
+    end
+end
+if changed > 0 then
+    local counters = redis.call("HMGET", KEYS[3], "pending", "delivered", "failed")
+    redis.call("PUBLISH", ARGV[3], cjson.encode({
+        sms_id = ARGV[2],
+        pending = tonumber(counters[1]),
+        delivered = tonumber(counters[2]),
+        failed = tonumber(counters[3]),
+    }))
+end
+return changed
+"""
+    % MAX_SMS_VALID_SECONDS
+)
 
 
 def _clean_key(key):
@@ -12,7 +80,7 @@ def _clean_key(key):
 
 def _clean_sms_status(value):
     cleaned_value = str(value).lower()
-    if cleaned_value not in ["delivered", "failed", "pending"]:
+    if cleaned_value not in SMS_STATUSES:
         raise ValueError(
             f"Unknown status found: `{cleaned_value}`. Wanted one of delivered, failed or pending."
         )
@@ -20,80 +88,475 @@ def _clean_sms_status(value):
     return cleaned_value
 
 
+def _get_valid_until(sent_at: float, valid: Optional[int]) -> float:
+    return sent_at + (valid * 60 * 60 if valid else MAX_SMS_VALID_SECONDS)
+
+
 class Database:
     """База данных Redis, хранит данные об SMS рассылках.
 
+    Рассылка отправляется в sms-сервис одной или несколькими частями, каждая часть получает свой id SMSC.
+    Рассылка из одной части, добавленная через add_sms_mailing, имеет sms_id, совпадающий с id SMSC.
+    В списке недоставленных SMS и в обновлениях статусов sms_id — это id SMSC части рассылки.
+
     Схема ключей в базе данных:
 
         tracked_sms_{sms_id}_{phone} —> timestamp (когда начали следить за SMS)
         sms_mailing_{sms_id} —> JSON с информацией о рассылке
-        phones_for_sms_mailing_{sms_id} —> hset {phone}:{status} (статус доставки)
+        phones_for_smsc_id_{smsc_id} —> hset {phone}:{status code} (статус доставки телефонов части рассылки)
+        phones_for_sms_mailing_{sms_id} —> hset {phone}:{status} (статус доставки при compact_phones=False)
+        stats_for_sms_mailing_{sms_id} —> hset {status}:{count} (счётчики SMS по статусам и отправленных частей,
+            valid_until последней отправленной части)
+        sms_mailings —> zset {sms_id}:{created_at} (индекс всех рассылок)
+        sms_mailings_by_smsc_id —> hset {smsc_id}:{sms_id} (рассылка, к которой относится часть с id SMSC)
+        pending_smsc_ids_by_deadline —> zset {smsc_id}:{valid_until} (части рассылок, у которых есть
+            недоставленные SMS, и время, после которого sms-сервис перестаёт их доставлять)
+        pending_phones_for_smsc_id_{smsc_id} —> set {phone} (телефоны части рассылки в статусе pending)
+        sms_status_checks —> zset {smsc_id}:{phone}:{check_at} (SMS в статусе pending и время следующего опроса
+            их статуса)
+        sent_at_by_smsc_id —> hset {smsc_id}:{sent_at} (время отправки части рассылки)
+        done_chunks_for_sms_mailing_{sms_id} —> set {chunk_index} (отправленные или отклонённые части рассылки)
+        smsc_ids_for_sms_mailing_{sms_id} —> set {smsc_id} (id SMSC отправленных частей рассылки)
+        compacted_sms_mailings —> zset {sms_id}:{expire_at} (сжатые рассылки и время удаления их сводки)
+        sms_mailing_jobs —> stream (очередь рассылок на отправку с группой обработчиков sms_mailing_senders)
+
+    Статусы телефонов хранятся по частям рассылки кодами SMS_STATUS_CODES: хэш части из не более чем
+    hash-max-listpack-entries (512 по умолчанию) телефонов Redis хранит в компактном представлении.
+    При compact_phones=False и в рассылках, созданных до этого, статусы хранятся строками в одном хэше рассылки.
+
+    Об изменениях рассылок Database сообщает в канал sms_mailings_updates: JSON с sms_id и счётчиками SMS.
     """
 
-    def __init__(self, redis):
+    def __init__(self, redis, compact_phones: bool = True):
         self.redis = redis
+        self.compact_phones = compact_phones
+        self._update_sms_statuses = redis.register_script(UPDATE_SMS_STATUSES_SCRIPT)
 
+    @timed(REDIS_CALL_SECONDS)
     async def add_sms_mailing(
-        self, sms_id: str, phones: list, text: str, created_at: Optional[float] = None
+        self,
+        sms_id: str,
+        phones: list,
+        text: str,
+        created_at: Optional[float] = None,
+        valid: Optional[int] = None,
     ):
-        """Add to Redis all records required to represent new SMS mailing."""
+        """Add to Redis all records required to represent new SMS mailing sent as one chunk with SMSC id sms_id.
+
+        SMS are pending for valid hours since created_at at most,
+        then they are counted as failed by expire_pending_sms.
+        """
         sms_id_key = _clean_key(sms_id)
+        created_at = float(created_at or time.time())
 
-        mailing_key = f"sms_mailing_{sms_id_key}"
-        mailing_phones_key = f"phones_for_sms_mailing_{sms_id_key}"
+        async with self.redis.pipeline(transaction=True) as pipe:
+            self._create_sms_mailing(pipe, sms_id_key, text, len(phones), created_at)
+            self._add_sms_mailing_chunk(
+                pipe, sms_id_key, sms_id_key, phones, created_at, valid
+            )
+            await pipe.execute()
 
+        await self._publish_update(sms_id_key)
+
+    @timed(REDIS_CALL_SECONDS)
+    async def create_sms_mailing(
+        self,
+        sms_id: str,
+        text: str,
+        phones_count: int,
+        chunks_count: int,
+        created_at: Optional[float] = None,
+    ):
+        """Register new SMS mailing which chunks will be added with add_sms_mailing_chunk as they are sent."""
         async with self.redis.pipeline(transaction=True) as pipe:
-            pipe.set(
-                mailing_key,
-                json.dumps(
-                    {
-                        "sms_id": sms_id,
-                        "text": text,
-                        "created_at": float(created_at or time.time()),
-                        "phones_count": len(phones),
-                    },
-                    ensure_ascii=False,
-                ),
+            self._create_sms_mailing(
+                pipe, _clean_key(sms_id), text, phones_count, created_at, chunks_count
+            )
+            await pipe.execute()
+
+    @timed(REDIS_CALL_SECONDS)
+    async def add_sms_mailing_chunk(
+        self,
+        sms_id: str,
+        smsc_id: str,
+        phones: list,
+        chunk_index: Optional[int] = None,
+        valid: Optional[int] = None,
+    ):
+        """Add to Redis pending phones of SMS mailing chunk, sent to SMSC and got SMSC id smsc_id.
+
+        If chunk_index is given, the chunk is marked as done, so it is not sent again when the mailing job is retried.
+        SMS are pending for valid hours since now at most, then they are counted as failed by expire_pending_sms.
+        """
+        sms_id_key = _clean_key(sms_id)
+
+        async with self.redis.pipeline(transaction=True) as pipe:
+            self._add_sms_mailing_chunk(
+                pipe, sms_id_key, _clean_key(smsc_id), phones, time.time(), valid
             )
+            if chunk_index is not None:
+                pipe.sadd(f"done_chunks_for_sms_mailing_{sms_id_key}", chunk_index)
+            await pipe.execute()
 
-            for phone in phones:
-                # escaping for phone number is not required here, any string is acceptable
-                pipe.hset(mailing_phones_key, phone, "pending")
+        await self._publish_update(sms_id_key)
 
+    @timed(REDIS_CALL_SECONDS)
+    async def add_failed_sms_mailing_chunk(
+        self, sms_id: str, phones_count: int, chunk_index: Optional[int] = None
+    ):
+        """Count SMS mailing chunk that SMSC refused to send: all its phones are counted as failed."""
+        sms_id_key = _clean_key(sms_id)
+        stats_key = f"stats_for_sms_mailing_{sms_id_key}"
+
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hincrby(stats_key, "failed", phones_count)
+            pipe.hincrby(stats_key, "chunks_failed", 1)
+            if chunk_index is not None:
+                pipe.sadd(f"done_chunks_for_sms_mailing_{sms_id_key}", chunk_index)
             await pipe.execute()
 
-    async def get_pending_sms_list(self):
-        """Get from Redis all pending messages."""
-        keys = await self.redis.keys("phones_for_sms_mailing_*")
+        await self._publish_update(sms_id_key)
+
+    @timed(REDIS_CALL_SECONDS)
+    async def get_done_sms_mailing_chunks(self, sms_id: str) -> set:
+        """Return indexes of SMS mailing chunks that were already sent or refused by SMSC."""
+        sms_id_key = _clean_key(sms_id)
+        chunk_indexes = await self.redis.smembers(
+            f"done_chunks_for_sms_mailing_{sms_id_key}"
+        )
+        return {int(chunk_index) for chunk_index in chunk_indexes}
+
+    @timed(REDIS_CALL_SECONDS)
+    async def enqueue_sms_mailing_job(self, sms_id: str, **job) -> str:
+        """Add job to send SMS mailing to the jobs stream, return job id."""
+        return await self.redis.xadd(
+            SMS_MAILING_JOBS_STREAM, {"sms_id": _clean_key(sms_id), **job}
+        )
+
+    async def create_sms_mailing_jobs_group(self):
+        """Create the consumers group of the jobs stream, if it does not exist yet. Call once before reading jobs."""
+        try:
+            await self.redis.xgroup_create(
+                SMS_MAILING_JOBS_STREAM, SMS_MAILING_JOBS_GROUP, id="0", mkstream=True
+            )
+        except ResponseError as error:
+            if "BUSYGROUP" not in str(error):
+                raise
+
+    async def read_sms_mailing_jobs(
+        self, consumer: str, count: int = 1, block: Optional[int] = None
+    ) -> list:
+        """Read new jobs for consumer, blocking up to block milliseconds. Return list of pairs (job_id, job)."""
+        streams = await self.redis.xreadgroup(
+            SMS_MAILING_JOBS_GROUP,
+            consumer,
+            {SMS_MAILING_JOBS_STREAM: ">"},
+            count=count,
+            block=block,
+        )
+        return [job for _, jobs in streams for job in jobs]
+
+    async def claim_stale_sms_mailing_jobs(
+        self, consumer: str, min_idle_time: int, count: int = 10
+    ) -> list:
+        """Take over up to count jobs not acknowledged by other consumers for min_idle_time milliseconds.
+
+        Such jobs are left by crashed consumers or postponed while SMSC was unavailable. The whole pending list
+        is scanned with XAUTOCLAIM (Redis 6.2+), so stale jobs are found behind any number of jobs in progress.
+        Return list of pairs (job_id, job).
+        """
+        jobs = []
+        start_id = "0-0"
+        while len(jobs) < count:
+            start_id, claimed_jobs = await self.redis.xautoclaim(
+                SMS_MAILING_JOBS_STREAM,
+                SMS_MAILING_JOBS_GROUP,
+                consumer,
+                min_idle_time,
+                start_id,
+                count=count - len(jobs),
+            )
+            # job deleted from the stream is returned without fields
+            jobs.extend(job for job in claimed_jobs if job[0] is not None)
+            if start_id == "0-0":
+                break
+        return jobs
+
+    async def touch_sms_mailing_job(self, consumer: str, job_id: str):
+        """Reset idle time of the job being processed, so other consumers do not take it over."""
+        await self.redis.xclaim(
+            SMS_MAILING_JOBS_STREAM,
+            SMS_MAILING_JOBS_GROUP,
+            consumer,
+            0,
+            [job_id],
+            justid=True,
+        )
+
+    @timed(REDIS_CALL_SECONDS)
+    async def ack_sms_mailing_job(self, job_id: str):
+        """Acknowledge processed job and remove it from the jobs stream."""
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.xack(SMS_MAILING_JOBS_STREAM, SMS_MAILING_JOBS_GROUP, job_id)
+            pipe.xdel(SMS_MAILING_JOBS_STREAM, job_id)
+            await pipe.execute()
+
+    def _create_sms_mailing(
+        self,
+        pipe,
+        sms_id_key: str,
+        text: str,
+        phones_count: int,
+        created_at: Optional[float],
+        chunks_count: int = 1,
+    ):
+        created_at = float(created_at or time.time())
+        pipe.set(
+            f"sms_mailing_{sms_id_key}",
+            json.dumps(
+                {
+                    "sms_id": sms_id_key,
+                    "text": text,
+                    "created_at": created_at,
+                    "phones_count": phones_count,
+                    "chunks_count": chunks_count,
+                },
+                ensure_ascii=False,
+            ),
+        )
+        pipe.hset(
+            f"stats_for_sms_mailing_{sms_id_key}",
+            mapping={
+                **{status: 0 for status in SMS_STATUSES},
+                **{field: 0 for field in SMS_MAILING_PROGRESS_FIELDS},
+            },
+        )
+        pipe.zadd("sms_mailings", {sms_id_key: created_at})
+        pipe.publish(
+            UPDATES_CHANNEL,
+            json.dumps(
+                {"sms_id": sms_id_key, **{status: 0 for status in SMS_STATUSES}}
+            ),
+        )
+
+    def _add_sms_mailing_chunk(
+        self,
+        pipe,
+        sms_id_key: str,
+        smsc_id_key: str,
+        phones: list,
+        sent_at: float,
+        valid: Optional[int],
+    ):
+        stats_key = f"stats_for_sms_mailing_{sms_id_key}"
+        pending_phones_key = f"pending_phones_for_smsc_id_{smsc_id_key}"
+        valid_until = _get_valid_until(sent_at, valid)
+
+        if phones:
+            # escaping for phone number is not required here, any string is acceptable
+            if self.compact_phones:
+                pipe.hset(
+                    f"phones_for_smsc_id_{smsc_id_key}",
+                    mapping=dict.fromkeys(phones, SMS_STATUS_CODES["pending"]),
+                )
+            else:
+                pipe.hset(
+                    f"phones_for_sms_mailing_{sms_id_key}",
+                    mapping=dict.fromkeys(phones, "pending"),
+                )
+            pipe.sadd(pending_phones_key, *phones)
+            pipe.zadd("pending_smsc_ids_by_deadline", {smsc_id_key: valid_until})
+            # status of just sent SMS is checked on the next refresh
+            pipe.zadd(
+                "sms_status_checks",
+                {f"{smsc_id_key}:{phone}": sent_at for phone in phones},
+            )
+        pipe.hset("sms_mailings_by_smsc_id", smsc_id_key, sms_id_key)
+        pipe.hset("sent_at_by_smsc_id", smsc_id_key, sent_at)
+        pipe.hset(stats_key, "valid_until", valid_until)
+        pipe.sadd(f"smsc_ids_for_sms_mailing_{sms_id_key}", smsc_id_key)
+        pipe.hincrby(stats_key, "pending", len(set(phones)))
+        pipe.hincrby(stats_key, "chunks_sent", 1)
+
+    async def _publish_update(self, sms_id_key: str):
+        counters = await self.redis.hmget(
+            f"stats_for_sms_mailing_{sms_id_key}", *SMS_STATUSES
+        )
+        await self.redis.publish(
+            UPDATES_CHANNEL,
+            json.dumps(
+                {
+                    "sms_id": sms_id_key,
+                    **{
+                        status: int(count or 0)
+                        for status, count in zip(SMS_STATUSES, counters)
+                    },
+                }
+            ),
+        )
+
+    @timed(REDIS_CALL_SECONDS)
+    async def get_pending_sms_list(self, now: Optional[float] = None):
+        """Get from Redis pending messages which are still valid as list of pairs (SMSC id, phone)."""
+        now = now or time.time()
+        smsc_id_keys = await self.redis.zrangebyscore(
+            "pending_smsc_ids_by_deadline", f"({now}", "+inf"
+        )
 
         pipe = self.redis.pipeline()
-        for key in keys:
-            pipe.hgetall(key)
+        for smsc_id_key in smsc_id_keys:
+            pipe.smembers(f"pending_phones_for_smsc_id_{smsc_id_key}")
 
-        phones_pairs_groups = await pipe.execute()
+        pending_phones_groups = await pipe.execute()
 
         pending_sms_list = []
-        for key, phone2status in zip(keys, phones_pairs_groups):
-            *_, sms_id_key = key.split("_")
+        drained_smsc_id_keys = []
+        for smsc_id_key, pending_phones in zip(smsc_id_keys, pending_phones_groups):
+            if not pending_phones:
+                drained_smsc_id_keys.append(smsc_id_key)
+                continue
 
-            pending_phones = (
-                phone for phone, status in phone2status.items() if status == "pending"
-            )
-            pending_sms_list.extend((sms_id_key, phone) for phone in pending_phones)
+            pending_sms_list.extend((smsc_id_key, phone) for phone in pending_phones)
+
+        if drained_smsc_id_keys:
+            # chunk has no pending phones anymore, drop it from the index lazily
+            await self.redis.zrem("pending_smsc_ids_by_deadline", *drained_smsc_id_keys)
 
         return pending_sms_list
 
-    async def update_sms_status_in_bulk(self, sms_list):
-        """Receives list of tuples (sms_id, phone, status)."""
-        async with self.redis.pipeline(transaction=True) as pipe:
-            for sms_id, phone, status in sms_list:
-                sms_id_key = _clean_key(sms_id)
-                cleaned_status = _clean_sms_status(status)
-                mailing_phones_key = f"phones_for_sms_mailing_{sms_id_key}"
-                pipe.hset(mailing_phones_key, phone, cleaned_status)
+    @timed(REDIS_CALL_SECONDS)
+    async def get_due_sms_list(
+        self, now: Optional[float] = None, limit: Optional[int] = None
+    ) -> list:
+        """Get from Redis pending messages which status check is due by now, earliest first.
 
-            await pipe.execute()
+        Returns list of tuples (SMSC id, phone, sent_at), sent_at is None if sending time of the chunk is unknown.
+        """
+        now = now or time.time()
+        members = await self.redis.zrangebyscore(
+            "sms_status_checks",
+            "-inf",
+            now,
+            start=0 if limit else None,
+            num=limit,
+        )
+        if not members:
+            return []
+
+        due_sms_list = [member.rpartition(":")[::2] for member in members]
+        smsc_id_keys = list({smsc_id_key for smsc_id_key, _ in due_sms_list})
+        sent_at_values = await self.redis.hmget("sent_at_by_smsc_id", *smsc_id_keys)
+        smsc_id_key2sent_at = {
+            smsc_id_key: float(sent_at) if sent_at else None
+            for smsc_id_key, sent_at in zip(smsc_id_keys, sent_at_values)
+        }
+        return [
+            (smsc_id_key, phone, smsc_id_key2sent_at[smsc_id_key])
+            for smsc_id_key, phone in due_sms_list
+        ]
+
+    @timed(REDIS_CALL_SECONDS)
+    async def get_pending_phones(self, *smsc_ids: str) -> list:
+        """For each mailing chunk in smsc_ids return set of its phones in pending status."""
+        pipe = self.redis.pipeline()
+        for smsc_id in smsc_ids:
+            pipe.smembers(f"pending_phones_for_smsc_id_{_clean_key(smsc_id)}")
+        return await pipe.execute()
+
+    @timed(REDIS_CALL_SECONDS)
+    async def reschedule_sms_checks(self, sms_checks: dict):
+        """Receives dict {(SMSC id, phone): time of the next status check}.
+
+        Only SMS that are still scheduled are updated, so SMS that got final status meanwhile are not checked again.
+        """
+        if not sms_checks:
+            return
+
+        await self.redis.zadd(
+            "sms_status_checks",
+            {
+                f"{_clean_key(smsc_id)}:{phone}": check_at
+                for (smsc_id, phone), check_at in sms_checks.items()
+            },
+            xx=True,
+        )
+
+    async def count_pending_sms(self) -> int:
+        """Return number of pending SMS scheduled for status checks."""
+        return await self.redis.zcard("sms_status_checks")
+
+    @timed(REDIS_CALL_SECONDS)
+    async def expire_pending_sms(self, now: Optional[float] = None) -> int:
+        """Mark as failed pending SMS which SMSC does not deliver anymore, since their valid period is over.
+
+        Returns number of SMS marked as failed.
+        """
+        now = now or time.time()
+        smsc_id_keys = await self.redis.zrangebyscore(
+            "pending_smsc_ids_by_deadline", "-inf", now
+        )
+        if not smsc_id_keys:
+            return 0
+
+        pipe = self.redis.pipeline()
+        for smsc_id_key in smsc_id_keys:
+            pipe.smembers(f"pending_phones_for_smsc_id_{smsc_id_key}")
+        pending_phones_groups = await pipe.execute()
+
+        expired_count = await self.update_sms_status_in_bulk(
+            (smsc_id_key, phone, "failed")
+            for smsc_id_key, pending_phones in zip(smsc_id_keys, pending_phones_groups)
+            for phone in pending_phones
+        )
+        await self.redis.zrem("pending_smsc_ids_by_deadline", *smsc_id_keys)
+        return expired_count
+
+    @timed(REDIS_CALL_SECONDS)
+    async def update_sms_status_in_bulk(self, sms_list) -> int:
+        """Receives list of tuples (sms_id, phone, status), where sms_id is SMSC id of mailing chunk.
+
+        Statuses and per-mailing counters are updated by Lua script, one call per SMSC id, all calls in one
+        MULTI/EXEC transaction sent in one round trip. Counters change only on actual transitions, so repeated
+        updates never double count. Unknown phones are ignored. For every changed mailing its new counters
+        are published to the updates channel. Returns number of changed SMS.
+        """
+        smsc_id_key2updates = collections.defaultdict(list)
+        for smsc_id, phone, status in sms_list:
+            smsc_id_key2updates[_clean_key(smsc_id)].extend(
+                (phone, _clean_sms_status(status))
+            )
+        if not smsc_id_key2updates:
+            return 0
 
+        smsc_id_keys = list(smsc_id_key2updates)
+        sms_id_keys = await self.redis.hmget("sms_mailings_by_smsc_id", *smsc_id_keys)
+
+        calls = []
+        for smsc_id_key, sms_id_key in zip(smsc_id_keys, sms_id_keys):
+            # mailings created before chunks existed have the same id as their only chunk
+            sms_id_key = sms_id_key or smsc_id_key
+            calls.append(
+                (
+                    [
+                        f"phones_for_sms_mailing_{sms_id_key}",
+                        f"pending_phones_for_smsc_id_{smsc_id_key}",
+                        f"stats_for_sms_mailing_{sms_id_key}",
+                        "pending_smsc_ids_by_deadline",
+                        f"phones_for_smsc_id_{smsc_id_key}",
+                        "sms_status_checks",
+                    ],
+                    [
+                        smsc_id_key,
+                        sms_id_key,
+                        UPDATES_CHANNEL,
+                        *smsc_id_key2updates[smsc_id_key],
+                    ],
+                )
+            )
+
+        return sum(await self._update_sms_statuses.execute_many(calls))
+
+    @timed(REDIS_CALL_SECONDS)
     async def get_sms_mailings(self, *sms_ids: str) -> list:
         """For each mailing in sms_ids load all data from Redis and return dict."""
         pipe = self.redis.pipeline()
@@ -104,11 +567,26 @@ class Database:
 
             pipe.get(mailing_key)
             pipe.hgetall(phones_key)
+            pipe.smembers(f"smsc_ids_for_sms_mailing_{sms_id_key}")
 
         values = await pipe.execute()
 
+        # statuses of chunks phones are stored as codes in hash of each chunk
+        pipe = self.redis.pipeline()
+        for smsc_id_keys in values[2::3]:
+            for smsc_id_key in smsc_id_keys:
+                pipe.hgetall(f"phones_for_smsc_id_{smsc_id_key}")
+        chunks_phones = iter(await pipe.execute())
+
         mailings = []
-        for json_text, phones in zip(values[::2], values[1::2]):
+        for json_text, phones, smsc_id_keys in zip(
+            values[::3], values[1::3], values[2::3]
+        ):
+            for _ in smsc_id_keys:
+                phones.update(
+                    (phone, SMS_CODE_STATUSES[code])
+                    for phone, code in next(chunks_phones).items()
+                )
             if not json_text:
                 # SMS mailing was not found
                 continue
@@ -122,7 +600,334 @@ class Database:
 
         return mailings
 
+    @timed(REDIS_CALL_SECONDS)
+    async def get_mailing_summaries(self, *sms_ids: str) -> list:
+        """For each mailing in sms_ids load its description, SMS counters by status and sent chunks counters.
+
+        Per-phone data is not loaded.
+        """
+        pipe = self.redis.pipeline()
+        for sms_id in sms_ids:
+            sms_id_key = _clean_key(sms_id)
+            pipe.get(f"sms_mailing_{sms_id_key}")
+            pipe.hmget(
+                f"stats_for_sms_mailing_{sms_id_key}",
+                *SMS_STATUSES,
+                *SMS_MAILING_PROGRESS_FIELDS,
+            )
+
+        values = await pipe.execute()
+
+        summaries = []
+        for json_text, counters in zip(values[::2], values[1::2]):
+            if not json_text:
+                # SMS mailing was not found
+                continue
+
+            summaries.append(
+                {
+                    "chunks_count": 1,
+                    **json.loads(json_text),
+                    **{
+                        field: int(count or 0)
+                        for field, count in zip(
+                            SMS_STATUSES + SMS_MAILING_PROGRESS_FIELDS, counters
+                        )
+                    },
+                }
+            )
+
+        return summaries
+
+    async def listen_updates(self):
+        """Yield delta events published when mailings are created, their chunks are sent or statuses change."""
+        channel = self.redis.pubsub(ignore_subscribe_messages=True)
+        await channel.subscribe(UPDATES_CHANNEL)
+        try:
+            async for message in channel.listen():
+                if message and message["type"] == "message":
+                    yield json.loads(message["data"])
+        finally:
+            await channel.reset()
+
     async def list_sms_mailings(self):
         """Return list of sms_id for all registered SMS mailings."""
-        keys = await self.redis.keys(f"sms_mailing_*")  # noqa F541
-        return [key.split("_")[-1] for key in keys]
+        return await self.redis.zrange("sms_mailings", 0, -1)
+
+    @timed(REDIS_CALL_SECONDS)
+    async def page_sms_mailings(
+        self,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        cursor: Optional[str] = None,
+        limit: int = SMS_MAILINGS_PAGE_SIZE,
+    ) -> tuple[list, Optional[str]]:
+        """Return sms_id of up to limit mailings created between since and until, newest first.
+
+        Also return cursor to pass for the next (older) page, None if there are no more mailings.
+        Cursor takes precedence over until.
+        """
+        if cursor is not None:
+            created_at, _, sms_id = cursor.partition(":")
+            rank = await self.redis.zrevrank("sms_mailings", sms_id)
+            if rank is None:
+                # mailing of cursor was removed, continue from its creation time
+                start = await self.redis.zcount("sms_mailings", created_at, "+inf")
+            else:
+                start = rank + 1
+        elif until is not None:
+            start = await self.redis.zcount("sms_mailings", f"({until}", "+inf")
+        else:
+            start = 0
+
+        # one more mailing tells whether there is the next page
+        mailings = await self.redis.zrevrange(
+            "sms_mailings", start, start + limit, withscores=True
+        )
+        if since is not None:
+            mailings = [
+                (sms_id, created_at)
+                for sms_id, created_at in mailings
+                if created_at >= since
+            ]
+
+        page = mailings[:limit]
+        next_cursor = None
+        if len(mailings) > limit:
+            sms_id, created_at = page[-1]
+            next_cursor = f"{created_at!r}:{sms_id}"
+        return [sms_id for sms_id, _ in page], next_cursor
+
+    async def build_indexes(self) -> int:
+        """One-shot migration: build mailing and pending indexes and status counters for keys created before them.
+
+        Such mailings were sent as one chunk with SMSC id equal to sms_id. Chunks of the pending index set created
+        before SMS valid period was recorded are moved to the index by deadline. Status checks of pending SMS sent
+        before the checks were scheduled are scheduled now. Keys are iterated with SCAN, so Redis is not blocked
+        for other clients. Returns number of indexed mailings.
+        """
+        indexed_count = 0
+        async for mailing_key in self.redis.scan_iter(match="sms_mailing_*"):
+            if mailing_key == SMS_MAILING_JOBS_STREAM:
+                continue
+            *_, sms_id_key = mailing_key.split("_")
+            mailing_phones_key = f"phones_for_sms_mailing_{sms_id_key}"
+            pending_phones_key = f"pending_phones_for_smsc_id_{sms_id_key}"
+            stats_key = f"stats_for_sms_mailing_{sms_id_key}"
+
+            json_text = await self.redis.get(mailing_key)
+            if not json_text:
+                # SMS mailing was deleted while scanning
+                continue
+            mailing = json.loads(json_text)
+            if "chunks_count" in mailing:
+                # mailing was created with indexes already
+                continue
+
+            pending_phones = []
+            status_counter = collections.Counter({status: 0 for status in SMS_STATUSES})
+            async for phone, status in self.redis.hscan_iter(mailing_phones_key):
+                status_counter[status] += 1
+                if status == "pending":
+                    pending_phones.append(phone)
+
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.zadd("sms_mailings", {sms_id_key: mailing["created_at"]})
+                pipe.hset("sms_mailings_by_smsc_id", sms_id_key, sms_id_key)
+                pipe.delete(pending_phones_key)
+                if pending_phones:
+                    pipe.sadd(pending_phones_key, *pending_phones)
+                    pipe.zadd(
+                        "pending_smsc_ids_by_deadline",
+                        {sms_id_key: mailing["created_at"] + MAX_SMS_VALID_SECONDS},
+                    )
+                pipe.hset(stats_key, mapping={**status_counter, "chunks_sent": 1})
+                await pipe.execute()
+
+            indexed_count += 1
+
+        await self._migrate_legacy_pending_index()
+        await self._schedule_legacy_status_checks()
+        return indexed_count
+
+    async def _migrate_legacy_pending_index(self):
+        """Pending index was a set before SMS valid period was recorded, validity of its chunks is unknown."""
+        legacy_smsc_id_keys = await self.redis.smembers("pending_smsc_ids")
+        if not legacy_smsc_id_keys:
+            return
+
+        valid_until = time.time() + MAX_SMS_VALID_SECONDS
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zadd(
+                "pending_smsc_ids_by_deadline",
+                dict.fromkeys(legacy_smsc_id_keys, valid_until),
+                nx=True,
+            )
+            pipe.delete("pending_smsc_ids")
+            await pipe.execute()
+
+    async def _schedule_legacy_status_checks(self):
+        """Pending SMS sent before status checks were scheduled are checked on the next refresh.
+
+        Sending time of their chunk is taken from the mailing.
+        """
+        now = time.time()
+        async for smsc_id_key, _ in self.redis.zscan_iter(
+            "pending_smsc_ids_by_deadline"
+        ):
+            sms_id_key = (
+                await self.redis.hget("sms_mailings_by_smsc_id", smsc_id_key)
+                or smsc_id_key
+            )
+            json_text = await self.redis.get(f"sms_mailing_{sms_id_key}")
+            pending_phones = await self.redis.smembers(
+                f"pending_phones_for_smsc_id_{smsc_id_key}"
+            )
+            async with self.redis.pipeline(transaction=True) as pipe:
+                if json_text:
+                    pipe.hsetnx(
+                        "sent_at_by_smsc_id",
+                        smsc_id_key,
+                        json.loads(json_text)["created_at"],
+                    )
+                if pending_phones:
+                    pipe.zadd(
+                        "sms_status_checks",
+                        {f"{smsc_id_key}:{phone}": now for phone in pending_phones},
+                        nx=True,
+                    )
+                await pipe.execute()
+
+    async def find_finished_sms_mailings(
+        self, now: Optional[float] = None, batch_size: int = 100
+    ) -> list:
+        """Return sms_id of not yet compacted mailings that will not change anymore.
+
+        Mailing is finished when all its chunks are sent or refused and it has no pending SMS,
+        or when SMSC stopped delivering its SMS: valid period of its last sent chunk is over.
+        """
+        now = now or time.time()
+        finished_sms_ids = []
+        offset = 0
+        while True:
+            sms_ids = await self.redis.zrange(
+                "sms_mailings", offset, offset + batch_size - 1
+            )
+            if not sms_ids:
+                return finished_sms_ids
+            offset += len(sms_ids)
+
+            pipe = self.redis.pipeline()
+            for sms_id in sms_ids:
+                pipe.zscore("compacted_sms_mailings", sms_id)
+                pipe.hget(f"stats_for_sms_mailing_{sms_id}", "valid_until")
+            values = await pipe.execute()
+            sms_id2valid_until = {
+                sms_id: float(valid_until) if valid_until else None
+                for sms_id, compacted_score, valid_until in zip(
+                    sms_ids, values[::2], values[1::2]
+                )
+                if compacted_score is None
+            }
+            summaries = await self.get_mailing_summaries(*sms_id2valid_until)
+
+            for summary in summaries:
+                if self._is_finished(
+                    summary, sms_id2valid_until[summary["sms_id"]], now
+                ):
+                    finished_sms_ids.append(summary["sms_id"])
+
+    @staticmethod
+    def _is_finished(summary: dict, valid_until: Optional[float], now: float) -> bool:
+        is_sent = (
+            summary["chunks_sent"] + summary["chunks_failed"] >= summary["chunks_count"]
+        )
+        if is_sent and not summary["pending"]:
+            return True
+
+        # mailings created before valid period was recorded are delivered for a day at most
+        deadline = valid_until or summary["created_at"] + MAX_SMS_VALID_SECONDS
+        if not is_sent:
+            # chunks not sent yet get their own valid period, unless sending got stuck for a day
+            deadline = max(deadline, summary["created_at"] + MAX_SMS_VALID_SECONDS)
+        return deadline <= now
+
+    async def compact_sms_mailing(
+        self,
+        sms_id: str,
+        ttl: Optional[int] = None,
+        archive: Optional[Callable[[dict], None]] = None,
+    ) -> int:
+        """Drop per-phone data of finished SMS mailing, keeping its description and SMS counters.
+
+        Before data is dropped archive is called with the mailing, its counters and per-phone statuses.
+        If ttl is given, description and counters expire after ttl seconds and the mailing is removed from the index
+        by remove_expired_sms_mailings. Returns number of bytes freed in Redis.
+        """
+        sms_id_key = _clean_key(sms_id)
+        phones_key = f"phones_for_sms_mailing_{sms_id_key}"
+        smsc_ids_key = f"smsc_ids_for_sms_mailing_{sms_id_key}"
+        done_chunks_key = f"done_chunks_for_sms_mailing_{sms_id_key}"
+
+        # mailings created before chunks existed have the same id as their only chunk
+        smsc_id_keys = list(await self.redis.smembers(smsc_ids_key) or {sms_id_key})
+        if archive:
+            [mailing] = await self.get_sms_mailings(sms_id_key)
+            counters = await self.redis.hgetall(f"stats_for_sms_mailing_{sms_id_key}")
+            mailing.update(
+                (field, float(value) if field == "valid_until" else int(value))
+                for field, value in counters.items()
+            )
+            archive(mailing)
+
+        pipe = self.redis.pipeline()
+        for smsc_id_key in smsc_id_keys:
+            pipe.smembers(f"pending_phones_for_smsc_id_{smsc_id_key}")
+        scheduled_checks = [
+            f"{smsc_id_key}:{phone}"
+            for smsc_id_key, pending_phones in zip(smsc_id_keys, await pipe.execute())
+            for phone in pending_phones
+        ]
+
+        dropped_keys = [
+            phones_key,
+            smsc_ids_key,
+            done_chunks_key,
+            *(f"pending_phones_for_smsc_id_{key}" for key in smsc_id_keys),
+            *(f"phones_for_smsc_id_{key}" for key in smsc_id_keys),
+        ]
+        pipe = self.redis.pipeline()
+        for key in dropped_keys:
+            pipe.memory_usage(key)
+        freed_bytes = sum(size or 0 for size in await pipe.execute())
+
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(*dropped_keys)
+            pipe.hdel("sms_mailings_by_smsc_id", *smsc_id_keys)
+            pipe.hdel("sent_at_by_smsc_id", *smsc_id_keys)
+            pipe.zrem("pending_smsc_ids_by_deadline", *smsc_id_keys)
+            if scheduled_checks:
+                pipe.zrem("sms_status_checks", *scheduled_checks)
+            if ttl:
+                pipe.expire(f"sms_mailing_{sms_id_key}", ttl)
+                pipe.expire(f"stats_for_sms_mailing_{sms_id_key}", ttl)
+            expire_at = time.time() + ttl if ttl else "+inf"
+            pipe.zadd("compacted_sms_mailings", {sms_id_key: expire_at})
+            await pipe.execute()
+
+        return freed_bytes
+
+    async def remove_expired_sms_mailings(self, now: Optional[float] = None) -> int:
+        """Remove from the index compacted mailings which description and counters expired. Returns their number."""
+        now = now or time.time()
+        sms_id_keys = await self.redis.zrangebyscore(
+            "compacted_sms_mailings", "-inf", now
+        )
+        if not sms_id_keys:
+            return 0
+
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zrem("sms_mailings", *sms_id_keys)
+            pipe.zrem("compacted_sms_mailings", *sms_id_keys)
+            await pipe.execute()
+        return len(sms_id_keys)
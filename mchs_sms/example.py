@@ -1,13 +1,11 @@
-import asyncio
 from contextlib import suppress
 
-import aioredis
 import argparse
 
 import trio
-import trio_asyncio
 
 from db import Database
+from redis_client import from_url
 
 
 def create_argparser():
@@ -16,7 +14,7 @@ def create_argparser():
         "--address",
         action="store",
         dest="redis_uri",
-        help="Redis URL. See examples at https://aioredis.readthedocs.io/en/latest/api/high-level/#aioredis.client.Redis.from_url",  # noqa E501
+        help="Redis URL, e.g. redis://:password@localhost:6379/0",
         default="redis://localhost",
     )
     return parser
@@ -26,72 +24,65 @@ async def main():
     parser = create_argparser()
     args = parser.parse_args()
 
-    async with trio_asyncio.open_loop():
-        redis = aioredis.from_url(args.redis_uri, decode_responses=True)
+    redis = from_url(args.redis_uri)
 
-        try:
-            db = Database(redis)
+    try:
+        db = Database(redis)
 
-            sms_id = "1"
+        sms_id = "1"
 
-            phones = [
-                "+7 999 519 05 57",
-                "911",
-                "112",
-            ]
-            text = "Вечером будет шторм!"
-
-            # await db.add_sms_mailing(sms_id, phones, text)
-            await trio_asyncio.aio_as_trio(db.add_sms_mailing)(sms_id, phones, text)
+        phones = [
+            "+7 999 519 05 57",
+            "911",
+            "112",
+        ]
+        text = "Вечером будет шторм!"
 
-            sms_ids = await trio_asyncio.aio_as_trio(db.list_sms_mailings)()
-            print("Registered mailings ids", sms_ids)
+        await db.add_sms_mailing(sms_id, phones, text)
 
-            pending_sms_list = await trio_asyncio.aio_as_trio(db.get_pending_sms_list)()
-            print("pending:")
-            print(pending_sms_list)
+        sms_ids = await db.list_sms_mailings()
+        print("Registered mailings ids", sms_ids)
 
-            await trio_asyncio.aio_as_trio(db.update_sms_status_in_bulk)(
-                [
-                    # [sms_id, phone_number, status]
-                    [sms_id, "112", "failed"],
-                    [sms_id, "911", "pending"],
-                    [sms_id, "+7 999 519 05 57", "delivered"],
-                    # following statuses are available: failed, pending, delivered
-                ]
-            )
+        pending_sms_list = await db.get_pending_sms_list()
+        print("pending:")
+        print(pending_sms_list)
 
-            pending_sms_list = await trio_asyncio.aio_as_trio(db.get_pending_sms_list)()
-            print("pending:")
-            print(pending_sms_list)
-
-            sms_mailings = await trio_asyncio.aio_as_trio(db.get_sms_mailings)("1")
-            print("sms_mailings")
-            print(sms_mailings)
+        await db.update_sms_status_in_bulk(
+            [
+                # [sms_id, phone_number, status]
+                [sms_id, "112", "failed"],
+                [sms_id, "911", "pending"],
+                [sms_id, "+7 999 519 05 57", "delivered"],
+                # following statuses are available: failed, pending, delivered
+            ]
+        )
 
-            async def send():
-                while True:
-                    await asyncio.sleep(1)
-                    await redis.publish("updates", sms_id)
+        pending_sms_list = await db.get_pending_sms_list()
+        print("pending:")
+        print(pending_sms_list)
 
-            async def listen():
-                channel = redis.pubsub()
-                await channel.subscribe("updates")
+        sms_mailings = await db.get_sms_mailings("1")
+        print("sms_mailings")
+        print(sms_mailings)
 
-                while True:
-                    message = await channel.get_message(
-                        ignore_subscribe_messages=True, timeout=1.0
-                    )
+        async def send():
+            while True:
+                await trio.sleep(1)
+                await redis.publish("updates", sms_id)
 
-                    if not message:
-                        continue
+        async def listen():
+            channel = redis.pubsub(ignore_subscribe_messages=True)
+            await channel.subscribe("updates")
 
-                    print("Got message:", repr(message["data"]))
+            async for message in channel.listen():
+                print("Got message:", repr(message["data"]))
 
-            await trio_asyncio.aio_as_trio(asyncio.gather)(send(), listen())
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(send)
+            nursery.start_soon(listen)
 
-        finally:
-            await redis.close()
+    finally:
+        await redis.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,94 @@
+"""Служебные команды для обслуживания базы данных рассылок"""
+
+import gzip
+import json
+from contextlib import suppress
+from functools import partial
+
+import asyncclick as click
+import trio
+
+from mchs_sms.db import Database
+from mchs_sms.redis_client import from_url
+
+
+@click.group()
+@click.option(
+    "-r",
+    "--redis",
+    "redis_uri",
+    help="Адрес сервера REDIS для хранения информации о рассылках.",
+    default="redis://localhost",
+)
+@click.pass_context
+async def cli(ctx, redis_uri):
+    """Служебные команды для обслуживания базы данных рассылок"""
+    ctx.obj = redis_uri
+
+
+@cli.command("build-indexes")
+@click.pass_obj
+async def build_indexes(redis_uri):
+    """Строит индексы и счётчики статусов для рассылок, созданных до их появления"""
+    redis = from_url(redis_uri)
+    try:
+        db = Database(redis)
+        indexed_count = await db.build_indexes()
+    finally:
+        await redis.close()
+
+    click.echo(f"Проиндексировано рассылок: {indexed_count}")
+
+
+def write_archive_record(archive, mailing: dict):
+    archive.write(json.dumps(mailing, ensure_ascii=False) + "\n")
+
+
+@cli.command("compact")
+@click.option(
+    "--archive",
+    "archive_path",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Файл архива: рассылки со статусами по телефонам дописываются в него в формате JSON lines + gzip.",
+)
+@click.option(
+    "--ttl",
+    type=int,
+    default=30 * 24 * 60 * 60,
+    show_default=True,
+    help="Сколько секунд хранить сводку по сжатой рассылке, 0 — хранить всегда.",
+)
+@click.pass_obj
+async def compact(redis_uri, archive_path, ttl):
+    """
+    Сжимает завершённые рассылки: удаляет статусы по телефонам, оставляя счётчики SMS,
+    и удаляет из индекса рассылки с истекшим сроком хранения сводки
+    """
+    compacted_count = freed_bytes = 0
+    redis = from_url(redis_uri)
+    archive = gzip.open(archive_path, "at", encoding="utf-8") if archive_path else None
+    try:
+        db = Database(redis)
+        sms_ids = await db.find_finished_sms_mailings()
+        for sms_id in sms_ids:
+            freed_bytes += await db.compact_sms_mailing(
+                sms_id,
+                ttl,
+                partial(write_archive_record, archive) if archive else None,
+            )
+            compacted_count += 1
+
+        removed_count = await db.remove_expired_sms_mailings()
+    finally:
+        if archive:
+            archive.close()
+        await redis.close()
+
+    click.echo(f"Сжато рассылок: {compacted_count}")
+    click.echo(f"Освобождено памяти Redis: {freed_bytes / 1024:.1f} КБ")
+    click.echo(f"Удалено рассылок с истекшим сроком хранения: {removed_count}")
+
+
+if __name__ == "__main__":
+    with suppress(KeyboardInterrupt):
+        trio.run(cli(_anyio_backend="trio"))
@@ -0,0 +1,229 @@
+"""Метрики процесса в текстовом формате Prometheus"""
+
+import bisect
+import functools
+import time
+from contextlib import contextmanager
+from typing import Sequence
+
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _format_labels(names: Sequence[str], values: Sequence) -> str:
+    if not names:
+        return ""
+    return "{%s}" % ",".join(
+        f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)
+    )
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != float("inf") else "+Inf"
+
+
+class Registry:
+    """Набор метрик процесса. Метрики только копят значения, текст собирается при запросе метрик"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "".join(metric.render() for metric in self.metrics)
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(
+        self, name: str, help: str, labelnames: Sequence[str] = (), registry=REGISTRY
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        registry.register(self)
+
+    def _render_samples(self):
+        for label_values, value in self._values.items():
+            yield self.name, self.labelnames, label_values, value
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(
+            f"{name}{_format_labels(names, values)} {_format_value(value)}"
+            for name, names, values, value in self._render_samples()
+        )
+        return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+    """Счётчик, который только растёт"""
+
+    type = "counter"
+
+    def inc(self, *label_values, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+
+class Gauge(Metric):
+    """Текущее значение"""
+
+    type = "gauge"
+
+    def set(self, value: float, *label_values):
+        self._values[label_values] = value
+
+    def inc(self, *label_values, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount: float = 1):
+        self.inc(*label_values, amount=-amount)
+
+
+class Histogram(Metric):
+    """Распределение значений по корзинам buckets: количество значений не больше границы каждой корзины"""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+        registry=REGISTRY,
+    ):
+        super().__init__(name, help, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *label_values):
+        # счётчики корзин хранятся без накопления, последний — для значений больше всех границ
+        counts, total = self._values.get(label_values) or (
+            [0] * (len(self.buckets) + 1),
+            0.0,
+        )
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._values[label_values] = counts, total + value
+
+    @contextmanager
+    def timer(self, *label_values):
+        """Записывает время выполнения блока в секундах"""
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, *label_values)
+
+    def _render_samples(self):
+        bucket_names = self.labelnames + ("le",)
+        for label_values, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", bucket_names, label_values + (
+                    _format_value(bound),
+                ), cumulative
+            yield f"{self.name}_sum", self.labelnames, label_values, total
+            yield f"{self.name}_count", self.labelnames, label_values, cumulative
+
+
+def timed(histogram: Histogram):
+    """Декоратор асинхронной функции: время её выполнения записывается в histogram с меткой — именем функции"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with histogram.timer(func.__name__):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+SMSC_REQUEST_SECONDS = Histogram(
+    "mchs_sms_smsc_request_seconds",
+    "Время запроса к sms-сервису вместе с повторами.",
+    ("api_method",),
+)
+REDIS_CALL_SECONDS = Histogram(
+    "mchs_sms_redis_call_seconds",
+    "Время выполнения метода Database.",
+    ("method",),
+)
+PENDING_SMS = Gauge(
+    "mchs_sms_pending_sms",
+    "Количество недоставленных SMS в расписании опроса статусов.",
+)
+POLL_CYCLE_SECONDS = Histogram(
+    "mchs_sms_poll_cycle_seconds",
+    "Время одного цикла обновления статусов SMS.",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+WEBSOCKET_CLIENTS = Gauge(
+    "mchs_sms_websocket_clients",
+    "Количество подключённых вебсокетов.",
+)
+WEBSOCKET_PAYLOAD_BYTES = Histogram(
+    "mchs_sms_websocket_payload_bytes",
+    "Размер сообщений, отправленных вебсокетам.",
+    buckets=SIZE_BUCKETS,
+)
+SMSC_REQUESTS = Counter(
+    "mchs_sms_smsc_requests_total",
+    "Запросы к sms-сервису, включая повторы.",
+    ("api_method",),
+)
+SMSC_FAILURES = Counter(
+    "mchs_sms_smsc_failures_total",
+    "Неудачные запросы к sms-сервису: сетевые ошибки, ответы 5xx и временные ошибки сервиса.",
+    ("api_method",),
+)
+SMSC_RETRIES = Counter(
+    "mchs_sms_smsc_retries_total",
+    "Повторы запросов к sms-сервису.",
+    ("api_method",),
+)
+SMSC_REJECTED = Counter(
+    "mchs_sms_smsc_rejected_total",
+    "Запросы, отклонённые разомкнутым предохранителем без обращения к sms-сервису.",
+)
+SMSC_CIRCUIT_OPENED = Counter(
+    "mchs_sms_smsc_circuit_opened_total",
+    "Сколько раз размыкался предохранитель sms-сервиса.",
+)
+SMSC_CIRCUIT_OPEN = Gauge(
+    "mchs_sms_smsc_circuit_open",
+    "1, если предохранитель sms-сервиса разомкнут.",
+)
+SMSC_CIRCUIT_OPEN_SECONDS = Counter(
+    "mchs_sms_smsc_circuit_open_seconds_total",
+    "Время, которое предохранитель sms-сервиса провёл разомкнутым.",
+)
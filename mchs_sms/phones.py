@@ -0,0 +1,309 @@
+"""Потоковое чтение списка номеров телефонов для рассылки"""
+
+import hashlib
+import re
+import sys
+from array import array
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+from functools import cached_property
+from typing import Iterable, Iterator, NamedTuple, Optional, TextIO
+
+DEFAULT_BLOCK_SIZE = 64 * 1024
+MAX_PHONE_LENGTH = 64
+MAX_REPORTED_INVALID = 100
+
+PHONE_DELIMITERS = re.compile(r"[;|,\n]")
+PHONE_PATTERN = re.compile(r"[+]?\d{10,11}")
+WHITESPACE = re.compile(r"\s+")
+
+
+PLUS_FLAG = 0b10
+LONG_FLAG = 0b01
+FLAGS_SIZE = 2
+
+# множитель фибоначчиева хэширования: соседние номера попадают в далёкие ячейки PackedIntSet
+HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+UINT64_MASK = 2**64 - 1
+
+
+def encode_phone(phone: str) -> int:
+    """
+    Упаковывает проверенный номер из 10 или 11 цифр, возможно с + в начале, в целое число:
+    цифры номера, признак + и признак 11-значного номера
+    """
+    digits = phone.lstrip("+")
+    flags = (PLUS_FLAG if phone[0] == "+" else 0) | (
+        LONG_FLAG if len(digits) == 11 else 0
+    )
+    return int(digits) << FLAGS_SIZE | flags
+
+
+def decode_phone(code: int) -> str:
+    """Восстанавливает номер, упакованный encode_phone"""
+    digits = "%0*d" % (11 if code & LONG_FLAG else 10, code >> FLAGS_SIZE)
+    return "+" + digits if code & PLUS_FLAG else digits
+
+
+class PhoneList(Sequence):
+    """
+    Список номеров телефонов, упакованных в массив 64-битных целых чисел.
+    Занимает 8 байт на номер вместо строки Python, номера проверяются один раз при добавлении
+    и преобразуются в строки только при обращении
+    """
+
+    def __init__(self, codes: Optional[array] = None):
+        self._codes = codes if codes is not None else array("Q")
+        self._smsc_chunks = {}
+
+    @classmethod
+    def from_phones(cls, phones: Iterable[str]) -> "PhoneList":
+        """Упаковывает номера, проверенные load_phones"""
+        return cls(array("Q", map(encode_phone, phones)))
+
+    def __len__(self) -> int:
+        return len(self._codes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return PhoneList(self._codes[index])
+        return decode_phone(self._codes[index])
+
+    def __iter__(self) -> Iterator[str]:
+        return map(decode_phone, self._codes)
+
+    def __eq__(self, other):
+        if isinstance(other, PhoneList):
+            return self._codes == other._codes
+        return NotImplemented
+
+    def __repr__(self):
+        return "PhoneList(%d phones)" % len(self)
+
+    @property
+    def nbytes(self) -> int:
+        """Размер массива номеров в байтах"""
+        return self._codes.itemsize * len(self._codes)
+
+    def to_smsc(self) -> str:
+        """Номера в формате параметра phones sms-сервиса"""
+        return ",".join(self)
+
+    def get_smsc_chunks(self, size: int) -> tuple[str, ...]:
+        """
+        Номера частями по size в формате параметра phones sms-сервиса. Строки собираются при первом вызове
+        и кэшируются: около 13 байт на номер, зато следующие рассылки по списку не декодируют номера заново
+        """
+        chunks = self._smsc_chunks.get(size)
+        if chunks is None:
+            rendered = []
+            for start in range(0, len(self._codes), size):
+                end = start + size
+                rendered.append(",".join(map(decode_phone, self._codes[start:end])))
+            chunks = self._smsc_chunks[size] = tuple(rendered)
+        return chunks
+
+    @cached_property
+    def digest(self) -> str:
+        """Отпечаток списка: sha256 упакованных номеров в порядке little-endian, не зависит от платформы"""
+        codes = self._codes
+        if sys.byteorder == "big":
+            codes = array("Q", codes)
+            codes.byteswap()
+        return hashlib.sha256(codes.tobytes()).hexdigest()
+
+
+def get_phones_digest(phones: Iterable[str]) -> str:
+    """
+    Отпечаток списка номеров: у списков с одинаковыми номерами в одинаковом порядке он совпадает.
+    По нему обработчик очереди проверяет, что рассылка создана по тому же списку, что загружен у него
+    """
+    if not isinstance(phones, PhoneList):
+        phones = PhoneList.from_phones(phones)
+    return phones.digest
+
+
+class PackedIntSet:
+    """
+    Множество целых чисел от 1 до 2**64 - 1 в массиве 64-битных ячеек с открытой адресацией.
+    Занимает от 12 до 24 байт на число вместо 60–80 байт у set из int Python, 0 отмечает свободную ячейку
+    """
+
+    def __init__(self, capacity_bits: int = 10):
+        self._resize(capacity_bits)
+        self._len = 0
+
+    def _resize(self, bits: int):
+        self._bits = bits
+        self._slots = array("Q", bytes(8 << bits))
+        self._shift = 64 - bits
+        self._mask = (1 << bits) - 1
+        # заполнение не больше 2/3, чтобы цепочки линейного пробирования оставались короткими
+        self._limit = (2 << bits) // 3
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __contains__(self, value: int) -> bool:
+        slots, mask = self._slots, self._mask
+        index = (value * HASH_MULTIPLIER & UINT64_MASK) >> self._shift
+        while slot := slots[index]:
+            if slot == value:
+                return True
+            index = (index + 1) & mask
+        return False
+
+    def add(self, value: int) -> bool:
+        """Добавляет число, возвращает False, если оно уже есть в множестве"""
+        slots, mask = self._slots, self._mask
+        index = (value * HASH_MULTIPLIER & UINT64_MASK) >> self._shift
+        while slot := slots[index]:
+            if slot == value:
+                return False
+            index = (index + 1) & mask
+
+        slots[index] = value
+        self._len += 1
+        if self._len > self._limit:
+            self._grow()
+        return True
+
+    def _grow(self):
+        old_slots = self._slots
+        self._resize(self._bits + 1)
+        slots, shift, mask = self._slots, self._shift, self._mask
+        for value in old_slots:
+            if value:
+                index = (value * HASH_MULTIPLIER & UINT64_MASK) >> shift
+                while slots[index]:
+                    index = (index + 1) & mask
+                slots[index] = value
+
+    @property
+    def nbytes(self) -> int:
+        """Размер массива ячеек в байтах"""
+        return self._slots.itemsize * len(self._slots)
+
+
+def get_phone_dedup_key(phone: str) -> int:
+    """
+    Ключ номера для поиска повторов: sms-сервис считает +7, 7 и 8 в начале номера и тот же номер
+    из 10 цифр одним абонентом. Номера с другим кодом страны остаются разными
+    """
+    digits = phone.lstrip("+")
+    if len(digits) == 10:
+        digits = "7" + digits
+    elif digits[0] == "8" and phone[0] != "+":
+        digits = "7" + digits[1:]
+    return int(digits)
+
+
+class InvalidPhone(NamedTuple):
+    """Некорректный номер и его позиция в файле, строки и столбцы нумеруются с 1"""
+
+    line: int
+    column: int
+    value: str
+
+
+@dataclass
+class PhonesReport:
+    """Итоги чтения списка номеров"""
+
+    loaded: int = 0
+    duplicates: int = 0
+    invalid_count: int = 0
+    invalid: list[InvalidPhone] = field(default_factory=list)
+
+    def add_invalid(self, phone: InvalidPhone):
+        """Учитывает некорректный номер, позиции запоминаются только для первых MAX_REPORTED_INVALID"""
+        self.invalid_count += 1
+        if len(self.invalid) < MAX_REPORTED_INVALID:
+            self.invalid.append(phone)
+
+
+def iter_phone_tokens(
+    fd: TextIO, block_size: int = DEFAULT_BLOCK_SIZE
+) -> Iterator[tuple[int, int, str]]:
+    """
+    Читает файл блоками по block_size символов и возвращает значения между разделителями
+    вместе с их позицией: (строка, столбец, значение). Пустые значения пропускаются.
+    Значение длиннее MAX_PHONE_LENGTH обрезается, чтобы файл без разделителей не читался в память целиком
+    """
+    line, line_start = 1, 0
+    offset = 0  # позиция начала data в файле
+    tail = ""
+    skip_tail = False
+
+    while True:
+        block = fd.read(block_size)
+        data = tail + block
+        position = 0
+        for delimiter in PHONE_DELIMITERS.finditer(data):
+            if skip_tail:
+                skip_tail = False
+            elif token := _get_token(
+                data, position, delimiter.start(), offset, line, line_start
+            ):
+                yield token
+
+            if delimiter.group() == "\n":
+                line += 1
+                line_start = offset + delimiter.end()
+            position = delimiter.end()
+
+        if not block:
+            if not skip_tail and (
+                token := _get_token(data, position, len(data), offset, line, line_start)
+            ):
+                yield token
+            return
+
+        tail = data[position:]
+        offset += position
+        if len(tail) > MAX_PHONE_LENGTH and not skip_tail:
+            yield _get_token(tail, 0, MAX_PHONE_LENGTH, offset, line, line_start)
+            skip_tail = True
+        if skip_tail:
+            offset += len(tail)
+            tail = ""
+
+
+def _get_token(data, start, end, offset, line, line_start):
+    token = data[start:end]
+    value = token.strip()
+    if not value:
+        return None
+    column = offset + start + token.index(value[0]) - line_start + 1
+    return line, column, value
+
+
+def load_phones(
+    fd: TextIO,
+    report: Optional[PhonesReport] = None,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+) -> Iterator[str]:
+    """
+    Лениво возвращает номера телефонов из файла в порядке следования, без повторов.
+    Номера разделяются ; | , или переводом строки, пробелы внутри номера удаляются.
+    Некорректные номера и повторы пропускаются и учитываются в report.
+    Результат можно передать в MailingSender.send без загрузки всего списка в память:
+    для поиска повторов хранятся только ключи номеров в PackedIntSet
+    """
+    report = report if report is not None else PhonesReport()
+    seen = PackedIntSet()
+
+    for line, column, value in iter_phone_tokens(fd, block_size):
+        phone = value
+        if not PHONE_PATTERN.fullmatch(phone):
+            phone = WHITESPACE.sub("", value)
+        if not PHONE_PATTERN.fullmatch(phone):
+            report.add_invalid(InvalidPhone(line, column, value[:MAX_PHONE_LENGTH]))
+            continue
+
+        if not seen.add(get_phone_dedup_key(phone)):
+            report.duplicates += 1
+            continue
+
+        report.loaded += 1
+        yield phone
@@ -0,0 +1,307 @@
+"""Опрос sms-сервиса о статусах доставки отправленных SMS"""
+
+import logging
+import time
+from typing import Optional
+
+import trio
+from asks.errors import AsksException
+
+from mchs_sms.metrics import POLL_CYCLE_SECONDS
+from mchs_sms.redis_client import RedisError
+from mchs_sms.smsc_api import (
+    STATUS_BATCH_SIZE,
+    SmscApiError,
+    chunked,
+    get_phone_key,
+    request_statuses,
+)
+
+logger = logging.getLogger("poller")
+
+DEFAULT_MAX_CONCURRENCY = 5
+DEFAULT_RATE_LIMIT = 10.0
+DEFAULT_REFRESH_INTERVAL = 10.0
+MIN_CHECK_DELAY = 10.0
+MAX_CHECK_DELAY = 15 * 60.0
+CHECK_BACKOFF = 0.5
+DEFAULT_REPORTS_FLUSH_INTERVAL = 0.5
+DEFAULT_REPORTS_BATCH_SIZE = 1000
+
+
+def convert_smsc_status(smsc_status: int) -> str:
+    """
+    Преобразует код статуса sms-сервиса в статус SMS в базе данных.
+    Документация по статусам https://smsc.ru/api/http/status_messages/statuses/#menu
+    """
+    if smsc_status in (1, 2, 4):
+        return "delivered"
+    if smsc_status in (-1, 0):
+        return "pending"
+    return "failed"
+
+
+def get_next_check_delay(age: float) -> float:
+    """
+    Через сколько секунд снова опросить статус SMS, которое не меняло статус age секунд.
+    Задержка растёт вместе с возрастом SMS, поэтому проверки идут с экспоненциальной отсрочкой:
+    свежие SMS опрашиваются часто, давно недоставленные — не чаще раза в MAX_CHECK_DELAY секунд
+    """
+    return min(max(age * CHECK_BACKOFF, MIN_CHECK_DELAY), MAX_CHECK_DELAY)
+
+
+class TokenBucket:
+    """Ограничитель частоты запросов: не более rate запросов в секунду, всплеск до capacity запросов"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError("Rate limit should be positive.")
+
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self._tokens = self.capacity
+        self._updated_at = None
+        self._lock = trio.Lock()
+
+    def _refill(self):
+        now = trio.current_time()
+        if self._updated_at is not None:
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated_at) * self.rate
+            )
+        self._updated_at = now
+
+    async def acquire(self):
+        """Дожидается разрешения на один запрос"""
+        async with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                await trio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+
+class StatusPoller:
+    """
+    Опрашивает sms-сервис о статусах SMS параллельно пачками по batch_size SMS в одном запросе:
+    не более max_concurrency одновременных запросов и не более rate_limit запросов в секунду
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        rate_limit: float = DEFAULT_RATE_LIMIT,
+        batch_size: int = STATUS_BATCH_SIZE,
+    ):
+        self.limiter = trio.CapacityLimiter(max_concurrency)
+        self.bucket = TokenBucket(rate_limit)
+        self.batch_size = batch_size
+
+    async def poll(
+        self,
+        pending_sms_list,
+        last_timestamps: Optional[dict] = None,
+        polled: Optional[set] = None,
+    ) -> list:
+        """
+        Принимает список пар (sms_id, phone), возвращает список статусов [sms_id, phone, status],
+        готовый для Database.update_sms_status_in_bulk.
+        В last_timestamps, если передан, записывается время последнего изменения статуса {(sms_id, phone): timestamp}.
+        В polled, если передано, добавляются пары из запросов, на которые sms-сервис ответил, в том числе пары,
+        для которых ответ содержит ошибку вместо статуса
+        """
+        statuses = []
+        async with trio.open_nursery() as nursery:
+            for sms_list_chunk in chunked(pending_sms_list, self.batch_size):
+                nursery.start_soon(
+                    self._poll_chunk, sms_list_chunk, statuses, last_timestamps, polled
+                )
+
+        return statuses
+
+    async def _poll_chunk(
+        self,
+        sms_list_chunk: list,
+        statuses: list,
+        last_timestamps: Optional[dict],
+        polled: Optional[set],
+    ):
+        async with self.limiter:
+            await self.bucket.acquire()
+            try:
+                sms_statuses = await request_statuses(sms_list_chunk)
+            except (OSError, AsksException, SmscApiError) as error:
+                logger.warning(
+                    "status request for %d sms failed: %r", len(sms_list_chunk), error
+                )
+                return
+
+        if polled is not None:
+            polled.update(sms_list_chunk)
+        statuses.extend(
+            [sms_id, phone, convert_smsc_status(sms_status["status"])]
+            for sms_id, phone, sms_status in sms_statuses
+            if "status" in sms_status
+        )
+        if last_timestamps is not None:
+            last_timestamps.update(
+                ((sms_id, phone), sms_status["last_timestamp"])
+                for sms_id, phone, sms_status in sms_statuses
+                if sms_status.get("last_timestamp")
+            )
+
+
+class StatusRefresher:
+    """
+    Фоновое обновление статусов: раз в interval секунд опрашивает sms-сервис о недоставленных SMS,
+    время проверки которых наступило, и сохраняет статусы в базу данных. Об изменениях база данных сообщает сама
+    через канал обновлений. SMS, оставшиеся недоставленными, откладываются на get_next_check_delay секунд
+    от их возраста: времени с отправки или с последнего изменения статуса по данным sms-сервиса
+    """
+
+    def __init__(
+        self,
+        db,
+        poller: StatusPoller,
+        interval: float = DEFAULT_REFRESH_INTERVAL,
+    ):
+        self.db = db
+        self.poller = poller
+        self.interval = interval
+
+    async def refresh(self) -> int:
+        """
+        Однократно обновляет статусы недоставленных SMS, время проверки которых наступило,
+        возвращает количество изменившихся.
+        SMS, срок жизни которых истёк, sms-сервис уже не доставит: они не опрашиваются и считаются неудачными
+        """
+        expired_count = await self.db.expire_pending_sms()
+        if expired_count:
+            logger.info("%d pending sms expired", expired_count)
+
+        now = time.time()
+        due_sms_list = await self.db.get_due_sms_list(now)
+        if not due_sms_list:
+            return expired_count
+
+        last_timestamps = {}
+        polled = set()
+        statuses = await self.poller.poll(
+            [(sms_id, phone) for sms_id, phone, _ in due_sms_list],
+            last_timestamps,
+            polled,
+        )
+        changed_count = await self.db.update_sms_status_in_bulk(statuses)
+
+        # SMS, запрос статуса которых не удался, опрашиваются при следующем обновлении. SMS, для которых
+        # sms-сервис ответил ошибкой или не вернул статус, откладываются так же, как недоставленные
+        finished = {
+            (sms_id, phone) for sms_id, phone, status in statuses if status != "pending"
+        }
+        sms_checks = {}
+        for sms_id, phone, sent_at in due_sms_list:
+            if (sms_id, phone) not in polled or (sms_id, phone) in finished:
+                continue
+            changed_at = max(last_timestamps.get((sms_id, phone), 0), sent_at or 0)
+            # время отправки старых SMS неизвестно, они опрашиваются как давно недоставленные
+            delay = (
+                get_next_check_delay(now - changed_at)
+                if changed_at
+                else MAX_CHECK_DELAY
+            )
+            sms_checks[sms_id, phone] = now + delay
+        await self.db.reschedule_sms_checks(sms_checks)
+
+        logger.debug(
+            "polled %d due sms, %d changed, %d rescheduled",
+            len(due_sms_list),
+            changed_count,
+            len(sms_checks),
+        )
+        return changed_count + expired_count
+
+    async def run(self):
+        """Обновляет статусы до отмены задачи"""
+        while True:
+            try:
+                with POLL_CYCLE_SECONDS.timer():
+                    await self.refresh()
+            except (OSError, AsksException, RedisError, SmscApiError):
+                logger.exception("status refresh failed")
+            await trio.sleep(self.interval)
+
+
+class StatusReportCollector:
+    """
+    Копит отчёты о статусах SMS, которые sms-сервис присылает на адрес обработчика статусов,
+    и сохраняет их в базу данных одним пакетом раз в flush_interval секунд или по накоплении batch_size отчётов.
+    SMS с окончательным статусом база данных убирает из расписания опроса, опрос остальных откладывается
+    на MAX_CHECK_DELAY секунд: опрос остаётся запасным способом на случай потерянного отчёта
+    """
+
+    def __init__(
+        self,
+        db,
+        flush_interval: float = DEFAULT_REPORTS_FLUSH_INTERVAL,
+        batch_size: int = DEFAULT_REPORTS_BATCH_SIZE,
+    ):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._reports = []
+        self._full = trio.Event()
+
+    def add(self, sms_id: str, phone: str, smsc_status: int):
+        """Добавляет отчёт о статусе SMS, не дожидаясь сохранения"""
+        self._reports.append((sms_id, phone, convert_smsc_status(smsc_status)))
+        if len(self._reports) >= self.batch_size:
+            self._full.set()
+
+    async def flush(self) -> int:
+        """
+        Сохраняет накопленные отчёты, возвращает количество изменившихся SMS.
+        Отчёты о SMS, которые уже не в статусе pending, пропускаются
+        """
+        reports, self._reports = self._reports, []
+        self._full = trio.Event()
+        if not reports:
+            return 0
+
+        sms_ids = list({sms_id for sms_id, _, _ in reports})
+        pending_phones_groups = await self.db.get_pending_phones(*sms_ids)
+        # в отчёте номер в формате sms-сервиса, в базе данных — в формате списка номеров
+        key2phone = {
+            (sms_id, get_phone_key(phone)): phone
+            for sms_id, pending_phones in zip(sms_ids, pending_phones_groups)
+            for phone in pending_phones
+        }
+        statuses = [
+            [sms_id, key2phone[sms_id, get_phone_key(phone)], status]
+            for sms_id, phone, status in reports
+            if (sms_id, get_phone_key(phone)) in key2phone
+        ]
+
+        changed_count = await self.db.update_sms_status_in_bulk(statuses)
+        check_at = time.time() + MAX_CHECK_DELAY
+        await self.db.reschedule_sms_checks(
+            {
+                (sms_id, phone): check_at
+                for sms_id, phone, status in statuses
+                if status == "pending"
+            }
+        )
+        logger.debug(
+            "saved %d status reports, %d sms changed", len(reports), changed_count
+        )
+        return changed_count
+
+    async def run(self):
+        """Сохраняет отчёты до отмены задачи"""
+        while True:
+            with trio.move_on_after(self.flush_interval):
+                await self._full.wait()
+            try:
+                await self.flush()
+            except (OSError, RedisError):
+                # статусы SMS из потерянных отчётов будут получены опросом
+                logger.exception("status reports flush failed")
@@ -0,0 +1,847 @@
+"""
+Клиент Redis на trio: протокол RESP2 поверх trio.SocketStream с пулом соединений.
+Реализует те команды aioredis 2 с decode_responses=True, которыми пользуется Database, с теми же сигнатурами
+и разбором ответов, поэтому вызовы Database не проходят через цикл asyncio
+"""
+
+import hashlib
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from typing import Optional
+from urllib.parse import parse_qs, unquote, urlparse
+
+import trio
+
+DEFAULT_PORT = 6379
+DEFAULT_MAX_CONNECTIONS = 50
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_TIMEOUT = 10.0
+READ_SIZE = 64 * 1024
+SCAN_COUNT = 1000
+
+_NOT_ENOUGH = object()
+_ARRAY_STARTED = object()
+
+
+class RedisError(Exception):
+    pass
+
+
+class ResponseError(RedisError):
+    """Ошибка, которую вернул сервер Redis в ответ на команду"""
+
+
+class NoScriptError(ResponseError):
+    pass
+
+
+def _encode(value) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode()
+    if isinstance(value, float):
+        return repr(value).encode()
+    if isinstance(value, (int, bool)):
+        return str(int(value)).encode()
+    raise RedisError(f"Invalid argument type {type(value).__name__}: {value!r}")
+
+
+def pack_command(*args) -> bytes:
+    """Команда в формате RESP: массив строк"""
+    encoded = [_encode(arg) for arg in args]
+    parts = [b"*%d\r\n" % len(encoded)]
+    for arg in encoded:
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+class ReplyParser:
+    """
+    Разбирает ответы RESP2 из накопленных данных. Разбор вложенных массивов продолжается с места остановки,
+    поэтому большой ответ, пришедший многими частями, разбирается один раз
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._pos = 0
+        self._arrays = []  # незаполненные массивы: элементы и их ожидаемое количество
+
+    def feed(self, data: bytes):
+        self._buffer += data
+
+    def get_reply(self):
+        """Очередной ответ или _NOT_ENOUGH, если ответ пришёл не целиком"""
+        arrays = self._arrays
+        while True:
+            line_end = self._buffer.find(b"\r\n", self._pos)
+            if line_end < 0:
+                return _NOT_ENOUGH
+            value = self._parse_value(line_end)
+            if value is _NOT_ENOUGH:
+                return _NOT_ENOUGH
+            if value is _ARRAY_STARTED:
+                continue
+
+            # значение дописывается в незаполненные массивы, заполненный массив — в объемлющий
+            while arrays:
+                items, length = arrays[-1]
+                items.append(value)
+                if len(items) < length:
+                    break
+                arrays.pop()
+                value = items
+            else:
+                parsed_size, self._pos = self._pos, 0
+                del self._buffer[:parsed_size]
+                return value
+
+    def _parse_value(self, line_end: int):
+        """
+        Разбирает значение, строка заголовка которого заканчивается в line_end. Для непустого массива возвращает
+        _ARRAY_STARTED: его элементы разбираются следующими значениями
+        """
+        buffer = self._buffer
+        prefix = buffer[self._pos]
+        line_start = self._pos + 1
+
+        if prefix == 36:  # $
+            return self._parse_bulk_string(int(buffer[line_start:line_end]), line_end)
+        self._pos = line_end + 2
+        if prefix == 42:  # *
+            length = int(buffer[line_start:line_end])
+            if length > 0:
+                self._arrays.append(([], length))
+                return _ARRAY_STARTED
+            return [] if length == 0 else None
+        if prefix == 58:  # :
+            return int(buffer[line_start:line_end])
+        if prefix == 43:  # +
+            return buffer[line_start:line_end].decode()
+        if prefix == 45:  # -
+            message = buffer[line_start:line_end].decode()
+            if message.startswith("NOSCRIPT"):
+                return NoScriptError(message)
+            return ResponseError(message)
+        raise RedisError(f"Protocol error, got {chr(prefix)!r} as reply type")
+
+    def _parse_bulk_string(self, length: int, line_end: int):
+        value_start = line_end + 2
+        if length < 0:
+            self._pos = value_start
+            return None
+        value_end = value_start + length
+        if len(self._buffer) < value_end + 2:
+            return _NOT_ENOUGH
+        self._pos = value_end + 2
+        return self._buffer[value_start:value_end].decode()
+
+
+def _no_limit(timeout: Optional[float]) -> float:
+    return float("inf") if timeout is None else timeout
+
+
+class Connection:
+    """Соединение с Redis. Команды отправляются и ответы читаются по порядку, без одновременного использования"""
+
+    def __init__(
+        self, stream: trio.SocketStream, timeout: Optional[float] = DEFAULT_TIMEOUT
+    ):
+        self.stream = stream
+        self.timeout = timeout
+        self._parser = ReplyParser()
+
+    @classmethod
+    async def connect(
+        cls,
+        host: str,
+        port: int,
+        db: int = 0,
+        password: Optional[str] = None,
+        username: Optional[str] = None,
+        path: Optional[str] = None,
+        connect_timeout: Optional[float] = DEFAULT_CONNECT_TIMEOUT,
+        timeout: Optional[float] = DEFAULT_TIMEOUT,
+    ) -> "Connection":
+        """
+        Соединение по TCP или, если указан path, через unix-сокет. С username вход выполняется по ACL Redis 6.
+        Если соединение не установлено за connect_timeout секунд, выбрасывается TimeoutError
+        """
+        try:
+            with trio.fail_after(_no_limit(connect_timeout)):
+                if path:
+                    stream = await trio.open_unix_socket(path)
+                else:
+                    stream = await trio.open_tcp_stream(host, port)
+        except trio.TooSlowError as error:
+            raise TimeoutError("Timeout connecting to Redis.") from error
+        connection = cls(stream, timeout)
+        try:
+            if password:
+                credentials = (username, password) if username else (password,)
+                await connection.execute_checked(pack_command("AUTH", *credentials))
+            if db:
+                await connection.execute_checked(pack_command("SELECT", db))
+        except BaseException:
+            await connection.aclose()
+            raise
+        return connection
+
+    async def execute(
+        self, packed_commands: bytes, replies_count: int, blocking_timeout: float = 0
+    ) -> list:
+        """
+        Отправляет команды одним пакетом и возвращает ответы, ошибки Redis возвращаются как исключения.
+        Если ответы не получены за timeout секунд, выбрасывается TimeoutError. Блокирующим командам
+        к timeout добавляется время ожидания blocking_timeout
+        """
+        timeout = None if self.timeout is None else self.timeout + blocking_timeout
+        try:
+            with trio.fail_after(_no_limit(timeout)):
+                await self.stream.send_all(packed_commands)
+                return [await self.read_reply() for _ in range(replies_count)]
+        except trio.BrokenResourceError as error:
+            raise ConnectionError("Connection to Redis lost.") from error
+        except trio.TooSlowError as error:
+            raise TimeoutError("Timeout reading from Redis.") from error
+
+    async def execute_checked(self, packed_command: bytes):
+        """Выполняет одну команду, ошибка Redis выбрасывается исключением"""
+        [reply] = await self.execute(packed_command, 1)
+        if isinstance(reply, ResponseError):
+            raise reply
+        return reply
+
+    async def read_reply(self):
+        reply = self._parser.get_reply()
+        while reply is _NOT_ENOUGH:
+            data = await self.stream.receive_some(READ_SIZE)
+            if not data:
+                raise ConnectionError("Connection closed by Redis server.")
+            self._parser.feed(data)
+            reply = self._parser.get_reply()
+        return reply
+
+    async def aclose(self):
+        await trio.aclose_forcefully(self.stream)
+
+
+class ConnectionPool:
+    """
+    Пул соединений: не больше max_connections соединений одновременно, остальные запросы ждут свободного.
+    Соединение, на котором запрос прервался ошибкой, отменой или истечением timeout, закрывается, так как в нём
+    могут остаться непрочитанные ответы. timeout и connect_timeout None — ждать без ограничения
+    """
+
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: int = DEFAULT_PORT,
+        db: int = 0,
+        password: Optional[str] = None,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        username: Optional[str] = None,
+        path: Optional[str] = None,
+        connect_timeout: Optional[float] = DEFAULT_CONNECT_TIMEOUT,
+        timeout: Optional[float] = DEFAULT_TIMEOUT,
+    ):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.username = username
+        self.path = path
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._limiter = trio.Semaphore(max_connections)
+        self._idle = []
+
+    async def connect(self) -> Connection:
+        return await Connection.connect(
+            self.host,
+            self.port,
+            self.db,
+            self.password,
+            self.username,
+            self.path,
+            self.connect_timeout,
+            self.timeout,
+        )
+
+    @asynccontextmanager
+    async def connection(self):
+        async with self._limiter:
+            connection = self._idle.pop() if self._idle else await self.connect()
+            try:
+                yield connection
+            except BaseException:
+                await connection.aclose()
+                raise
+            self._idle.append(connection)
+
+    async def disconnect(self):
+        idle, self._idle = self._idle, []
+        for connection in idle:
+            await connection.aclose()
+
+
+def _pairs_to_dict(response) -> dict:
+    if response is None:
+        return {}
+    it = iter(response)
+    return dict(zip(it, it))
+
+
+def _score_pairs(response) -> list:
+    it = iter(response)
+    return list(zip(it, map(float, it)))
+
+
+def _float_or_none(response) -> Optional[float]:
+    return None if response is None else float(response)
+
+
+def _bool_ok(response) -> bool:
+    return response == "OK"
+
+
+def _parse_stream_list(response) -> Optional[list]:
+    if response is None:
+        return None
+    return [
+        (entry[0], _pairs_to_dict(entry[1])) if entry is not None else (None, None)
+        for entry in response
+    ]
+
+
+def _parse_xread(response) -> list:
+    if response is None:
+        return []
+    return [[stream[0], _parse_stream_list(stream[1])] for stream in response]
+
+
+def _parse_xautoclaim(response) -> tuple:
+    """Курсор следующего вызова и забранные записи. Удалённые из потока записи Redis 6.2 возвращает как nil"""
+    return response[0], _parse_stream_list(response[1])
+
+
+def _parse_xpending_range(response) -> list:
+    fields = ("message_id", "consumer", "time_since_delivered", "times_delivered")
+    return [dict(zip(fields, entry)) for entry in response]
+
+
+def _parse_info_value(value: str):
+    if "," not in value or "=" not in value:
+        try:
+            return float(value) if "." in value else int(value)
+        except ValueError:
+            return value
+    return dict(
+        (key, _parse_info_value(item_value))
+        for key, item_value in (item.rsplit("=", 1) for item in value.split(","))
+    )
+
+
+def _parse_info(response) -> dict:
+    info = {}
+    for line in response.splitlines():
+        if line and not line.startswith("#"):
+            if ":" in line:
+                key, value = line.split(":", 1)
+                info[key] = _parse_info_value(value)
+            else:
+                info.setdefault("__raw__", []).append(line)
+    return info
+
+
+def _zset_options(withscores: bool):
+    return ("WITHSCORES",) if withscores else ()
+
+
+class Commands(ABC):
+    """
+    Команды Redis с разбором ответов. Клиент выполняет команду сразу, конвейер копит команды до execute,
+    поэтому методы возвращают то же, что execute_command
+    """
+
+    @abstractmethod
+    def execute_command(self, *args, parse=None, blocking_timeout: float = 0):
+        """
+        Выполняет команду args, ответ разбирается функцией parse. blocking_timeout — время в секундах,
+        на которое команда может заблокировать соединение
+        """
+
+    # строки и ключи
+
+    def get(self, name):
+        return self.execute_command("GET", name)
+
+    def set(self, name, value, ex: Optional[int] = None):
+        args = ("EX", ex) if ex else ()
+        return self.execute_command("SET", name, value, *args, parse=_bool_ok)
+
+    def delete(self, *names):
+        return self.execute_command("DEL", *names)
+
+    def expire(self, name, time: int):
+        return self.execute_command("EXPIRE", name, time, parse=bool)
+
+    def memory_usage(self, key, samples: Optional[int] = None):
+        args = ("SAMPLES", samples) if samples is not None else ()
+        return self.execute_command("MEMORY", "USAGE", key, *args)
+
+    def object(self, infotype: str, key):
+        return self.execute_command("OBJECT", infotype, key)
+
+    def flushdb(self):
+        return self.execute_command("FLUSHDB", parse=_bool_ok)
+
+    def info(self, section: Optional[str] = None):
+        args = (section,) if section else ()
+        return self.execute_command("INFO", *args, parse=_parse_info)
+
+    def publish(self, channel, message):
+        return self.execute_command("PUBLISH", channel, message)
+
+    # хэши
+
+    def hset(self, name, key=None, value=None, mapping: Optional[dict] = None):
+        items = [key, value] if key is not None else []
+        for item in (mapping or {}).items():
+            items.extend(item)
+        return self.execute_command("HSET", name, *items)
+
+    def hsetnx(self, name, key, value):
+        return self.execute_command("HSETNX", name, key, value, parse=bool)
+
+    def hget(self, name, key):
+        return self.execute_command("HGET", name, key)
+
+    def hmget(self, name, *keys):
+        return self.execute_command("HMGET", name, *keys)
+
+    def hgetall(self, name):
+        return self.execute_command("HGETALL", name, parse=_pairs_to_dict)
+
+    def hincrby(self, name, key, amount: int = 1):
+        return self.execute_command("HINCRBY", name, key, amount)
+
+    def hdel(self, name, *keys):
+        return self.execute_command("HDEL", name, *keys)
+
+    # множества
+
+    def sadd(self, name, *values):
+        return self.execute_command("SADD", name, *values)
+
+    def srem(self, name, *values):
+        return self.execute_command("SREM", name, *values)
+
+    def smembers(self, name):
+        return self.execute_command("SMEMBERS", name, parse=set)
+
+    # упорядоченные множества
+
+    def zadd(self, name, mapping: dict, nx: bool = False, xx: bool = False):
+        if nx and xx:
+            raise RedisError("ZADD allows either 'nx' or 'xx', not both")
+        args = ("NX",) if nx else ("XX",) if xx else ()
+        items = []
+        for member, score in mapping.items():
+            items.extend((score, member))
+        return self.execute_command("ZADD", name, *args, *items)
+
+    def zrem(self, name, *values):
+        return self.execute_command("ZREM", name, *values)
+
+    def zcard(self, name):
+        return self.execute_command("ZCARD", name)
+
+    def zcount(self, name, min, max):
+        return self.execute_command("ZCOUNT", name, min, max)
+
+    def zscore(self, name, value):
+        return self.execute_command("ZSCORE", name, value, parse=_float_or_none)
+
+    def zrevrank(self, name, value):
+        return self.execute_command("ZREVRANK", name, value)
+
+    def zrange(self, name, start: int, end: int, withscores: bool = False):
+        return self.execute_command(
+            "ZRANGE",
+            name,
+            start,
+            end,
+            *_zset_options(withscores),
+            parse=_score_pairs if withscores else None,
+        )
+
+    def zrevrange(self, name, start: int, end: int, withscores: bool = False):
+        return self.execute_command(
+            "ZREVRANGE",
+            name,
+            start,
+            end,
+            *_zset_options(withscores),
+            parse=_score_pairs if withscores else None,
+        )
+
+    def zrangebyscore(
+        self,
+        name,
+        min,
+        max,
+        start: Optional[int] = None,
+        num: Optional[int] = None,
+        withscores: bool = False,
+    ):
+        if (start is None) != (num is None):
+            raise RedisError("``start`` and ``num`` must both be specified")
+        args = ("LIMIT", start, num) if start is not None else ()
+        return self.execute_command(
+            "ZRANGEBYSCORE",
+            name,
+            min,
+            max,
+            *args,
+            *_zset_options(withscores),
+            parse=_score_pairs if withscores else None,
+        )
+
+    # потоки
+
+    def xadd(self, name, fields: dict, id="*"):
+        items = []
+        for item in fields.items():
+            items.extend(item)
+        return self.execute_command("XADD", name, id, *items)
+
+    def xack(self, name, groupname, *ids):
+        return self.execute_command("XACK", name, groupname, *ids)
+
+    def xdel(self, name, *ids):
+        return self.execute_command("XDEL", name, *ids)
+
+    def xgroup_create(self, name, groupname, id="$", mkstream: bool = False):
+        args = ("MKSTREAM",) if mkstream else ()
+        return self.execute_command(
+            "XGROUP", "CREATE", name, groupname, id, *args, parse=_bool_ok
+        )
+
+    def xreadgroup(
+        self,
+        groupname,
+        consumername,
+        streams: dict,
+        count: Optional[int] = None,
+        block: Optional[int] = None,
+        noack: bool = False,
+    ):
+        args = ["GROUP", groupname, consumername]
+        if count is not None:
+            args.extend(("COUNT", count))
+        if block is not None:
+            args.extend(("BLOCK", block))
+        if noack:
+            args.append("NOACK")
+        args.extend(("STREAMS", *streams.keys(), *streams.values()))
+        return self.execute_command(
+            "XREADGROUP",
+            *args,
+            parse=_parse_xread,
+            blocking_timeout=(block or 0) / 1000,
+        )
+
+    def xpending_range(self, name, groupname, min, max, count: int):
+        return self.execute_command(
+            "XPENDING", name, groupname, min, max, count, parse=_parse_xpending_range
+        )
+
+    def xautoclaim(
+        self,
+        name,
+        groupname,
+        consumername,
+        min_idle_time: int,
+        start_id="0-0",
+        count: Optional[int] = None,
+    ):
+        args = ("COUNT", count) if count is not None else ()
+        return self.execute_command(
+            "XAUTOCLAIM",
+            name,
+            groupname,
+            consumername,
+            min_idle_time,
+            start_id,
+            *args,
+            parse=_parse_xautoclaim,
+        )
+
+    def xclaim(
+        self,
+        name,
+        groupname,
+        consumername,
+        min_idle_time: int,
+        message_ids: list,
+        justid: bool = False,
+    ):
+        args = ("JUSTID",) if justid else ()
+        return self.execute_command(
+            "XCLAIM",
+            name,
+            groupname,
+            consumername,
+            min_idle_time,
+            *message_ids,
+            *args,
+            parse=None if justid else _parse_stream_list,
+        )
+
+
+class Redis(Commands):
+    """Клиент Redis: каждая команда выполняется на свободном соединении пула"""
+
+    def __init__(self, connection_pool: ConnectionPool):
+        self.connection_pool = connection_pool
+
+    async def execute_command(self, *args, parse=None, blocking_timeout: float = 0):
+        async with self.connection_pool.connection() as connection:
+            [reply] = await connection.execute(pack_command(*args), 1, blocking_timeout)
+        if isinstance(reply, ResponseError):
+            raise reply
+        return parse(reply) if parse else reply
+
+    def pipeline(self, transaction: bool = False) -> "Pipeline":
+        return Pipeline(self.connection_pool, transaction)
+
+    def register_script(self, script: str) -> "Script":
+        return Script(self, script)
+
+    def pubsub(self, ignore_subscribe_messages: bool = False) -> "PubSub":
+        return PubSub(self.connection_pool, ignore_subscribe_messages)
+
+    async def scan_iter(self, match: Optional[str] = None, count: int = SCAN_COUNT):
+        args = ("MATCH", match) if match else ()
+        cursor = "0"
+        while True:
+            cursor, keys = await self.execute_command(
+                "SCAN", cursor, *args, "COUNT", count
+            )
+            for key in keys:
+                yield key
+            if cursor == "0":
+                return
+
+    async def hscan_iter(
+        self, name, match: Optional[str] = None, count: int = SCAN_COUNT
+    ):
+        args = ("MATCH", match) if match else ()
+        cursor = "0"
+        while True:
+            cursor, items = await self.execute_command(
+                "HSCAN", name, cursor, *args, "COUNT", count
+            )
+            for item in _pairs_to_dict(items).items():
+                yield item
+            if cursor == "0":
+                return
+
+    async def zscan_iter(
+        self, name, match: Optional[str] = None, count: int = SCAN_COUNT
+    ):
+        args = ("MATCH", match) if match else ()
+        cursor = "0"
+        while True:
+            cursor, items = await self.execute_command(
+                "ZSCAN", name, cursor, *args, "COUNT", count
+            )
+            for item in _score_pairs(items):
+                yield item
+            if cursor == "0":
+                return
+
+    async def close(self):
+        await self.connection_pool.disconnect()
+
+
+class Pipeline(Commands):
+    """
+    Конвейер: команды отправляются одним пакетом при execute, с transaction=True — внутри MULTI/EXEC.
+    Первая ошибка Redis среди ответов выбрасывается исключением
+    """
+
+    def __init__(self, connection_pool: ConnectionPool, transaction: bool = False):
+        self.connection_pool = connection_pool
+        self.transaction = transaction
+        self._commands = []
+
+    def execute_command(self, *args, parse=None, blocking_timeout: float = 0):
+        self._commands.append((args, parse, blocking_timeout))
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._commands = []
+
+    async def execute(self) -> list:
+        commands, self._commands = self._commands, []
+        if not commands:
+            return []
+
+        packed_commands = [pack_command(*args) for args, _, _ in commands]
+        if self.transaction:
+            packed_commands = [
+                pack_command("MULTI"),
+                *packed_commands,
+                pack_command("EXEC"),
+            ]
+        blocking_timeout = sum(timeout for _, _, timeout in commands)
+        async with self.connection_pool.connection() as connection:
+            replies = await connection.execute(
+                b"".join(packed_commands), len(packed_commands), blocking_timeout
+            )
+
+        if self.transaction:
+            *queued_replies, replies = replies[1:]
+            if isinstance(replies, ResponseError):
+                # транзакция отменена, причина — в ответе на постановку команды в очередь
+                raise next(
+                    (
+                        reply
+                        for reply in queued_replies
+                        if isinstance(reply, ResponseError)
+                    ),
+                    replies,
+                )
+
+        results = []
+        for reply, (_, parse, _) in zip(replies, commands):
+            if isinstance(reply, ResponseError):
+                raise reply
+            results.append(parse(reply) if parse else reply)
+        return results
+
+
+class Script:
+    """Скрипт Lua: выполняется по SHA1 через EVALSHA, при первом вызове на сервере загружается через EVAL"""
+
+    def __init__(self, client: Redis, script: str):
+        self.client = client
+        self.script = script
+        self.sha = hashlib.sha1(script.encode()).hexdigest()
+
+    async def __call__(self, keys: list = (), args: list = ()):
+        try:
+            return await self.client.execute_command(
+                "EVALSHA", self.sha, len(keys), *keys, *args
+            )
+        except NoScriptError:
+            return await self.client.execute_command(
+                "EVAL", self.script, len(keys), *keys, *args
+            )
+
+    async def execute_many(self, calls: list) -> list:
+        """
+        Выполняет скрипт для каждой пары (keys, args) из calls одной транзакцией MULTI/EXEC за один запрос.
+        Если скрипта нет на сервере, ни один вызов транзакции не выполнен: скрипт загружается и транзакция повторяется
+        """
+        try:
+            return await self._execute_many(calls)
+        except NoScriptError:
+            await self.client.execute_command("SCRIPT", "LOAD", self.script)
+            return await self._execute_many(calls)
+
+    async def _execute_many(self, calls: list) -> list:
+        pipe = self.client.pipeline(transaction=True)
+        for keys, args in calls:
+            pipe.execute_command("EVALSHA", self.sha, len(keys), *keys, *args)
+        return await pipe.execute()
+
+
+class PubSub:
+    """Подписка на каналы на отдельном соединении, которое не возвращается в пул"""
+
+    def __init__(
+        self, connection_pool: ConnectionPool, ignore_subscribe_messages: bool = False
+    ):
+        self.connection_pool = connection_pool
+        self.ignore_subscribe_messages = ignore_subscribe_messages
+        self.connection = None
+
+    async def subscribe(self, *channels):
+        if self.connection is None:
+            self.connection = await self.connection_pool.connect()
+        try:
+            await self.connection.stream.send_all(pack_command("SUBSCRIBE", *channels))
+        except trio.BrokenResourceError as error:
+            raise ConnectionError("Connection to Redis lost.") from error
+
+    async def get_message(self) -> Optional[dict]:
+        """Очередное сообщение, None для пропускаемых подтверждений подписки"""
+        reply = await self.connection.read_reply()
+        if isinstance(reply, ResponseError):
+            raise reply
+        message_type, channel, data = reply[0], reply[-2], reply[-1]
+        if self.ignore_subscribe_messages and message_type.endswith("subscribe"):
+            return None
+        pattern = reply[1] if message_type == "pmessage" else None
+        return {
+            "type": message_type,
+            "pattern": pattern,
+            "channel": channel,
+            "data": data,
+        }
+
+    async def listen(self):
+        while True:
+            message = await self.get_message()
+            if message is not None:
+                yield message
+
+    async def reset(self):
+        if self.connection is not None:
+            connection, self.connection = self.connection, None
+            await connection.aclose()
+
+
+def from_url(
+    url: str,
+    max_connections: int = DEFAULT_MAX_CONNECTIONS,
+    timeout: Optional[float] = DEFAULT_TIMEOUT,
+    connect_timeout: Optional[float] = DEFAULT_CONNECT_TIMEOUT,
+) -> Redis:
+    """
+    Клиент по адресу вида redis://[[username]:password@]host[:port][/db]
+    или unix://[[username]:password@]/path/to/redis.sock[?db=db], ответы всегда декодируются в строки.
+    TLS (rediss://) не поддерживается. Таймауты ответа и подключения — в секундах, None — без ограничения
+    """
+    parsed = urlparse(url)
+    if parsed.scheme == "rediss":
+        raise ValueError(f"TLS connections to Redis are not supported: {url}")
+    if parsed.scheme not in ("redis", "unix"):
+        raise ValueError(f"Unsupported Redis URL scheme {parsed.scheme!r}: {url}")
+    if parsed.username and not parsed.password:
+        raise ValueError(f"Redis URL has username without password: {url}")
+
+    if parsed.scheme == "unix":
+        path, db = parsed.path, parse_qs(parsed.query).get("db", [""])[0]
+    else:
+        path, db = None, parsed.path.lstrip("/")
+    return Redis(
+        ConnectionPool(
+            host=parsed.hostname or "localhost",
+            port=parsed.port or DEFAULT_PORT,
+            db=int(db) if db else 0,
+            password=unquote(parsed.password) if parsed.password else None,
+            max_connections=max_connections,
+            username=unquote(parsed.username) if parsed.username else None,
+            path=path,
+            connect_timeout=connect_timeout,
+            timeout=timeout,
+        )
+    )
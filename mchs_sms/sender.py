@@ -0,0 +1,356 @@
+"""Отправка больших рассылок частями"""
+
+import logging
+import math
+import uuid
+from dataclasses import dataclass
+from typing import Iterable, Optional, Sequence
+
+import trio
+from asks.errors import AsksException
+
+from mchs_sms.phones import PhoneList, get_phones_digest
+from mchs_sms.redis_client import RedisError
+from mchs_sms.smsc_api import (
+    HttpMethod,
+    Message,
+    RETRYABLE_ERROR_CODES,
+    RETRYABLE_ERRORS,
+    SEND_URL,
+    SmscApiError,
+    SmscResponse,
+    SmscRetryableError,
+    SmscUnavailableError,
+    chunked,
+    request_smsc,
+)
+
+logger = logging.getLogger("sender")
+
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_SEND_CONCURRENCY = 3
+DEFAULT_STALE_TIMEOUT = 60.0
+READ_TIMEOUT = 5.0
+DEFAULT_ERROR_DELAY = 1.0
+MAX_ERROR_DELAY = 60.0
+
+# ошибки Redis и sms-сервиса, после которых обработчик очереди продолжает работу
+WORKER_ERRORS = (OSError, AsksException, trio.TooSlowError, RedisError, SmscApiError)
+# временные ошибки sms-сервиса: часть рассылки не записывается неудачной и отправляется при повторе задания
+TRANSIENT_SEND_ERRORS = (*RETRYABLE_ERRORS, SmscRetryableError, SmscUnavailableError)
+
+
+class MailingPostponedError(SmscApiError):
+    """Части рассылки не отправлены из-за временной ошибки sms-сервиса, задание остаётся в очереди"""
+
+
+def get_smsc_chunks(phones: Iterable[str], size: int) -> Iterable[str]:
+    """Номера частями по size в формате параметра phones sms-сервиса, у PhoneList части кэшируются"""
+    if isinstance(phones, PhoneList):
+        return phones.get_smsc_chunks(size)
+    return (",".join(chunk) for chunk in chunked(phones, size))
+
+
+@dataclass
+class MailingProgress:
+    """Прогресс отправки рассылки"""
+
+    sms_id: str
+    chunks_count: int
+    chunk_size: int
+    chunks_sent: int = 0
+    chunks_failed: int = 0
+    chunks_postponed: int = 0
+    phones_sent: int = 0
+
+    @property
+    def is_finished(self) -> bool:
+        return self.chunks_sent + self.chunks_failed >= self.chunks_count
+
+
+class MailingSender:
+    """
+    Отправляет рассылку в sms-сервис частями по chunk_size номеров, не более concurrency частей одновременно.
+    Все части регистрируются в базе данных под одной рассылкой, id SMSC каждой части сохраняется для опроса статусов.
+    Ошибка отправки одной части не прерывает отправку остальных. Часть, которую sms-сервис отклонил, записывается
+    неудачной; часть, не отправленная из-за временной ошибки, не записывается и может быть отправлена повторно
+    """
+
+    def __init__(
+        self,
+        db,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        concurrency: int = DEFAULT_SEND_CONCURRENCY,
+    ):
+        self.db = db
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+
+    async def create_mailing(self, phones_count: int, text: str) -> MailingProgress:
+        """Регистрирует новую рассылку в базе данных до начала отправки"""
+        sms_id = uuid.uuid4().hex
+        chunks_count = math.ceil(phones_count / self.chunk_size)
+
+        await self.db.create_sms_mailing(sms_id, text, phones_count, chunks_count)
+        return MailingProgress(
+            sms_id=sms_id, chunks_count=chunks_count, chunk_size=self.chunk_size
+        )
+
+    async def enqueue_mailing(
+        self, phones: Sequence[str], text: str, valid: int
+    ) -> MailingProgress:
+        """
+        Регистрирует новую рассылку по списку phones и ставит её в очередь на отправку обработчикам MailingWorker.
+        В задание записывается отпечаток списка: обработчик с другим списком номеров рассылку не отправит
+        """
+        progress = await self.create_mailing(len(phones), text)
+        await self.db.enqueue_sms_mailing_job(
+            progress.sms_id,
+            text=text,
+            valid=valid,
+            phones_count=len(phones),
+            phones_digest=get_phones_digest(phones),
+            chunk_size=progress.chunk_size,
+        )
+        return progress
+
+    async def send(
+        self,
+        progress: MailingProgress,
+        phones: Iterable[str],
+        text: str,
+        valid: int,
+        done_chunks: Optional[set] = None,
+    ) -> MailingProgress:
+        """
+        Отправляет части рассылки, зарегистрированной через create_mailing, и обновляет progress.
+        Части с индексами из done_chunks уже были отправлены ранее и пропускаются
+        """
+        done_chunks = done_chunks or set()
+        semaphore = trio.Semaphore(self.concurrency)
+        async with trio.open_nursery() as nursery:
+            for chunk_index, chunk in enumerate(
+                get_smsc_chunks(phones, progress.chunk_size)
+            ):
+                if chunk_index in done_chunks:
+                    continue
+
+                await semaphore.acquire()
+                nursery.start_soon(
+                    self._send_chunk,
+                    progress,
+                    chunk_index,
+                    chunk,
+                    text,
+                    valid,
+                    semaphore,
+                )
+
+        logger.info(
+            "mailing %s finished: %d chunks sent, %d failed, %d postponed",
+            progress.sms_id,
+            progress.chunks_sent,
+            progress.chunks_failed,
+            progress.chunks_postponed,
+        )
+        return progress
+
+    async def _send_chunk(
+        self,
+        progress: MailingProgress,
+        chunk_index: int,
+        smsc_phones: str,
+        text: str,
+        valid: int,
+        semaphore: trio.Semaphore,
+    ):
+        try:
+            phones = smsc_phones.split(",")
+            try:
+                response = await self._request_send(smsc_phones, text, valid)
+            except TRANSIENT_SEND_ERRORS:
+                logger.exception(
+                    "mailing %s: chunk of %d phones postponed",
+                    progress.sms_id,
+                    len(phones),
+                )
+                progress.chunks_postponed += 1
+                return
+            except SmscApiError:
+                logger.exception(
+                    "mailing %s: chunk of %d phones failed",
+                    progress.sms_id,
+                    len(phones),
+                )
+                await self.db.add_failed_sms_mailing_chunk(
+                    progress.sms_id, len(phones), chunk_index
+                )
+                progress.chunks_failed += 1
+                return
+
+            await self.db.add_sms_mailing_chunk(
+                progress.sms_id, response.content["id"], phones, chunk_index, valid
+            )
+            progress.chunks_sent += 1
+            progress.phones_sent += len(phones)
+            logger.info(
+                "mailing %s: %d of %d chunks sent",
+                progress.sms_id,
+                progress.chunks_sent,
+                progress.chunks_count,
+            )
+        finally:
+            semaphore.release()
+
+    async def _request_send(
+        self, smsc_phones: str, text: str, valid: int
+    ) -> SmscResponse:
+        """Запрос на отправку части рассылки, отказ sms-сервиса — SmscApiError"""
+        message = Message(phones=smsc_phones, mes=text, valid=valid)
+        response = await request_smsc(
+            HttpMethod.post, SEND_URL, payload=message.as_payload()
+        )
+        if response.status_code == 200 and "error_code" not in response.content:
+            return response
+
+        error_class = (
+            SmscRetryableError
+            if response.content.get("error_code") in RETRYABLE_ERROR_CODES
+            else SmscApiError
+        )
+        raise error_class(
+            "Ошибка отправки sms: ответ %s, статус ответа %d"
+            % (response.content, response.status_code)
+        )
+
+
+class MailingWorker:
+    """
+    Забирает задания на отправку рассылок из очереди Redis и отправляет их через MailingSender.
+    Задание подтверждается только после отправки всех частей. Пока рассылка отправляется, обработчик
+    периодически продлевает задание; задание, которое не продлевалось дольше stale_timeout секунд
+    (обработчик упал), забирает другой обработчик и досылает только неотправленные части.
+    Задание, созданное по другому списку номеров, не отправляется: все его части записываются неудачными.
+    Если часть не отправлена из-за временной ошибки sms-сервиса, задание не подтверждается: его повторит
+    этот или другой обработчик после stale_timeout
+    """
+
+    def __init__(
+        self,
+        db,
+        sender: MailingSender,
+        phones: Sequence[str],
+        consumer: str,
+        stale_timeout: float = DEFAULT_STALE_TIMEOUT,
+        error_delay: float = DEFAULT_ERROR_DELAY,
+    ):
+        self.db = db
+        self.sender = sender
+        self.phones = phones
+        self.phones_digest = get_phones_digest(phones)
+        # части номеров собираются заранее, чтобы первая рассылка не ждала декодирования списка
+        get_smsc_chunks(phones, sender.chunk_size)
+        self.consumer = consumer
+        self.stale_timeout = stale_timeout
+        self.error_delay = error_delay
+
+    async def run(self):
+        """
+        Обрабатывает задания до отмены задачи. Группа обработчиков очереди создаётся при запуске
+        и после ошибок чтения очереди. После ошибки чтения очереди или обработки задания
+        обработчик делает паузу, растущую с каждой ошибкой подряд до MAX_ERROR_DELAY, и продолжает работу.
+        Неподтверждённое задание после stale_timeout заберёт этот или другой обработчик
+        """
+        logger.info("worker %s started", self.consumer)
+        errors = 0
+        group_created = False
+        while True:
+            try:
+                if not group_created:
+                    await self.db.create_sms_mailing_jobs_group()
+                    group_created = True
+                jobs = await self.db.claim_stale_sms_mailing_jobs(
+                    self.consumer, int(self.stale_timeout * 1000)
+                )
+                if not jobs:
+                    jobs = await self.db.read_sms_mailing_jobs(
+                        self.consumer, block=int(READ_TIMEOUT * 1000)
+                    )
+            except WORKER_ERRORS:
+                errors += 1
+                # группа могла пропасть вместе с очередью, например после FLUSHDB
+                group_created = False
+                logger.exception("worker %s: reading jobs failed", self.consumer)
+                await trio.sleep(self._get_error_delay(errors))
+                continue
+
+            for job_id, job in jobs:
+                try:
+                    await self.process(job_id, job)
+                except WORKER_ERRORS:
+                    errors += 1
+                    logger.exception("worker %s: job %s failed", self.consumer, job_id)
+                    await trio.sleep(self._get_error_delay(errors))
+                else:
+                    errors = 0
+
+    def _get_error_delay(self, errors: int) -> float:
+        return min(MAX_ERROR_DELAY, self.error_delay * 2 ** (errors - 1))
+
+    async def process(self, job_id: str, job: dict):
+        """
+        Отправляет рассылку из задания job_id и подтверждает задание. Если часть рассылки не отправлена
+        из-за временной ошибки sms-сервиса, задание не подтверждается и выбрасывается MailingPostponedError
+        """
+        sms_id = job["sms_id"]
+        phones_count = int(job["phones_count"])
+        chunk_size = int(job["chunk_size"])
+        chunks_count = math.ceil(phones_count / chunk_size)
+
+        if job.get("phones_digest") != self.phones_digest:
+            # список номеров обработчика не совпадает со списком, по которому создана рассылка
+            logger.error(
+                "mailing %s: created for other phone list (%d phones), worker has %d phones, mailing failed",
+                sms_id,
+                phones_count,
+                len(self.phones),
+            )
+            for chunk_index in range(chunks_count):
+                await self.db.add_failed_sms_mailing_chunk(
+                    sms_id,
+                    min(chunk_size, phones_count - chunk_index * chunk_size),
+                    chunk_index,
+                )
+            await self.db.ack_sms_mailing_job(job_id)
+            return
+
+        done_chunks = await self.db.get_done_sms_mailing_chunks(sms_id)
+        if done_chunks:
+            logger.info(
+                "mailing %s: resuming, %d of %d chunks already done",
+                sms_id,
+                len(done_chunks),
+                chunks_count,
+            )
+
+        progress = MailingProgress(
+            sms_id=sms_id, chunks_count=chunks_count, chunk_size=chunk_size
+        )
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(self._keep_job, job_id)
+            await self.sender.send(
+                progress, self.phones, job["text"], int(job["valid"]), done_chunks
+            )
+            nursery.cancel_scope.cancel()
+
+        if progress.chunks_postponed:
+            raise MailingPostponedError(
+                "Рассылка %s: %d частей не отправлены, задание будет повторено"
+                % (sms_id, progress.chunks_postponed)
+            )
+        await self.db.ack_sms_mailing_job(job_id)
+
+    async def _keep_job(self, job_id: str):
+        while True:
+            await trio.sleep(self.stale_timeout / 3)
+            await self.db.touch_sms_mailing_job(self.consumer, job_id)
@@ -1,18 +1,28 @@
-import collections
+import hmac
 import json
 import logging
-import re
+import multiprocessing
+import os
+import signal
+import socket
 import warnings
-from enum import IntEnum
-from unittest.mock import patch
-from urllib.error import HTTPError
+from functools import partial
+from typing import Literal, Optional
 
-import aioredis
 import trio
-import trio_asyncio
-from hypercorn.trio import serve
-from hypercorn.config import Config as HyperConfig
-from pydantic import BaseModel, constr, conint, Field, field_serializer
+from hypercorn.config import Config as HyperConfig, Sockets
+from hypercorn.trio.run import worker_serve
+from hypercorn.utils import check_multiprocess_shutdown_event, wrap_app
+from pydantic import (
+    BaseModel,
+    ConfigDict,
+    ValidationError,
+    confloat,
+    constr,
+    conint,
+    Field,
+    field_serializer,
+)
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from quart import render_template, request, websocket
 
@@ -20,18 +30,55 @@ import asyncclick as click
 from quart_trio import QuartTrio
 from trio import TrioDeprecationWarning
 
-from mchs_sms.db import Database
+from mchs_sms.db import Database, SMS_MAILINGS_PAGE_SIZE
+from mchs_sms.metrics import (
+    CONTENT_TYPE,
+    PENDING_SMS,
+    REGISTRY,
+    WEBSOCKET_CLIENTS,
+    WEBSOCKET_PAYLOAD_BYTES,
+)
+from mchs_sms.phones import PhoneList, PhonesReport, load_phones
+from mchs_sms.poller import (
+    StatusPoller,
+    StatusRefresher,
+    StatusReportCollector,
+    DEFAULT_MAX_CONCURRENCY,
+    DEFAULT_RATE_LIMIT,
+    DEFAULT_REFRESH_INTERVAL,
+    DEFAULT_REPORTS_FLUSH_INTERVAL,
+)
+from mchs_sms.redis_client import (
+    DEFAULT_MAX_CONNECTIONS,
+    DEFAULT_TIMEOUT as DEFAULT_REDIS_TIMEOUT,
+    from_url as redis_from_url,
+)
+from mchs_sms.sender import (
+    MailingSender,
+    MailingWorker,
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_SEND_CONCURRENCY,
+)
+from mchs_sms.updates import (
+    MailingSnapshotCache,
+    MailingUpdatesFeed,
+    DEFAULT_SNAPSHOT_TTL,
+)
 from mchs_sms.smsc_api import (
     smsc_login,
     smsc_password,
-    HttpMethod,
-    SEND_URL,
-    request_smsc,
-    STATUS_URL,
+    smsc_client,
+    SmscClient,
+    RetryPolicy,
+    get_status_report_signature,
+    STATUS_BATCH_SIZE,
+    SMSC_HOST,
+    DEFAULT_CONNECTIONS,
+    DEFAULT_TIMEOUT,
 )
-from tests.test_request_smsc import MockSuccessResponse, MockSendStatusResponse
 
-app = QuartTrio(__name__)
+# при --workers больше 1 процессы сервера импортируют этот модуль под именем __mp_main__
+app = QuartTrio("mchs_sms.server")
 warnings.filterwarnings(action="ignore", category=TrioDeprecationWarning)
 logging.basicConfig(
     format="%(asctime)s - %(levelname)s: %(name)s: %(message)s",
@@ -39,35 +86,40 @@ logging.basicConfig(
 )
 logger = logging.getLogger("server")
 
-PHONE_DELIMITERS = r"[;|,]"
-PHONES_PATTERN = re.compile(
-    r"^[+]?\d{10,11}("
-    + PHONE_DELIMITERS
-    + r"+[+]?\d{10,11}){0,}"
-    + PHONE_DELIMITERS
-    + "*$"
-)
+MAX_SMS_MAILINGS_PAGE_SIZE = 500
+DEFAULT_BIND = "127.0.0.1:5000"
+DEFAULT_GRACEFUL_TIMEOUT = 10.0
 
 
 def convert_phones(ctx, param, value):
     """
-    Очищает строку с телефонами от пробельных символов, проверяет её на валидность и
-    возвращает список телефонов для рассылки.
+    Читает файл с телефонами, пропуская некорректные номера и повторы, и
+    возвращает упакованный список телефонов для рассылки.
     """
-
+    report = PhonesReport()
     with open(value) as fd:
-        phones_str = re.sub(r"\s+", "", fd.read())
+        phones = PhoneList.from_phones(load_phones(fd, report))
+
+    for invalid in report.invalid:
+        logger.warning(
+            "invalid phone %r at line %d, column %d",
+            invalid.value,
+            invalid.line,
+            invalid.column,
+        )
+    if report.invalid_count > len(report.invalid):
+        logger.warning(
+            "%d more invalid phones skipped", report.invalid_count - len(report.invalid)
+        )
+    if report.duplicates:
+        logger.info("%d duplicate phones skipped", report.duplicates)
 
-    if not PHONES_PATTERN.match(phones_str):
+    if not phones:
         raise click.BadParameter(
             "Номера телефонов должны содержать только цифры и "
             "разделены между собой через точку с запятой"
         )
 
-    phones = re.split(PHONE_DELIMITERS, phones_str)
-    if phones[-1] == "":
-        phones.remove("")
-
     logger.debug("phone list (first 10 copies) %s", "; ".join(phones[:10]))
     return phones
 
@@ -88,39 +140,36 @@ def get_log_level(ctx, param, value):
 class Message(BaseModel):
     """Класс сообщения"""
 
-    phones: list[constr(pattern=r"^[+]?\d{10,11}$")]
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    # номера проверены при загрузке списка, повторно они не проверяются
+    phones: PhoneList
     mes: constr(min_length=5)
     valid: conint(ge=1, le=24)
 
     @field_serializer("phones")
-    def serialize_phones(self, phones: list, _info):
-        return ",".join(phones)
+    def serialize_phones(self, phones: PhoneList, _info):
+        return phones.to_smsc()
 
 
-class Status(BaseModel):
-    """Класс для хранения статуса ответа"""
+class MailingsRequest(BaseModel):
+    """Запрос вебсокета более ранних рассылок"""
 
-    class Number(IntEnum):
-        """
-        Формат ответа сервера:
-            0 – (по умолчанию) в виде строки (Status = 1, check_time = 10.10.2010 10:10:10).
-            1 – в виде номера статуса и штампа времени через запятую (1,1286524541).
-            2 – в xml формате.
-            3 – в json формате.
-        """
+    msgType: Literal["LoadOlderMailings"]
+    # курсор вида "<created_at>:<sms_id>" из nextCursor предыдущего ответа
+    cursor: Optional[constr(pattern=r"^\d+(\.\d*)?(e[+-]?\d+)?:[^_\s]+$")] = None
+    since: Optional[confloat(allow_inf_nan=False)] = None
+    until: Optional[confloat(allow_inf_nan=False)] = None
+    limit: conint(ge=1, le=MAX_SMS_MAILINGS_PAGE_SIZE) = SMS_MAILINGS_PAGE_SIZE
 
-        ZERO = 0
-        ONE = 1
-        TWO = 2
-        THREE = 3
 
-    phone: constr(pattern=r"^[+]?\d{10,11}$")
-    id: conint(ge=0)
-    fmt: Number = Number.THREE
+class StatusReport(BaseModel):
+    """Отчёт sms-сервиса о статусе SMS, присланный на адрес обработчика статусов"""
 
-    @field_serializer("id")
-    def serialize_id(self, id: int, _info):
-        return str(id)
+    id: conint(ge=0)
+    phone: constr(pattern=r"^[+]?\d{10,15}$")
+    status: int
+    md5: str
 
 
 class Settings(BaseSettings):
@@ -137,74 +186,124 @@ async def hello():
     return await render_template("index.html")
 
 
-@app.websocket("/ws")
-async def ws():
+async def build_mailings_status_message(db, sms_ids) -> dict:
+    """Собирает сообщение для вебсокета со сводкой по рассылкам sms_ids"""
+    sms_mailings = await db.get_mailing_summaries(*sms_ids)
+    logger.debug("sms_mailings %s", sms_mailings[:10])
+
+    messages = {"msgType": "SMSMailingStatus", "SMSMailings": []}
+    for sms_mailing in sms_mailings:
+        messages["SMSMailings"].append(
+            {
+                "timestamp": sms_mailing["created_at"],
+                "SMSText": sms_mailing["text"],
+                "mailingId": str(sms_mailing["sms_id"]),
+                "totalSMSAmount": sms_mailing["phones_count"],
+                "deliveredSMSAmount": sms_mailing["delivered"],
+                "failedSMSAmount": sms_mailing["failed"],
+                "chunksAmount": sms_mailing["chunks_count"],
+                "sentChunksAmount": sms_mailing["chunks_sent"],
+                "failedChunksAmount": sms_mailing["chunks_failed"],
+            }
+        )
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("%s", json.dumps(messages, indent=4, ensure_ascii=False))
+    return messages
+
+
+async def build_mailings_page_message(
+    db, since=None, until=None, cursor=None, limit=SMS_MAILINGS_PAGE_SIZE
+) -> dict:
     """
-    Делает регулярные запросы в сторону sms-сервиса для получения статусов отправки sms
-    Документация по статусам https://smsc.ru/api/http/status_messages/statuses/#menu
+    Собирает сообщение для вебсокета со сводкой по limit рассылкам, созданным между since и until,
+    начиная с самых новых. nextCursor — курсор для запроса более ранних рассылок или None
     """
+    sms_ids, next_cursor = await db.page_sms_mailings(since, until, cursor, limit)
+    logger.info("Registered mailings ids %s", sms_ids[:10])
 
-    verbose = (
-        lambda _status: "delivered"
-        if _status in (1, 2, 4)
-        else "pending"
-        if _status in (-1, 0)
-        else "failed"
-    )
+    messages = await build_mailings_status_message(db, sms_ids)
+    messages["nextCursor"] = next_cursor
+    return messages
 
-    db = app.config["REDIS_DB"]
 
-    pending_sms_list = await trio_asyncio.aio_as_trio(db.get_pending_sms_list)()
-    logger.debug("pending: %s", json.dumps(pending_sms_list[:10], ensure_ascii=False))
+async def answer_mailings_requests(db):
+    """
+    Отвечает на запросы вебсокета более ранних рассылок:
+    {"msgType": "LoadOlderMailings", "cursor": "...", "since": ..., "until": ..., "limit": 50}
+    """
+    while True:
+        try:
+            mailings_request = MailingsRequest.model_validate_json(
+                await websocket.receive()
+            )
+        except ValidationError as error:
+            logger.warning("invalid websocket request: %s", error)
+            continue
+
+        await send_websocket_message(
+            json.dumps(
+                await build_mailings_page_message(
+                    db,
+                    mailings_request.since,
+                    mailings_request.until,
+                    mailings_request.cursor,
+                    mailings_request.limit,
+                )
+            )
+        )
 
-    statuses = list()
 
-    for pending_sms in pending_sms_list:
-        with patch("asks.get") as mock_function:
-            mock_function.return_value = MockSendStatusResponse()
-            phone, sms_id = pending_sms[1], pending_sms[0]
-            status = Status(phone=phone, id=sms_id)
-            response = await request_smsc(
-                HttpMethod.get, STATUS_URL, payload=status.model_dump()
-            )
+async def send_websocket_message(text: str):
+    """Отправляет сообщение вебсокету и учитывает его размер в метриках"""
+    WEBSOCKET_PAYLOAD_BYTES.observe(len(text.encode()))
+    await websocket.send(text)
 
-            if response.status_code == 200:
-                statuses.append(
-                    [
-                        sms_id,
-                        phone,
-                        verbose(response.content["status"]),
-                    ]
-                )
 
-    await trio_asyncio.aio_as_trio(db.update_sms_status_in_bulk)(statuses)
+@app.websocket("/ws")
+async def ws():
+    """
+    Отправляет сводку по всем рассылкам при подключении и затем только изменившиеся рассылки,
+    не чаще одного раза в WS_UPDATE_INTERVAL секунд. Статусы обновляет фоновая задача StatusRefresher,
+    об изменениях сообщает канал обновлений Redis, общий для всех процессов сервера.
+    Сводку по последним рассылкам вебсокеты процесса получают из общего кэша MailingSnapshotCache,
+    более ранние рассылки — по запросу LoadOlderMailings
+    """
 
-    sms_ids = await trio_asyncio.aio_as_trio(db.list_sms_mailings)()
-    logger.info(
-        "Registered mailings ids %s", json.dumps(sms_ids[:10], ensure_ascii=False)
-    )
+    db = app.config["REDIS_DB"]
+    feed = app.config["UPDATES_FEED"]
+
+    WEBSOCKET_CLIENTS.inc()
+    try:
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(answer_mailings_requests, db)
+
+            version, snapshot = await app.config["SNAPSHOT_CACHE"].get()
+            await send_websocket_message(snapshot)
+            while True:
+                await trio.sleep(app.config["WS_UPDATE_INTERVAL"])
+                version, sms_ids = await feed.wait_changes(version)
+                if sms_ids is None:
+                    logger.info("updates history overflow, sending full snapshot")
+                    version, snapshot = await app.config["SNAPSHOT_CACHE"].get()
+                    await send_websocket_message(snapshot)
+                    continue
+                await send_websocket_message(
+                    json.dumps(await build_mailings_status_message(db, sms_ids))
+                )
+    finally:
+        WEBSOCKET_CLIENTS.dec()
 
-    sms_mailings = await trio_asyncio.aio_as_trio(db.get_sms_mailings)(*sms_ids)
-    logger.debug("sms_mailings %s", json.dumps(sms_mailings[:10], ensure_ascii=False))
 
-    messages = {"msgType": "SMSMailingStatus", "SMSMailings": []}
-    for sms_mailing in sms_mailings:
-        messages["SMSMailings"].append(
-            {
-                "timestamp": sms_mailing["created_at"],
-                "SMSText": sms_mailing["text"],
-                "mailingId": str(sms_mailing["sms_id"]),
-                "totalSMSAmount": sms_mailing["phones_count"],
-                "deliveredSMSAmount": collections.Counter(
-                    sms_mailing["phones"].values()
-                )["delivered"],
-                "failedSMSAmount": collections.Counter(sms_mailing["phones"].values())[
-                    "failed"
-                ],
-            }
-        )
-    logger.debug("%s", json.dumps(messages, indent=4, ensure_ascii=False))
-    await websocket.send_json(messages)
+@app.route("/metrics")
+async def metrics():
+    """
+    Метрики процесса в текстовом формате Prometheus.
+    Метрики не объединяются между процессами: с --workers больше 1 запрос получает метрики случайного процесса.
+    Количество недоставленных SMS запрашивается у Redis только при запросе метрик
+    """
+    PENDING_SMS.set(await app.config["REDIS_DB"].count_pending_sms())
+    smsc_client.get().breaker.observe_open_time()
+    return REGISTRY.render(), 200, {"Content-Type": CONTENT_TYPE}
 
 
 @app.route("/send/", methods=["POST"])
@@ -215,27 +314,51 @@ async def send_message():
     message = Message(
         valid=app.config["VALID"], phones=app.config["PHONES"], mes=form["text"]
     )
-    with patch("asks.post") as mock_function:
-        mock_function.return_value = MockSuccessResponse()
-        try:
-            response = await request_smsc(
-                HttpMethod.post, SEND_URL, payload=message.model_dump()
-            )
-        except HTTPError:
-            return {"errorMessage": "Потеряно соединение с SMSC.ru"}
-
-    logger.info("response status %d, ответ %s", response.status_code, response.content)
 
-    db = app.config["REDIS_DB"]
+    if smsc_client.get().breaker.is_rejecting:
+        return {"errorMessage": "SMSC.ru недоступен, повторите попытку позже"}
 
-    await trio_asyncio.aio_as_trio(db.add_sms_mailing)(
-        response.content["id"], message.phones, message.mes
+    # рассылку отправят обработчики очереди, прогресс виден в сводке по рассылкам
+    progress = await app.config["MAILING_SENDER"].enqueue_mailing(
+        message.phones, message.mes, message.valid
+    )
+    logger.info(
+        "mailing %s enqueued: %d phones in %d chunks",
+        progress.sms_id,
+        len(message.phones),
+        progress.chunks_count,
     )
 
-    pending_sms_list = await trio_asyncio.aio_as_trio(db.get_pending_sms_list)()
-    logger.debug("pending: %s", json.dumps(pending_sms_list[:10], ensure_ascii=False))
+    return {
+        "mailingId": progress.sms_id,
+        "totalSMSAmount": len(message.phones),
+        "chunksCount": progress.chunks_count,
+    }
+
+
+@app.route("/smsc/status/", methods=["POST"])
+async def receive_status_report():
+    """
+    Принимает отчёт sms-сервиса о статусе SMS. Адрес обработчика статусов указывается в настройках
+    аккаунта smsc.ru, подлинность отчёта проверяется по подписи md5.
+    Отчёты сохраняются пакетами фоновой задачей StatusReportCollector
+    """
+    form = await request.form
+    try:
+        report = StatusReport.model_validate(form.to_dict())
+    except ValidationError as error:
+        logger.warning("invalid status report: %s", error)
+        return "Invalid status report", 400
+
+    signature = get_status_report_signature(
+        form["id"], form["phone"], form["status"], app.config["STATUS_REPORTS_SECRET"]
+    )
+    if not hmac.compare_digest(signature, report.md5.lower()):
+        logger.warning("status report of sms %d with wrong signature", report.id)
+        return "Wrong signature", 403
 
-    return pending_sms_list
+    app.config["STATUS_REPORTS"].add(str(report.id), report.phone, report.status)
+    return "OK"
 
 
 @click.command()
@@ -259,6 +382,152 @@ async def send_message():
     help="Адрес сервера REDIS для хранения информации о рассылках.",
     default="redis://localhost",
 )
+@click.option(
+    "--redis-connections",
+    type=int,
+    envvar="REDIS_MAX_CONNECTIONS",
+    default=DEFAULT_MAX_CONNECTIONS,
+    help="Максимальное количество одновременных соединений с Redis.",
+)
+@click.option(
+    "--redis-timeout",
+    type=float,
+    envvar="REDIS_TIMEOUT",
+    default=DEFAULT_REDIS_TIMEOUT,
+    help="Максимальное время ожидания ответа Redis в секундах.",
+)
+@click.option(
+    "--poll-concurrency",
+    type=int,
+    envvar="SMSC_POLL_CONCURRENCY",
+    default=DEFAULT_MAX_CONCURRENCY,
+    help="Максимальное количество одновременных запросов статусов SMS.",
+)
+@click.option(
+    "--poll-rate",
+    type=float,
+    envvar="SMSC_POLL_RATE",
+    default=DEFAULT_RATE_LIMIT,
+    help="Максимальное количество запросов статусов SMS в секунду.",
+)
+@click.option(
+    "--poll-batch-size",
+    type=int,
+    envvar="SMSC_POLL_BATCH_SIZE",
+    default=STATUS_BATCH_SIZE,
+    help="Количество SMS в одном запросе статусов.",
+)
+@click.option(
+    "--refresh-interval",
+    type=float,
+    envvar="SMSC_REFRESH_INTERVAL",
+    default=DEFAULT_REFRESH_INTERVAL,
+    help="Период опроса статусов SMS в секундах.",
+)
+@click.option(
+    "--status-reports-secret",
+    envvar="SMSC_STATUS_REPORTS_SECRET",
+    help="Пароль для проверки подписи отчётов о статусах SMS. По умолчанию — пароль sms-сервиса.",
+)
+@click.option(
+    "--status-reports-flush-interval",
+    type=float,
+    envvar="SMSC_STATUS_REPORTS_FLUSH_INTERVAL",
+    default=DEFAULT_REPORTS_FLUSH_INTERVAL,
+    help="Период сохранения полученных отчётов о статусах SMS в секундах.",
+)
+@click.option(
+    "--ws-update-interval",
+    type=float,
+    envvar="SERVER_WS_UPDATE_INTERVAL",
+    default=1.0,
+    help="Минимальный интервал между обновлениями вебсокета в секундах.",
+)
+@click.option(
+    "--page-size",
+    type=int,
+    envvar="SERVER_PAGE_SIZE",
+    default=SMS_MAILINGS_PAGE_SIZE,
+    help="Количество последних рассылок, которые вебсокет получает при подключении.",
+)
+@click.option(
+    "--snapshot-ttl",
+    type=float,
+    envvar="SERVER_SNAPSHOT_TTL",
+    default=DEFAULT_SNAPSHOT_TTL,
+    help="Наибольшее время в секундах, в течение которого новые вебсокеты получают сохранённую сводку по рассылкам.",
+)
+@click.option(
+    "--smsc-host",
+    envvar="SMSC_HOST",
+    default=SMSC_HOST,
+    help="Адрес sms-сервиса, например адрес локального имитатора python -m mchs_sms.simulator.",
+)
+@click.option(
+    "--smsc-connections",
+    type=int,
+    envvar="SMSC_CONNECTIONS",
+    default=DEFAULT_CONNECTIONS,
+    help="Максимальное количество постоянных соединений с sms-сервисом.",
+)
+@click.option(
+    "--smsc-timeout",
+    type=float,
+    envvar="SMSC_TIMEOUT",
+    default=DEFAULT_TIMEOUT,
+    help="Максимальное время ожидания ответа sms-сервиса в секундах.",
+)
+@click.option(
+    "--smsc-attempts",
+    type=int,
+    envvar="SMSC_ATTEMPTS",
+    default=RetryPolicy.attempts,
+    help="Количество попыток запроса к sms-сервису при временных ошибках.",
+)
+@click.option(
+    "--send-chunk-size",
+    type=int,
+    envvar="SMSC_SEND_CHUNK_SIZE",
+    default=DEFAULT_CHUNK_SIZE,
+    help="Количество номеров телефонов в одном запросе на отправку. "
+    "Статусы части до 512 номеров Redis хранит компактно.",
+)
+@click.option(
+    "--send-concurrency",
+    type=int,
+    envvar="SMSC_SEND_CONCURRENCY",
+    default=DEFAULT_SEND_CONCURRENCY,
+    help="Максимальное количество одновременно отправляемых частей рассылки.",
+)
+@click.option(
+    "--embedded-worker/--no-embedded-worker",
+    default=True,
+    help="Отправлять рассылки из очереди в процессе сервера. "
+    "Без обработчика в процессе сервера нужно запустить python -m mchs_sms.worker.",
+)
+@click.option(
+    "-b",
+    "--bind",
+    multiple=True,
+    envvar="SERVER_BIND",
+    default=[DEFAULT_BIND],
+    help="Адрес, на котором сервер принимает запросы. Можно указать несколько раз.",
+)
+@click.option(
+    "-w",
+    "--workers",
+    type=click.IntRange(min=1),
+    envvar="SERVER_WORKERS",
+    default=1,
+    help="Количество процессов сервера, принимающих запросы на общих адресах.",
+)
+@click.option(
+    "--graceful-timeout",
+    type=float,
+    envvar="SERVER_GRACEFUL_TIMEOUT",
+    default=DEFAULT_GRACEFUL_TIMEOUT,
+    help="Время в секундах, которое при остановке даётся на завершение обрабатываемых запросов.",
+)
 @click.option(
     "-v",
     "--verbose",
@@ -266,30 +535,195 @@ async def send_message():
     callback=get_log_level,
     help="Настройка логирования.",
 )  # https://click.palletsprojects.com/en/8.1.x/options/#counting
-async def run_server(valid, phones, redis_uri, verbose):
+async def run_server(bind, workers, graceful_timeout, **options):
     """
     Запускает цикл событий для отслеживания поступающих сообщений пользователя
-    и рендеринга статусов отправленных сообщений
+    и рендеринга статусов отправленных сообщений.
+    С --workers больше 1 запросы на общих адресах принимают несколько процессов сервера.
+    Сервер останавливается по SIGINT или SIGTERM, дав запросам завершиться за --graceful-timeout секунд
     """
-    async with trio_asyncio.open_loop():
-        config = HyperConfig()
-        config.bind = ["127.0.0.1:5000"]
-        config.use_reloader = True
+    logger.setLevel(options["verbose"])
+    config = HyperConfig()
+    config.bind = list(bind)
+    config.graceful_timeout = graceful_timeout
+
+    if workers == 1:
+        await serve_worker(config, shutdown_trigger=wait_shutdown_signal, **options)
+        return
+
+    sockets = config.create_sockets()
+    context = multiprocessing.get_context("spawn")
+    shutdown_event = context.Event()
+    processes = [
+        context.Process(
+            target=run_worker_process,
+            args=(config, sockets, shutdown_event, worker_index == 0, options),
+            daemon=True,
+        )
+        for worker_index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    logger.info("started %d server workers on %s", workers, ", ".join(config.bind))
+    logger.warning(
+        "/metrics reports metrics of a single server worker, use --workers 1 to collect them"
+    )
+
+    async with trio.open_nursery() as nursery:
+        for waiter in [wait_shutdown_signal, partial(wait_any_exited, processes)]:
+            nursery.start_soon(run_and_cancel, waiter, nursery.cancel_scope)
+
+    shutdown_event.set()
+    for process in processes:
+        await trio.to_thread.run_sync(process.join)
+    for sock in sockets.insecure_sockets + sockets.secure_sockets:
+        sock.close()
+
+
+async def serve_worker(
+    config: HyperConfig,
+    valid,
+    phones,
+    redis_uri,
+    redis_connections,
+    redis_timeout,
+    poll_concurrency,
+    poll_rate,
+    poll_batch_size,
+    refresh_interval,
+    status_reports_secret,
+    status_reports_flush_interval,
+    ws_update_interval,
+    snapshot_ttl,
+    page_size,
+    smsc_host,
+    smsc_connections,
+    smsc_timeout,
+    smsc_attempts,
+    send_chunk_size,
+    send_concurrency,
+    embedded_worker,
+    verbose,
+    sockets: Optional[Sockets] = None,
+    shutdown_trigger=None,
+    run_refresher: bool = True,
+):
+    """
+    Запускает один процесс сервера со своим подключением к Redis, сессией sms-сервиса и фоновыми задачами.
+    Опрос статусов SMS ведёт только процесс с run_refresher, чтобы процессы не опрашивали одни и те же SMS.
+    Отчёты о статусах, полученные до остановки сервера, сохраняются
+    """
+    conf = Settings().model_dump()
+
+    smsc_login.set(conf["login"])
+    smsc_password.set(conf["psw"])
+    app.config.from_prefixed_env()
+    app.config["VALID"] = valid
+    app.config["PHONES"] = phones
+
+    redis = redis_from_url(redis_uri, redis_connections, redis_timeout)
+    app.config["REDIS_DB"] = Database(redis)
+    refresher = StatusRefresher(
+        app.config["REDIS_DB"],
+        StatusPoller(poll_concurrency, poll_rate, poll_batch_size),
+        refresh_interval,
+    )
+    app.config["MAILING_SENDER"] = MailingSender(
+        app.config["REDIS_DB"], send_chunk_size, send_concurrency
+    )
+    app.config["STATUS_REPORTS"] = StatusReportCollector(
+        app.config["REDIS_DB"], status_reports_flush_interval
+    )
+    app.config["STATUS_REPORTS_SECRET"] = status_reports_secret or conf["psw"]
+    feed = MailingUpdatesFeed(app.config["REDIS_DB"])
+    app.config["UPDATES_FEED"] = feed
+    app.config["SNAPSHOT_CACHE"] = MailingSnapshotCache(
+        feed,
+        partial(build_mailings_page_message, app.config["REDIS_DB"], limit=page_size),
+        snapshot_ttl,
+    )
+    app.config["WS_UPDATE_INTERVAL"] = ws_update_interval
+
+    logger.setLevel(verbose)
+
+    async with SmscClient(
+        smsc_host,
+        connections=smsc_connections,
+        timeout=smsc_timeout,
+        retry_policy=RetryPolicy(attempts=smsc_attempts),
+    ) as client, trio.open_nursery() as nursery:
+        smsc_client.set(client)
+        if run_refresher:
+            nursery.start_soon(refresher.run)
+        nursery.start_soon(app.config["STATUS_REPORTS"].run)
+        nursery.start_soon(feed.run)
+        if embedded_worker:
+            worker = MailingWorker(
+                app.config["REDIS_DB"],
+                app.config["MAILING_SENDER"],
+                phones,
+                "%s-%d" % (socket.gethostname(), os.getpid()),
+            )
+            nursery.start_soon(worker.run)
+        await worker_serve(
+            wrap_app(app, config.wsgi_max_body_size, "asgi"),
+            config,
+            sockets=sockets,
+            shutdown_trigger=shutdown_trigger,
+        )
+        await app.config["STATUS_REPORTS"].flush()
+        nursery.cancel_scope.cancel()
+
+    await redis.close()
+    logger.info("server worker %d stopped", os.getpid())
+
+
+def run_worker_process(
+    config: HyperConfig,
+    sockets: Sockets,
+    shutdown_event,
+    run_refresher: bool,
+    options: dict,
+):
+    """
+    Точка входа процесса сервера при --workers больше 1. Процесс останавливается по shutdown_event,
+    которое устанавливает родительский процесс, поэтому Ctrl+C в терминале процесс игнорирует
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for sock in sockets.insecure_sockets + sockets.secure_sockets:
+        sock.listen(config.backlog)
+    trio.run(
+        partial(
+            serve_worker,
+            config,
+            sockets=sockets,
+            shutdown_trigger=partial(
+                check_multiprocess_shutdown_event, shutdown_event, trio.sleep
+            ),
+            run_refresher=run_refresher,
+            **options,
+        )
+    )
+
 
-        conf = Settings().model_dump()
+async def wait_shutdown_signal():
+    """Ждёт SIGINT или SIGTERM"""
+    with trio.open_signal_receiver(signal.SIGINT, signal.SIGTERM) as signals:
+        async for signum in signals:
+            logger.info("received %s, shutting down", signal.Signals(signum).name)
+            return
 
-        smsc_login.set(conf["login"])
-        smsc_password.set(conf["psw"])
-        app.config.from_prefixed_env()
-        app.config["VALID"] = valid
-        app.config["PHONES"] = phones
 
-        redis = aioredis.from_url(redis_uri, decode_responses=True)
-        app.config["REDIS_DB"] = Database(redis)
+async def wait_any_exited(processes: list, check_interval: float = 1.0):
+    """Ждёт завершения любого из процессов"""
+    while all(process.is_alive() for process in processes):
+        await trio.sleep(check_interval)
+    logger.error("server worker exited, shutting down")
 
-        logger.setLevel(verbose)
 
-        await serve(app, config)
+async def run_and_cancel(waiter, cancel_scope: trio.CancelScope):
+    await waiter()
+    cancel_scope.cancel()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,230 @@
+"""Локальный имитатор sms-сервиса smsc.ru для нагрузочного тестирования и замеров задержек"""
+
+import math
+import random
+import time
+import warnings
+from dataclasses import dataclass
+from typing import Optional
+
+import asyncclick as click
+import trio
+from hypercorn.config import Config as HyperConfig
+from hypercorn.trio import serve
+from quart import request
+from quart_trio import QuartTrio
+from trio import TrioDeprecationWarning
+
+app = QuartTrio(__name__)
+warnings.filterwarnings(action="ignore", category=TrioDeprecationWarning)
+
+# статусы sms-сервиса: ожидает отправки, передано оператору, доставлено, невозможно доставить
+STATUS_QUEUED = -1
+STATUS_SENT = 0
+STATUS_DELIVERED = 1
+STATUS_FAILED = 20
+QUEUED_SECONDS = 1.0
+# клиент повторяет запросы с этим кодом ошибки, как и у настоящего sms-сервиса
+TOO_MANY_REQUESTS_ERROR_CODE = 9
+
+
+@dataclass
+class SimulatorSettings:
+    """
+    Поведение имитатора: задержка ответа распределена логнормально с медианой latency секунд и разбросом latency_sigma,
+    доля ответов 500 — error_rate, запросы сверх rate_limit в секунду отклоняются ошибкой 9.
+    Доля delivery_rate SMS доставляется, остальные не доставляются, в среднем через delivery_time секунд после отправки
+    """
+
+    latency: float = 0.05
+    latency_sigma: float = 0.5
+    error_rate: float = 0.0
+    rate_limit: float = 0.0
+    delivery_rate: float = 0.9
+    delivery_time: float = 30.0
+
+
+class SmscSimulator:
+    """
+    Имитирует отправку SMS и изменение их статусов со временем.
+    Хранится только время отправки каждой рассылки, статус SMS вычисляется по её id и номеру телефона,
+    поэтому при одинаковом seed повторные запуски дают одинаковые статусы
+    """
+
+    def __init__(self, settings: SimulatorSettings, seed: Optional[int] = None):
+        self.settings = settings
+        self.seed = seed if seed is not None else random.randrange(2**32)
+        self.rng = random.Random(self.seed)
+        self._sent_at = {}
+        self._last_id = 0
+        self._window_start = 0.0
+        self._window_requests = 0
+
+    def get_latency(self) -> float:
+        """Случайная задержка ответа в секундах"""
+        if not self.settings.latency:
+            return 0.0
+        return self.rng.lognormvariate(
+            math.log(self.settings.latency), self.settings.latency_sigma
+        )
+
+    def is_failed(self) -> bool:
+        """Ответить ли на запрос ошибкой сервера"""
+        return self.rng.random() < self.settings.error_rate
+
+    def is_rate_limited(self, now: float) -> bool:
+        """Превышено ли ограничение количества запросов в секунду"""
+        if not self.settings.rate_limit:
+            return False
+        if now - self._window_start >= 1:
+            self._window_start, self._window_requests = now, 0
+        self._window_requests += 1
+        return self._window_requests > self.settings.rate_limit
+
+    def send(self, phones: str, now: Optional[float] = None) -> dict:
+        """Регистрирует рассылку по номерам через запятую, возвращает ответ rest/send/"""
+        self._last_id += 1
+        self._sent_at[self._last_id] = now or time.time()
+        return {"id": self._last_id, "cnt": len(phones.split(","))}
+
+    def get_status(self, sms_id: int, phone: str, now: Optional[float] = None) -> dict:
+        """Статус SMS в формате ответа sys/status.php с fmt=3"""
+        now = now or time.time()
+        phone = phone.lstrip("+")
+        sent_at = self._sent_at.get(sms_id)
+        if sent_at is None:
+            return {"id": sms_id, "phone": phone, "error": "not found", "error_code": 5}
+
+        rng = random.Random(f"{self.seed}:{sms_id}:{phone}")
+        is_delivered = rng.random() < self.settings.delivery_rate
+        finished_at = (
+            sent_at + QUEUED_SECONDS + rng.expovariate(1 / self.settings.delivery_time)
+        )
+        if now >= finished_at:
+            status = STATUS_DELIVERED if is_delivered else STATUS_FAILED
+            changed_at = finished_at
+        elif now >= sent_at + QUEUED_SECONDS:
+            status, changed_at = STATUS_SENT, sent_at + QUEUED_SECONDS
+        else:
+            status, changed_at = STATUS_QUEUED, sent_at
+
+        return {
+            "id": sms_id,
+            "phone": phone,
+            "status": status,
+            "last_date": time.strftime("%d.%m.%Y %H:%M:%S", time.localtime(changed_at)),
+            "last_timestamp": int(changed_at),
+        }
+
+
+async def simulate_request():
+    """Задерживает ответ и возвращает ответ с ошибкой, если запрос должен завершиться ошибкой"""
+    simulator = app.config["SIMULATOR"]
+    await trio.sleep(simulator.get_latency())
+    if simulator.is_failed():
+        return {"error": "internal error"}, 500
+    if simulator.is_rate_limited(trio.current_time()):
+        return {
+            "error": "too many requests",
+            "error_code": TOO_MANY_REQUESTS_ERROR_CODE,
+        }
+    return None
+
+
+@app.route("/rest/send/", methods=["POST"], strict_slashes=False)
+async def send():
+    """Отправка SMS: принимает JSON с полями login, psw, phones, mes, valid"""
+    if error := await simulate_request():
+        return error
+
+    payload = await request.get_json(force=True)
+    if not payload.get("phones") or not payload.get("mes"):
+        return {"error": "parameters error", "error_code": 1}
+    return app.config["SIMULATOR"].send(payload["phones"])
+
+
+@app.route("/sys/status.php", methods=["GET"])
+async def status():
+    """Статусы SMS: id и phone — списки через запятую одинаковой длины"""
+    if error := await simulate_request():
+        return error
+
+    sms_ids = request.args.get("id", "").split(",")
+    phones = request.args.get("phone", "").split(",")
+    if len(sms_ids) != len(phones) or not all(sms_id.isdigit() for sms_id in sms_ids):
+        return {"error": "parameters error", "error_code": 1}
+
+    simulator = app.config["SIMULATOR"]
+    now = time.time()
+    statuses = [
+        simulator.get_status(int(sms_id), phone, now)
+        for sms_id, phone in zip(sms_ids, phones)
+    ]
+    return statuses[0] if len(statuses) == 1 else statuses
+
+
+@click.command()
+@click.option("--host", default="127.0.0.1", help="Адрес имитатора.")
+@click.option("--port", type=int, default=8000, help="Порт имитатора.")
+@click.option(
+    "--latency",
+    type=float,
+    default=SimulatorSettings.latency,
+    help="Медиана задержки ответа в секундах.",
+)
+@click.option(
+    "--latency-sigma",
+    type=float,
+    default=SimulatorSettings.latency_sigma,
+    help="Разброс задержки ответа: стандартное отклонение её логарифма.",
+)
+@click.option(
+    "--error-rate",
+    type=float,
+    default=SimulatorSettings.error_rate,
+    help="Доля запросов, завершающихся ошибкой 500.",
+)
+@click.option(
+    "--rate-limit",
+    type=float,
+    default=SimulatorSettings.rate_limit,
+    help="Максимальное количество запросов в секунду, 0 — без ограничения.",
+)
+@click.option(
+    "--delivery-rate",
+    type=float,
+    default=SimulatorSettings.delivery_rate,
+    help="Доля доставляемых SMS.",
+)
+@click.option(
+    "--delivery-time",
+    type=float,
+    default=SimulatorSettings.delivery_time,
+    help="Среднее время от отправки до окончательного статуса SMS в секундах.",
+)
+@click.option("--seed", type=int, help="Начальное значение генератора случайных чисел.")
+async def run_simulator(
+    host,
+    port,
+    latency,
+    latency_sigma,
+    error_rate,
+    rate_limit,
+    delivery_rate,
+    delivery_time,
+    seed,
+):
+    """Запускает имитатор sms-сервиса, адрес имитатора передаётся серверу через SMSC_HOST"""
+    app.config["SIMULATOR"] = SmscSimulator(
+        SimulatorSettings(
+            latency, latency_sigma, error_rate, rate_limit, delivery_rate, delivery_time
+        ),
+        seed,
+    )
+    config = HyperConfig()
+    config.bind = [f"{host}:{port}"]
+    await serve(app, config)
+
+
+if __name__ == "__main__":
+    trio.run(run_simulator(_anyio_backend="trio"))
@@ -1,18 +1,23 @@
 """Консольный скрипт отправки sms-сообщений через сервис smsc.ru"""
 
+import hashlib
 import json
+import logging
+import random
 import re
 import time
 from contextlib import suppress
 from contextvars import ContextVar
 from dataclasses import dataclass, asdict
 from enum import Enum
-from typing import Optional, NamedTuple, Mapping
+from itertools import islice
+from typing import Iterable, Iterator, Optional, NamedTuple, Mapping, Sequence
 from urllib.parse import urlencode, urljoin
 
 import asyncclick as click
 import trio
 import asks
+from asks.errors import AsksException
 
 import warnings
 from trio import (
@@ -22,18 +27,39 @@ from trio import (
     MemoryReceiveChannel,
 )
 
+from mchs_sms.metrics import (
+    SMSC_CIRCUIT_OPEN,
+    SMSC_CIRCUIT_OPEN_SECONDS,
+    SMSC_CIRCUIT_OPENED,
+    SMSC_FAILURES,
+    SMSC_REJECTED,
+    SMSC_REQUEST_SECONDS,
+    SMSC_REQUESTS,
+    SMSC_RETRIES,
+)
+
 warnings.filterwarnings(action="ignore", category=TrioDeprecationWarning)
 
 SMSC_HOST = "https://smsc.ru"
 SEND_URL = "rest/send/"
 STATUS_URL = "sys/status.php"
 MAX_CLIENTS = 1
+STATUS_BATCH_SIZE = 100
+DEFAULT_CONNECTIONS = 10
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_CONNECTION_TIMEOUT = 10.0
+
+# 4 — IP-адрес временно заблокирован, 9 — слишком много одновременных или одинаковых запросов
+RETRYABLE_ERROR_CODES = frozenset({4, 9})
 
 asks.init("trio")
 
+logger = logging.getLogger("smsc_api")
+
 
 smsc_login: ContextVar[str] = ContextVar("smsc_login")
 smsc_password: ContextVar[str] = ContextVar("smsc_password")
+smsc_client: ContextVar["SmscClient"] = ContextVar("smsc_client")
 
 
 class HttpMethod(str, Enum):
@@ -50,19 +76,261 @@ class SmscResponse(NamedTuple):
     status_code: int
 
 
-@dataclass
+@dataclass(slots=True)
 class Message:
+    """
+    Параметры запроса на отправку sms. Данные не проверяются: пользовательский ввод
+    проверяет модель Message сервера, номера — загрузчик списка номеров
+    """
+
     phones: str
     mes: str
     valid: int
 
+    def as_payload(self) -> dict:
+        """Параметры запроса без рекурсивного копирования, которое делает asdict"""
+        return {"phones": self.phones, "mes": self.mes, "valid": self.valid}
 
-@dataclass
+
+@dataclass(slots=True)
 class Status:
+    """Параметры запроса статусов sms, собираются из данных нашей базы и не проверяются"""
+
     phone: str
     id: str
     fmt: int = 3
 
+    def as_payload(self) -> dict:
+        """Параметры запроса статусов для request_smsc"""
+        return {"phone": self.phone, "id": self.id, "fmt": self.fmt}
+
+
+class SmscApiError(Exception):
+    pass
+
+
+class SmscServerError(SmscApiError):
+    """Sms-сервис ответил статусом 5xx или не в формате JSON, запрос можно повторить"""
+
+
+class SmscRetryableError(SmscApiError):
+    """Sms-сервис временно отклонил запрос с кодом ошибки из RETRYABLE_ERROR_CODES, запрос можно повторить позже"""
+
+
+class SmscUnavailableError(SmscApiError):
+    """Sms-сервис недоступен: запросы отклоняются без обращения к нему, пока не истечёт reset_timeout"""
+
+
+# ошибки, после которых запрос повторяется, а предохранитель считает его неудачным
+RETRYABLE_ERRORS = (OSError, AsksException, trio.TooSlowError, SmscServerError)
+
+
+@dataclass
+class RetryPolicy:
+    """Повтор запросов с экспоненциально растущей случайной задержкой (full jitter)"""
+
+    attempts: int = 5
+    base_delay: float = 0.5
+    max_delay: float = 30.0
+
+    def get_delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+
+@dataclass
+class CircuitBreaker:
+    """
+    Предохранитель: после failure_threshold неудачных запросов подряд размыкается на reset_timeout секунд.
+    Затем пропускает ровно один пробный запрос, остальные отклоняет, пока не станет известен его результат:
+    при успехе замыкается, при неудаче снова размыкается
+    """
+
+    failure_threshold: int = 5
+    reset_timeout: float = 30.0
+    failures: int = 0
+    opened_at: Optional[float] = None
+    probing: bool = False
+    _open_time_observed_at: float = 0.0
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    @property
+    def is_rejecting(self) -> bool:
+        """Запрос будет отклонён: reset_timeout не истёк или пробный запрос уже выполняется"""
+        return self.is_open and (
+            self.probing or trio.current_time() - self.opened_at < self.reset_timeout
+        )
+
+    def check(self) -> bool:
+        """
+        Вызывает SmscUnavailableError, если запрос будет отклонён. Иначе, если предохранитель разомкнут,
+        запрос становится пробным и возвращается True: до вызова record_success, record_failure
+        или release_probe остальные запросы отклоняются
+        """
+        if self.is_rejecting:
+            SMSC_REJECTED.inc()
+            raise SmscUnavailableError("Sms-сервис недоступен, запрос отклонён")
+        self.probing = self.is_open
+        return self.probing
+
+    def release_probe(self):
+        """Пробный запрос прерван без результата, следующий запрос станет пробным"""
+        self.probing = False
+
+    def observe_open_time(self):
+        """Добавляет время в разомкнутом состоянии с прошлого вызова к метрике SMSC_CIRCUIT_OPEN_SECONDS"""
+        if self.is_open:
+            now = trio.current_time()
+            SMSC_CIRCUIT_OPEN_SECONDS.inc(amount=now - self._open_time_observed_at)
+            self._open_time_observed_at = now
+
+    def record_success(self):
+        if self.is_open:
+            self.observe_open_time()
+            self.opened_at = None
+            self.probing = False
+            SMSC_CIRCUIT_OPEN.set(0)
+            logger.warning("sms service is available again, circuit closed")
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.is_open:
+            # пробный запрос не удался, отсчёт reset_timeout начинается заново
+            self.observe_open_time()
+            self.opened_at = trio.current_time()
+            self.probing = False
+        elif self.failures >= self.failure_threshold:
+            self.opened_at = self._open_time_observed_at = trio.current_time()
+            SMSC_CIRCUIT_OPENED.inc()
+            SMSC_CIRCUIT_OPEN.set(1)
+            logger.warning(
+                "sms service failed %d times in a row, circuit opened", self.failures
+            )
+
+
+def _is_retryable_response(response: SmscResponse) -> bool:
+    return (
+        isinstance(response.content, Mapping)
+        and response.content.get("error_code") in RETRYABLE_ERROR_CODES
+    )
+
+
+def _parse_response(response) -> SmscResponse:
+    """Ответ sms-сервиса. Ответ 5xx или ответ не в формате JSON (например, страница ошибки прокси) — SmscServerError"""
+    if response.status_code >= 500:
+        raise SmscServerError(
+            "Ошибка sms-сервиса: статус ответа %d" % response.status_code
+        )
+    try:
+        content = response.json()
+    except ValueError:
+        raise SmscServerError(
+            "Ответ sms-сервиса не в формате JSON, статус ответа %d"
+            % response.status_code
+        ) from None
+    return SmscResponse(content=content, status_code=response.status_code)
+
+
+def _get_request_params(http_method: HttpMethod, payload: dict) -> dict:
+    """Параметры запроса: для GET данные передаются в строке запроса, для POST — в теле в формате JSON"""
+    if http_method.value == "get":
+        return {"params": urlencode(payload)}
+    return {"json": payload}
+
+
+class SmscClient:
+    """
+    Клиент sms-сервиса с пулом постоянных соединений: не более connections соединений с сервисом,
+    соединения переиспользуются между запросами, если включён keep_alive.
+
+    Сетевые ошибки, ответы 5xx и коды ошибок RETRYABLE_ERROR_CODES повторяются согласно retry_policy.
+    Если сервис не отвечает, предохранитель breaker отклоняет запросы сразу, не дожидаясь таймаутов.
+    Повтор запроса на отправку после таймаута может привести к повторной SMS: для экстренных рассылок
+    это предпочтительнее, чем потерянная SMS
+    """
+
+    def __init__(
+        self,
+        host: str = SMSC_HOST,
+        *,
+        connections: int = DEFAULT_CONNECTIONS,
+        timeout: float = DEFAULT_TIMEOUT,
+        connection_timeout: float = DEFAULT_CONNECTION_TIMEOUT,
+        keep_alive: bool = True,
+        retry_policy: Optional[RetryPolicy] = None,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.session = asks.Session(
+            host,
+            connections=connections,
+            headers={"Connection": "keep-alive" if keep_alive else "close"},
+        )
+        self.timeout = timeout
+        self.connection_timeout = connection_timeout
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+
+    async def request(
+        self, http_method: HttpMethod, api_method: str, *, payload: dict
+    ) -> SmscResponse:
+        """
+        Выполняет запрос с повторами. Если повторы исчерпаны, возвращает последний ответ сервиса
+        или вызывает последнюю ошибку: сетевую или SmscServerError
+        """
+        for attempt in range(self.retry_policy.attempts):
+            is_probe = self.breaker.check()
+            SMSC_REQUESTS.inc(api_method)
+            try:
+                response = await self._request(http_method, api_method, payload)
+            except RETRYABLE_ERRORS as error:
+                response, last_error = None, error
+            except BaseException:
+                if is_probe:
+                    self.breaker.release_probe()
+                raise
+            else:
+                if not _is_retryable_response(response):
+                    self.breaker.record_success()
+                    return response
+
+            SMSC_FAILURES.inc(api_method)
+            self.breaker.record_failure()
+            if attempt + 1 == self.retry_policy.attempts or self.breaker.is_open:
+                break
+
+            SMSC_RETRIES.inc(api_method)
+            delay = self.retry_policy.get_delay(attempt)
+            logger.info("%s request failed, retry in %.2f sec", api_method, delay)
+            await trio.sleep(delay)
+
+        if response is None:
+            raise last_error
+        return response
+
+    async def _request(
+        self, http_method: HttpMethod, api_method: str, payload: dict
+    ) -> SmscResponse:
+        response = await getattr(self.session, http_method.value)(
+            path=api_method,
+            timeout=self.timeout,
+            connection_timeout=self.connection_timeout,
+            **_get_request_params(http_method, payload),
+        )
+
+        return _parse_response(response)
+
+    async def close(self):
+        await self.session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
 
 async def request_smsc(
     http_method: HttpMethod,
@@ -72,25 +340,93 @@ async def request_smsc(
     password: Optional[str] = None,
     payload: dict = {},
 ) -> SmscResponse:
+    """Выполняет запрос к sms-сервису через клиент smsc_client, если он задан, иначе — через новое соединение"""
     payload["login"] = login or smsc_login.get()
     payload["psw"] = password or smsc_password.get()
 
-    if http_method.value == "get":
-        param_key = "params"
-        param_value = urlencode(payload)
-    else:
-        param_key = "json"
-        param_value = payload
+    with SMSC_REQUEST_SECONDS.timer(api_method):
+        client = smsc_client.get(None)
+        if client is not None:
+            return await client.request(http_method, api_method, payload=payload)
 
-    response = await getattr(asks, http_method.value)(
-        urljoin(SMSC_HOST, api_method), **{param_key: param_value}
-    )
+        response = await getattr(asks, http_method.value)(
+            urljoin(SMSC_HOST, api_method), **_get_request_params(http_method, payload)
+        )
 
-    return SmscResponse(content=response.json(), status_code=response.status_code)
+    return _parse_response(response)
 
 
-class SmscApiError(Exception):
-    pass
+def chunked(items: Iterable, size: int, /) -> Iterator[list]:
+    """Разбивает последовательность на списки длиной не более size элементов"""
+    iterator = iter(items)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def get_phone_key(phone) -> str:
+    """Ключ для сопоставления номеров: sms-сервис возвращает номера в своём формате (без +, с 7 вместо 8)"""
+    return re.sub(r"\D", "", str(phone))[-10:]
+
+
+def get_status_report_signature(sms_id, phone, status, password: str, /) -> str:
+    """
+    Подпись отчёта о статусе SMS, который sms-сервис отправляет на адрес обработчика статусов:
+    md5 от строки id:phone:status:пароль
+    """
+    return hashlib.md5(f"{sms_id}:{phone}:{status}:{password}".encode()).hexdigest()
+
+
+def match_statuses(sms_list: Sequence[tuple], content, /) -> list:
+    """
+    Сопоставляет ответ sms-сервиса на запрос статусов нескольких SMS с запрошенными парами (sms_id, phone).
+    Возвращает список троек (sms_id, phone, статус из ответа сервиса)
+    """
+    if isinstance(content, Mapping):
+        if "error_code" in content:
+            raise SmscApiError(
+                "Ошибка получения статусов: ошибка %s, код ошибки %d"
+                % (content.get("error"), content["error_code"])
+            )
+        content = [content]
+
+    if len(sms_list) == 1 and len(content) == 1:
+        # на запрос статуса одной SMS сервис может не возвращать её id и телефон
+        sms_id, phone = sms_list[0]
+        return [(sms_id, phone, content[0])]
+
+    key2sms = {
+        (str(sms_id), get_phone_key(phone)): (sms_id, phone)
+        for sms_id, phone in sms_list
+    }
+
+    statuses = []
+    for sms_status in content:
+        key = (str(sms_status.get("id")), get_phone_key(sms_status.get("phone")))
+        if key in key2sms:
+            statuses.append((*key2sms[key], sms_status))
+
+    return statuses
+
+
+async def request_statuses(sms_list: Sequence[tuple], /) -> list:
+    """
+    Запрашивает статусы нескольких SMS одним запросом. Принимает список пар (sms_id, phone),
+    возвращает список троек (sms_id, phone, статус из ответа сервиса)
+    """
+    status = Status(
+        phone=",".join(phone for _, phone in sms_list),
+        id=",".join(str(sms_id) for sms_id, _ in sms_list),
+    )
+    response = await request_smsc(
+        HttpMethod.get, STATUS_URL, payload=status.as_payload()
+    )
+
+    if response.status_code != 200:
+        raise SmscApiError(
+            "Ошибка получения статусов: статус ответа %d" % response.status_code
+        )
+
+    return match_statuses(sms_list, response.content)
 
 
 async def send_message(message: Message, send_channel: MemorySendChannel, /):
@@ -122,14 +458,12 @@ async def get_status(receive_channel: MemoryReceiveChannel, /):
         sms_id = content["id"]
         print(f"Сообщения были отправлены на {content['cnt']} телефонных номеров")
 
-        for phone in re.split(";|,", phones):
-            status = Status(phone=phone, id=sms_id)
-            response = await request_smsc(
-                HttpMethod.get, STATUS_URL, payload=asdict(status)
-            )
-            print(
-                f"SMS отправлена на телефон {phone}. Статус:\n{json.dumps(response.content, indent=4)}"
-            )
+        sms_list = [(sms_id, phone) for phone in re.split(";|,", phones)]
+        for sms_list_chunk in chunked(sms_list, STATUS_BATCH_SIZE):
+            for _, phone, sms_status in await request_statuses(sms_list_chunk):
+                print(
+                    f"SMS отправлена на телефон {phone}. Статус:\n{json.dumps(sms_status, indent=4)}"
+                )
 
 
 def validate_phones(ctx, param, value):
@@ -160,17 +494,22 @@ def validate_phones(ctx, param, value):
     help="Номер телефона или несколько номеров через запятую или точку с запятой.",
 )
 @click.option("--mes", required=True, type=str, help="Текст сообщения.")
-async def main(login, psw, valid, phones, mes):
+@click.option(
+    "--host", envvar="SMSC_HOST", default=SMSC_HOST, help="Адрес sms-сервиса."
+)
+async def main(login, psw, valid, phones, mes, host):
     smsc_login.set(login)
     smsc_password.set(psw)
 
     message = Message(valid=valid, phones=phones, mes=mes)
     send_channel, receive_channel = open_memory_channel(0)
     start = time.time()
-    async with trio.open_nursery() as nursery:
-        for _ in range(MAX_CLIENTS):
-            nursery.start_soon(send_message, message, send_channel)
-            nursery.start_soon(get_status, receive_channel)
+    async with SmscClient(host) as client:
+        smsc_client.set(client)
+        async with trio.open_nursery() as nursery:
+            for _ in range(MAX_CLIENTS):
+                nursery.start_soon(send_message, message, send_channel)
+                nursery.start_soon(get_status, receive_channel)
     print(f"завершено за {time.time() - start}")
 
 
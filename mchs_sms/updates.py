@@ -0,0 +1,121 @@
+"""Раздача изменений рассылок из канала Redis подписчикам внутри процесса"""
+
+import collections
+import json
+import logging
+from typing import Awaitable, Callable, Optional
+
+import trio
+
+from mchs_sms.redis_client import RedisError
+
+logger = logging.getLogger("updates")
+
+DEFAULT_HISTORY_SIZE = 10000
+RECONNECT_DELAY = 1.0
+DEFAULT_SNAPSHOT_TTL = 1.0
+
+
+class MailingUpdatesFeed:
+    """
+    Слушает канал обновлений Database и хранит журнал изменившихся рассылок.
+    Одна подписка на Redis обслуживает всех подписчиков процесса: каждый из них помнит версию
+    журнала, до которой получил изменения, и запрашивает только изменения после неё
+    """
+
+    def __init__(self, db, history_size: int = DEFAULT_HISTORY_SIZE):
+        self.db = db
+        self.version = 0
+        self._history = collections.deque(maxlen=history_size)
+        self._updated = trio.Event()
+
+    def _notify(self):
+        self._updated.set()
+        self._updated = trio.Event()
+
+    def add(self, sms_id: str):
+        """Записывает в журнал изменение рассылки sms_id"""
+        self.version += 1
+        self._history.append((self.version, sms_id))
+        self._notify()
+
+    def reset(self):
+        """Сбрасывает журнал: подписчики получат полную сводку вместо изменений"""
+        self.version += 1
+        self._history.clear()
+        self._notify()
+
+    def get_changes(self, version: int) -> Optional[set]:
+        """
+        Возвращает sms_id рассылок, изменившихся после версии version.
+        None — изменения после version уже вытеснены из журнала, нужна полная сводка
+        """
+        if version >= self.version:
+            return set()
+        if not self._history or self._history[0][0] > version + 1:
+            return None
+        return {
+            sms_id
+            for change_version, sms_id in self._history
+            if change_version > version
+        }
+
+    async def wait_changes(self, version: int) -> tuple[int, Optional[set]]:
+        """Дожидается изменений после версии version, возвращает новую версию и изменения"""
+        while self.version <= version:
+            await self._updated.wait()
+        return self.version, self.get_changes(version)
+
+    async def run(self):
+        """Слушает канал обновлений до отмены задачи, переподключается при потере соединения"""
+        while True:
+            try:
+                async for event in self.db.listen_updates():
+                    self.add(event["sms_id"])
+            except (OSError, RedisError):
+                logger.exception("updates channel connection lost")
+
+            # пока подписки не было, изменения могли потеряться
+            self.reset()
+            await trio.sleep(RECONNECT_DELAY)
+
+
+class MailingSnapshotCache:
+    """
+    Общая для всех вебсокетов процесса сводка по рассылкам, уже преобразованная в JSON.
+    Сводка строится заново, если после её построения в журнале feed появились изменения
+    или она старше ttl секунд. Одновременные запросы ждут одного построения сводки
+    """
+
+    def __init__(
+        self,
+        feed: MailingUpdatesFeed,
+        build: Callable[[], Awaitable[dict]],
+        ttl: float = DEFAULT_SNAPSHOT_TTL,
+    ):
+        self.feed = feed
+        self.build = build
+        self.ttl = ttl
+        self._snapshot = None  # версия журнала, время построения, JSON
+        self._lock = trio.Lock()
+
+    def _is_fresh(self) -> bool:
+        if self._snapshot is None:
+            return False
+        version, built_at, _ = self._snapshot
+        return (
+            version == self.feed.version and trio.current_time() - built_at < self.ttl
+        )
+
+    async def get(self) -> tuple[int, str]:
+        """Возвращает сводку в JSON и версию журнала, изменения после которой в сводку не вошли"""
+        async with self._lock:
+            if not self._is_fresh():
+                # изменения, пришедшие во время построения, подписчик получит из журнала
+                version = self.feed.version
+                snapshot = json.dumps(await self.build(), ensure_ascii=False)
+                self._snapshot = (version, trio.current_time(), snapshot)
+                logger.debug("mailings snapshot of version %d built", version)
+
+            version, _, snapshot = self._snapshot
+            return version, snapshot
@@ -0,0 +1,162 @@
+"""Обработчик очереди рассылок: отправляет рассылки, поставленные в очередь сервером"""
+
+import logging
+import os
+import socket
+
+import asyncclick as click
+import trio
+
+from mchs_sms.db import Database
+from mchs_sms.redis_client import (
+    DEFAULT_MAX_CONNECTIONS,
+    DEFAULT_TIMEOUT as DEFAULT_REDIS_TIMEOUT,
+    from_url,
+)
+from mchs_sms.sender import (
+    MailingSender,
+    MailingWorker,
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_SEND_CONCURRENCY,
+    DEFAULT_STALE_TIMEOUT,
+)
+from mchs_sms.server import Settings, convert_phones, get_log_level
+from mchs_sms.smsc_api import (
+    smsc_login,
+    smsc_password,
+    smsc_client,
+    SmscClient,
+    RetryPolicy,
+    SMSC_HOST,
+    DEFAULT_CONNECTIONS,
+    DEFAULT_TIMEOUT,
+)
+
+
+@click.command()
+@click.option(
+    "--phones",
+    required=True,
+    callback=convert_phones,
+    help="Путь до текстового файла с перечнем номеров телефонов.",
+)
+@click.option(
+    "-r",
+    "--redis",
+    "redis_uri",
+    help="Адрес сервера REDIS для хранения информации о рассылках.",
+    default="redis://localhost",
+)
+@click.option(
+    "--redis-connections",
+    type=int,
+    envvar="REDIS_MAX_CONNECTIONS",
+    default=DEFAULT_MAX_CONNECTIONS,
+    help="Максимальное количество одновременных соединений с Redis.",
+)
+@click.option(
+    "--redis-timeout",
+    type=float,
+    envvar="REDIS_TIMEOUT",
+    default=DEFAULT_REDIS_TIMEOUT,
+    help="Максимальное время ожидания ответа Redis в секундах.",
+)
+@click.option(
+    "--consumer",
+    default=lambda: "%s-%d" % (socket.gethostname(), os.getpid()),
+    help="Имя обработчика в группе обработчиков очереди рассылок.",
+)
+@click.option(
+    "--stale-timeout",
+    type=float,
+    envvar="SMSC_WORKER_STALE_TIMEOUT",
+    default=DEFAULT_STALE_TIMEOUT,
+    help="Время в секундах, после которого задание упавшего обработчика забирает другой.",
+)
+@click.option(
+    "--smsc-host",
+    envvar="SMSC_HOST",
+    default=SMSC_HOST,
+    help="Адрес sms-сервиса, например адрес локального имитатора python -m mchs_sms.simulator.",
+)
+@click.option(
+    "--smsc-connections",
+    type=int,
+    envvar="SMSC_CONNECTIONS",
+    default=DEFAULT_CONNECTIONS,
+    help="Максимальное количество постоянных соединений с sms-сервисом.",
+)
+@click.option(
+    "--smsc-timeout",
+    type=float,
+    envvar="SMSC_TIMEOUT",
+    default=DEFAULT_TIMEOUT,
+    help="Максимальное время ожидания ответа sms-сервиса в секундах.",
+)
+@click.option(
+    "--smsc-attempts",
+    type=int,
+    envvar="SMSC_ATTEMPTS",
+    default=RetryPolicy.attempts,
+    help="Количество попыток запроса к sms-сервису при временных ошибках.",
+)
+@click.option(
+    "--send-chunk-size",
+    type=int,
+    envvar="SMSC_SEND_CHUNK_SIZE",
+    default=DEFAULT_CHUNK_SIZE,
+    help="Количество номеров телефонов в одном запросе на отправку, как у сервера. "
+    "Части номеров этого размера собираются при запуске, рассылка отправляется частями из задания.",
+)
+@click.option(
+    "--send-concurrency",
+    type=int,
+    envvar="SMSC_SEND_CONCURRENCY",
+    default=DEFAULT_SEND_CONCURRENCY,
+    help="Максимальное количество одновременно отправляемых частей рассылки.",
+)
+@click.option(
+    "-v",
+    "--verbose",
+    count=True,
+    callback=get_log_level,
+    help="Настройка логирования.",
+)
+async def run_worker(
+    phones,
+    redis_uri,
+    redis_connections,
+    redis_timeout,
+    consumer,
+    stale_timeout,
+    smsc_host,
+    smsc_connections,
+    smsc_timeout,
+    smsc_attempts,
+    send_chunk_size,
+    send_concurrency,
+    verbose,
+):
+    """Запускает обработчик очереди рассылок"""
+    conf = Settings().model_dump()
+    smsc_login.set(conf["login"])
+    smsc_password.set(conf["psw"])
+
+    logging.getLogger().setLevel(verbose)
+
+    db = Database(from_url(redis_uri, redis_connections, redis_timeout))
+    sender = MailingSender(db, send_chunk_size, send_concurrency)
+    worker = MailingWorker(db, sender, phones, consumer, stale_timeout)
+
+    async with SmscClient(
+        smsc_host,
+        connections=smsc_connections,
+        timeout=smsc_timeout,
+        retry_policy=RetryPolicy(attempts=smsc_attempts),
+    ) as client:
+        smsc_client.set(client)
+        await worker.run()
+
+
+if __name__ == "__main__":
+    trio.run(run_worker(_anyio_backend="trio"))
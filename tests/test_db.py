@@ -0,0 +1,359 @@
+"""
+Тесты Database на настоящем Redis. Адрес задаётся TEST_REDIS_URL, база очищается перед каждым тестом.
+Если Redis недоступен, тесты пропускаются
+"""
+
+import gzip
+import io
+import json
+import os
+import socket
+import time
+from urllib.parse import urlparse
+
+import pytest
+import trio
+
+from mchs_sms.db import UPDATES_CHANNEL, Database
+from mchs_sms.redis_client import from_url
+
+TEST_REDIS_URL = os.getenv("TEST_REDIS_URL", "redis://127.0.0.1:6379/15")
+
+PHONES = ["+79999990000", "+79999990001", "+79999990002"]
+
+
+@pytest.fixture(scope="module")
+def redis_url():
+    parsed = urlparse(TEST_REDIS_URL)
+    try:
+        socket.create_connection(
+            (parsed.hostname or "localhost", parsed.port or 6379), timeout=1
+        ).close()
+    except OSError:
+        pytest.skip(f"Redis is not available at {TEST_REDIS_URL}")
+    return TEST_REDIS_URL
+
+
+@pytest.fixture
+def run_with_db(redis_url):
+    """Запускает scenario(db) в trio на пустой базе"""
+
+    def run(scenario, **db_options):
+        async def main():
+            redis = from_url(redis_url)
+            await redis.flushdb()
+            try:
+                return await scenario(Database(redis, **db_options))
+            finally:
+                await redis.flushdb()
+                await redis.close()
+
+        return trio.run(main)
+
+    return run
+
+
+@pytest.mark.parametrize("compact_phones", [True, False])
+def test_update_sms_statuses_counts_only_transitions(run_with_db, compact_phones):
+    """Тест скрипта смены статусов: счётчики меняются только при смене статуса, индексы pending и опроса
+    обновляются, новые счётчики публикуются в канал обновлений"""
+
+    async def scenario(db):
+        channel = db.redis.pubsub()
+        await channel.subscribe(UPDATES_CHANNEL)
+        await channel.get_message()
+
+        await db.add_sms_mailing("430", PHONES, "Завтра гроза")
+        changed = await db.update_sms_status_in_bulk(
+            [
+                ("430", PHONES[0], "delivered"),
+                ("430", PHONES[0], "delivered"),
+                ("430", PHONES[1], "failed"),
+                ("430", "+79990000000", "delivered"),
+            ]
+        )
+        repeated = await db.update_sms_status_in_bulk([("430", PHONES[0], "delivered")])
+
+        messages = [json.loads((await channel.get_message())["data"]) for _ in range(3)]
+        await channel.reset()
+        return (
+            changed,
+            repeated,
+            messages[-1],
+            await db.get_mailing_summaries("430"),
+            await db.get_pending_phones("430"),
+            await db.get_due_sms_list(time.time() + 1),
+            (await db.get_sms_mailings("430"))[0]["phones"],
+        )
+
+    changed, repeated, message, [summary], pending, due, phones = run_with_db(
+        scenario, compact_phones=compact_phones
+    )
+
+    assert (changed, repeated) == (2, 0)
+    assert message == {"sms_id": "430", "pending": 1, "delivered": 1, "failed": 1}
+    assert (summary["pending"], summary["delivered"], summary["failed"]) == (1, 1, 1)
+    assert pending == [{PHONES[2]}]
+    assert [(smsc_id, phone) for smsc_id, phone, _ in due] == [("430", PHONES[2])]
+    assert phones == dict(zip(PHONES, ["delivered", "failed", "pending"]))
+
+
+def test_update_sms_statuses_of_chunks_in_one_transaction(run_with_db):
+    """Тест смены статусов нескольких частей рассылки: скрипты всех частей выполняются одной транзакцией,
+    отсутствующий на сервере скрипт загружается"""
+
+    async def scenario(db):
+        await db.create_sms_mailing("mailing1", "Завтра гроза", 3, 2)
+        await db.add_sms_mailing_chunk("mailing1", "430", PHONES[:2], 0, valid=1)
+        await db.add_sms_mailing_chunk("mailing1", "431", PHONES[2:], 1, valid=1)
+        await db.redis.execute_command("SCRIPT", "FLUSH")
+        changed = await db.update_sms_status_in_bulk(
+            [
+                ("430", PHONES[0], "delivered"),
+                ("431", PHONES[2], "failed"),
+                ("430", PHONES[1], "pending"),
+            ]
+        )
+        return changed, await db.get_mailing_summaries("mailing1")
+
+    changed, [summary] = run_with_db(scenario)
+
+    assert changed == 2
+    assert (summary["pending"], summary["delivered"], summary["failed"]) == (1, 1, 1)
+
+
+def test_update_sms_status_back_to_pending(run_with_db):
+    """Тест скрипта смены статусов: SMS, вернувшаяся в pending, снова попадает в индексы недоставленных SMS"""
+
+    async def scenario(db):
+        await db.create_sms_mailing("mailing1", "Завтра гроза", 3, 2)
+        await db.add_sms_mailing_chunk("mailing1", "430", PHONES[:2], 0, valid=1)
+        await db.add_sms_mailing_chunk("mailing1", "431", PHONES[2:], 1, valid=1)
+        await db.update_sms_status_in_bulk(
+            [("430", PHONES[0], "delivered"), ("431", PHONES[2], "delivered")]
+        )
+        await db.update_sms_status_in_bulk([("431", PHONES[2], "pending")])
+        return (
+            await db.get_mailing_summaries("mailing1"),
+            await db.get_pending_phones("430", "431"),
+            await db.count_pending_sms(),
+            await db.get_done_sms_mailing_chunks("mailing1"),
+        )
+
+    [summary], pending, pending_count, done_chunks = run_with_db(scenario)
+
+    assert (summary["pending"], summary["delivered"], summary["chunks_sent"]) == (
+        2,
+        1,
+        2,
+    )
+    assert pending == [{PHONES[1]}, {PHONES[2]}]
+    assert pending_count == 2
+    assert done_chunks == {0, 1}
+
+
+def test_expire_pending_sms(run_with_db):
+    """Тест срока жизни SMS: недоставленные SMS после срока жизни части рассылки считаются неудачными"""
+
+    async def scenario(db):
+        await db.create_sms_mailing("mailing1", "Завтра гроза", 3, 2)
+        await db.add_sms_mailing_chunk("mailing1", "430", PHONES[:2], 0, valid=1)
+        await db.add_sms_mailing_chunk("mailing1", "431", PHONES[2:], 1, valid=2)
+        await db.update_sms_status_in_bulk([("430", PHONES[0], "delivered")])
+
+        expired = await db.expire_pending_sms(time.time() + 90 * 60)
+        return (
+            expired,
+            await db.get_mailing_summaries("mailing1"),
+            await db.get_pending_sms_list(time.time() + 90 * 60),
+        )
+
+    expired, [summary], pending_sms_list = run_with_db(scenario)
+
+    assert expired == 1
+    assert (summary["pending"], summary["delivered"], summary["failed"]) == (1, 1, 1)
+    assert pending_sms_list == [("431", PHONES[2])]
+
+
+def test_page_sms_mailings(run_with_db):
+    """Тест постраничного списка рассылок: от новых к старым, курсор продолжает список, в том числе после удаления
+    рассылки курсора"""
+
+    async def scenario(db):
+        for number in range(1, 6):
+            await db.add_sms_mailing(str(number), PHONES, "Завтра гроза", number)
+
+        pages = []
+        cursor = ""
+        while cursor is not None:
+            page, cursor = await db.page_sms_mailings(cursor=cursor or None, limit=2)
+            pages.append(page)
+
+        first_page, cursor = await db.page_sms_mailings(limit=2)
+        await db.redis.zrem("sms_mailings", first_page[-1])
+        after_removed, _ = await db.page_sms_mailings(cursor=cursor, limit=2)
+
+        return (
+            pages,
+            after_removed,
+            await db.page_sms_mailings(until=4),
+            await db.page_sms_mailings(since=2, until=4),
+        )
+
+    pages, after_removed, until_page, between_page = run_with_db(scenario)
+
+    assert pages == [["5", "4"], ["3", "2"], ["1"]]
+    assert after_removed == ["3", "2"]
+    assert until_page == (["3", "2", "1"], None)
+    assert between_page == (["3", "2"], None)
+
+
+def test_find_finished_sms_mailings(run_with_db):
+    """Тест поиска завершённых рассылок: все SMS получили статус либо срок жизни SMS истёк"""
+
+    async def scenario(db):
+        now = time.time()
+        await db.add_sms_mailing("1", PHONES[:1], "Завтра гроза", now)
+        await db.update_sms_status_in_bulk([("1", PHONES[0], "delivered")])
+        await db.add_sms_mailing("2", PHONES, "Завтра гроза", now)
+        await db.add_sms_mailing("3", PHONES, "Завтра гроза", now - 25 * 60 * 60)
+        await db.create_sms_mailing("4", "Завтра гроза", 3, 2, now)
+        await db.add_failed_sms_mailing_chunk("4", 2, 0)
+        await db.add_sms_mailing("5", PHONES, "Завтра гроза", now - 2 * 60 * 60, 1)
+        # рассылка долго ждала в очереди: её часть отправлена только что и доставляется ещё сутки
+        await db.create_sms_mailing("6", "Завтра гроза", 3, 1, now - 25 * 60 * 60)
+        await db.add_sms_mailing_chunk("6", "430", PHONES, 0, valid=24)
+        return await db.find_finished_sms_mailings(now, batch_size=2)
+
+    assert sorted(run_with_db(scenario)) == ["1", "3", "5"]
+
+
+def test_compact_sms_mailing(run_with_db):
+    """Тест сжатия рассылки: статусы телефонов архивируются и удаляются, сводка остаётся до истечения ttl"""
+
+    async def scenario(db):
+        await db.create_sms_mailing("mailing1", "Завтра гроза", 3, 2)
+        await db.add_sms_mailing_chunk("mailing1", "430", PHONES[:2], 0)
+        await db.add_sms_mailing_chunk("mailing1", "431", PHONES[2:], 1)
+        await db.update_sms_status_in_bulk([("430", PHONES[0], "delivered")])
+
+        archive = io.BytesIO()
+        with gzip.open(archive, "wt") as fd:
+            freed_bytes = await db.compact_sms_mailing(
+                "mailing1",
+                ttl=60,
+                archive=lambda mailing: fd.write(json.dumps(mailing) + "\n"),
+            )
+        keys = {key async for key in db.redis.scan_iter()}
+        ttl = await db.redis.execute_command("TTL", "sms_mailing_mailing1")
+        summaries = await db.get_mailing_summaries("mailing1")
+        finished = await db.find_finished_sms_mailings(time.time() + 2 * 24 * 60 * 60)
+        removed = await db.remove_expired_sms_mailings(time.time() + 120)
+        return (
+            archive.getvalue(),
+            freed_bytes,
+            keys,
+            ttl,
+            summaries,
+            finished,
+            removed,
+            await db.list_sms_mailings(),
+            await db.count_pending_sms(),
+        )
+
+    (
+        archive,
+        freed_bytes,
+        keys,
+        ttl,
+        [summary],
+        finished,
+        removed,
+        sms_ids,
+        pending_count,
+    ) = run_with_db(scenario)
+
+    [mailing] = [json.loads(line) for line in gzip.decompress(archive).splitlines()]
+    assert mailing["phones"] == dict(zip(PHONES, ["delivered", "pending", "pending"]))
+    assert (mailing["delivered"], mailing["pending"]) == (1, 2)
+    assert freed_bytes > 0
+    assert keys == {
+        "sms_mailing_mailing1",
+        "stats_for_sms_mailing_mailing1",
+        "sms_mailings",
+        "compacted_sms_mailings",
+    }
+    assert 0 < ttl <= 60
+    assert (summary["delivered"], summary["pending"]) == (1, 2)
+    assert finished == []
+    assert removed == 1
+    assert sms_ids == []
+    assert pending_count == 0
+
+
+def test_build_indexes_migrates_legacy_mailing(run_with_db):
+    """Тест миграции: рассылка без индексов индексируется, её недоставленные SMS попадают в расписание опроса"""
+
+    async def scenario(db):
+        created_at = time.time() - 60
+        await db.redis.set(
+            "sms_mailing_430",
+            json.dumps(
+                {"sms_id": "430", "text": "Завтра гроза", "created_at": created_at}
+            ),
+        )
+        await db.redis.hset(
+            "phones_for_sms_mailing_430",
+            mapping=dict(zip(PHONES, ["delivered", "pending", "pending"])),
+        )
+        await db.redis.sadd("pending_smsc_ids", "430")
+        await db.enqueue_sms_mailing_job("mailing1", chunk_size=2)
+
+        indexed = await db.build_indexes()
+        return (
+            indexed,
+            await db.build_indexes(),
+            await db.get_mailing_summaries("430"),
+            await db.list_sms_mailings(),
+            await db.get_pending_sms_list(),
+            sorted(phone for _, phone, _ in await db.get_due_sms_list()),
+        )
+
+    indexed, indexed_again, [summary], sms_ids, pending, due_phones = run_with_db(
+        scenario
+    )
+
+    assert (indexed, indexed_again) == (1, 1)
+    assert (summary["delivered"], summary["pending"], summary["chunks_sent"]) == (
+        1,
+        2,
+        1,
+    )
+    assert sms_ids == ["430"]
+    assert sorted(pending) == [("430", PHONES[1]), ("430", PHONES[2])]
+    assert due_phones == PHONES[1:]
+
+
+def test_claim_stale_jobs_behind_jobs_in_progress(run_with_db):
+    """Тест очереди рассылок: задание упавшего обработчика забирается, даже если перед ним в списке
+    неподтверждённых больше count заданий, которые ещё отправляются"""
+
+    async def scenario(db):
+        await db.create_sms_mailing_jobs_group()
+        await db.create_sms_mailing_jobs_group()
+        job_ids = [
+            await db.enqueue_sms_mailing_job(str(number), chunk_size=2)
+            for number in range(12)
+        ]
+        await db.read_sms_mailing_jobs("worker-1", count=12)
+        await trio.sleep(0.2)
+        for job_id in job_ids[:11]:
+            await db.touch_sms_mailing_job("worker-1", job_id)
+
+        claimed = await db.claim_stale_sms_mailing_jobs("worker-2", 100, count=10)
+        return job_ids, claimed, await db.claim_stale_sms_mailing_jobs("worker-2", 100)
+
+    job_ids, claimed, claimed_again = run_with_db(scenario)
+
+    assert [(job_id, job["sms_id"]) for job_id, job in claimed] == [(job_ids[11], "11")]
+    assert claimed_again == []
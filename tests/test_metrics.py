@@ -0,0 +1,52 @@
+import pytest
+import trio
+
+from mchs_sms.metrics import Gauge, Histogram, Registry, timed
+
+
+def test_histogram_rendered_with_cumulative_buckets():
+    """Тест гистограммы: корзины накапливают значения, сумма и количество выводятся по каждой метке"""
+    registry = Registry()
+    histogram = Histogram(
+        "test_seconds", "Test.", ("method",), buckets=(0.1, 1), registry=registry
+    )
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value, "get")
+
+    assert registry.render() == (
+        "# HELP test_seconds Test.\n"
+        "# TYPE test_seconds histogram\n"
+        'test_seconds_bucket{method="get",le="0.1"} 1.0\n'
+        'test_seconds_bucket{method="get",le="1.0"} 2.0\n'
+        'test_seconds_bucket{method="get",le="+Inf"} 3.0\n'
+        'test_seconds_sum{method="get"} 5.55\n'
+        'test_seconds_count{method="get"} 3.0\n'
+    )
+
+
+def test_gauge_rendered_without_labels():
+    registry = Registry()
+    gauge = Gauge("test_clients", "Test.", registry=registry)
+    gauge.inc()
+    gauge.inc()
+    gauge.dec()
+
+    assert registry.render().splitlines()[-1] == "test_clients 1.0"
+
+
+def test_timed_records_function_name():
+    """Тест декоратора timed: время вызова записывается с меткой — именем функции, в том числе при исключении"""
+    histogram = Histogram("test_seconds", "Test.", ("method",), registry=Registry())
+
+    @timed(histogram)
+    async def get_sms_list(fail=False):
+        if fail:
+            raise ValueError
+        return []
+
+    assert trio.run(get_sms_list) == []
+    with pytest.raises(ValueError):
+        trio.run(get_sms_list, True)
+
+    counts, _ = histogram._values[("get_sms_list",)]
+    assert sum(counts) == 2
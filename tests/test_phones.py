@@ -0,0 +1,77 @@
+import io
+
+from mchs_sms.phones import (
+    InvalidPhone,
+    PackedIntSet,
+    PhoneList,
+    PhonesReport,
+    load_phones,
+)
+
+
+def test_load_phones_reports_invalid_phones():
+    """Тест чтения номеров: некорректные номера пропускаются с указанием позиции, повторы удаляются"""
+    fd = io.StringIO(
+        "+79999990000, 89998880000;\n"
+        "7999 777 00 00|12345\n"
+        "+79998880000;;79999990001\n"
+    )
+    report = PhonesReport()
+
+    phones = list(load_phones(fd, report, block_size=7))
+
+    assert phones == ["+79999990000", "89998880000", "79997770000", "79999990001"]
+    assert report.invalid == [InvalidPhone(line=2, column=16, value="12345")]
+    assert (report.loaded, report.duplicates, report.invalid_count) == (4, 1, 1)
+
+
+def test_load_phones_keeps_other_country_codes():
+    """Тест поиска повторов: +7, 7, 8 и номер из 10 цифр — один абонент, номер с другим кодом страны — другой"""
+    fd = io.StringIO(
+        "79999990000;+79999990000;89999990000;9999990000;"
+        "19999990000;+19999990000;+89999990000"
+    )
+    report = PhonesReport()
+
+    phones = list(load_phones(fd, report))
+
+    assert phones == ["79999990000", "19999990000", "+89999990000"]
+    assert report.duplicates == 4
+
+
+def test_packed_int_set_grows():
+    numbers = PackedIntSet(capacity_bits=2)
+
+    added = [numbers.add(79999990000 + number * 1024) for number in range(1000)]
+
+    assert all(added)
+    assert not numbers.add(79999990000)
+    assert len(numbers) == 1000
+    assert 79999990000 + 999 * 1024 in numbers
+    assert 79999990001 not in numbers
+    assert numbers.nbytes <= 24 * len(numbers)
+
+
+def test_load_phones_truncates_long_values():
+    """Тест чтения номеров: значение без разделителей не читается в память целиком"""
+    fd = io.StringIO("1" * 1000 + ";79999990000")
+    report = PhonesReport()
+
+    phones = list(load_phones(fd, report, block_size=100))
+
+    assert phones == ["79999990000"]
+    assert report.invalid[0].column == 1
+    assert len(report.invalid[0].value) < 100
+
+
+def test_phone_list_round_trip():
+    """Тест упакованного списка: номера восстанавливаются в исходном виде"""
+    phones = ["+79999990000", "89998880000", "0999777000", "+0999777001"]
+
+    phone_list = PhoneList.from_phones(phones)
+
+    assert list(phone_list) == phones
+    assert phone_list[1] == "89998880000"
+    assert list(phone_list[2:]) == phones[2:]
+    assert phone_list.to_smsc() == ",".join(phones)
+    assert phone_list.nbytes == 8 * len(phones)
@@ -0,0 +1,228 @@
+from unittest.mock import patch
+
+import trio
+import trio.testing
+
+from mchs_sms.poller import (
+    MAX_CHECK_DELAY,
+    MIN_CHECK_DELAY,
+    StatusPoller,
+    StatusRefresher,
+    StatusReportCollector,
+    TokenBucket,
+    get_next_check_delay,
+)
+from mchs_sms.redis_client import ResponseError
+
+
+def test_token_bucket_limits_rate():
+    """Тест ограничителя частоты: после исчерпания всплеска запросы идут не чаще rate в секунду"""
+
+    async def acquire_many():
+        bucket = TokenBucket(rate=10, capacity=5)
+        start = trio.current_time()
+        for _ in range(25):
+            await bucket.acquire()
+        return trio.current_time() - start
+
+    elapsed = trio.run(acquire_many, clock=trio.testing.MockClock(autojump_threshold=0))
+
+    assert 1.9 < elapsed < 2.1
+
+
+def test_poller_collects_statuses_concurrently():
+    """Тест опроса статусов: все SMS опрошены, одновременных запросов не больше лимита"""
+
+    in_flight = 0
+    max_in_flight = 0
+
+    async def fake_request_statuses(sms_list):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await trio.sleep(1)
+        in_flight -= 1
+        return [(sms_id, phone, {"status": 1}) for sms_id, phone in sms_list]
+
+    pending_sms_list = [("430", f"7999999{number:04}") for number in range(20)]
+    poller = StatusPoller(max_concurrency=3, rate_limit=100, batch_size=2)
+
+    with patch("mchs_sms.poller.request_statuses", fake_request_statuses):
+        statuses = trio.run(
+            poller.poll,
+            pending_sms_list,
+            clock=trio.testing.MockClock(autojump_threshold=0),
+        )
+
+    assert sorted(statuses) == [
+        [sms_id, phone, "delivered"] for sms_id, phone in pending_sms_list
+    ]
+    assert max_in_flight == 3
+
+
+def test_refresher_expires_pending_sms_before_polling():
+    """Тест обновления статусов: SMS с истекшим сроком жизни помечаются неудачными и не опрашиваются"""
+    calls = []
+
+    class FakeDatabase:
+        async def expire_pending_sms(self):
+            calls.append("expire")
+            return 3
+
+        async def get_due_sms_list(self, now):
+            calls.append("get_due")
+            return []
+
+    async def refresh():
+        refresher = StatusRefresher(FakeDatabase(), StatusPoller())
+        return await refresher.refresh()
+
+    assert trio.run(refresh) == 3
+    assert calls == ["expire", "get_due"]
+
+
+def test_next_check_delay_grows_with_age():
+    """Тест расписания опроса: свежие SMS проверяются часто, старые — реже, но не реже MAX_CHECK_DELAY"""
+    assert get_next_check_delay(0) == MIN_CHECK_DELAY
+    assert get_next_check_delay(600) == 300
+    assert get_next_check_delay(24 * 60 * 60) == MAX_CHECK_DELAY
+
+
+def test_refresher_reschedules_pending_sms():
+    """Тест обновления статусов: недоставленные SMS откладываются по возрасту, доставленные не откладываются"""
+    rescheduled = {}
+
+    class FakeDatabase:
+        async def expire_pending_sms(self):
+            return 0
+
+        async def get_due_sms_list(self, now):
+            return [
+                ("430", "79999990001", now - 20),
+                ("430", "79999990002", now - 1200),
+                ("430", "79999990003", now - 3600),
+                ("430", "79999990004", None),
+            ]
+
+        async def update_sms_status_in_bulk(self, statuses):
+            return 1
+
+        async def reschedule_sms_checks(self, sms_checks):
+            rescheduled.update(sms_checks)
+
+    async def fake_request_statuses(sms_list):
+        return [
+            (sms_id, phone, {"status": 1 if phone.endswith("3") else 0})
+            for sms_id, phone in sms_list
+        ]
+
+    async def refresh():
+        refresher = StatusRefresher(FakeDatabase(), StatusPoller())
+        return await refresher.refresh()
+
+    with patch("mchs_sms.poller.request_statuses", fake_request_statuses), patch(
+        "mchs_sms.poller.time.time", return_value=100000.0
+    ):
+        assert trio.run(refresh) == 1
+
+    assert rescheduled == {
+        ("430", "79999990001"): 100000.0 + MIN_CHECK_DELAY,
+        ("430", "79999990002"): 100000.0 + 600,
+        ("430", "79999990004"): 100000.0 + MAX_CHECK_DELAY,
+    }
+
+
+def test_status_reports_saved_in_batch():
+    """Тест отчётов о статусах: отчёты сохраняются одним пакетом под номерами в формате базы данных"""
+    saved = []
+    rescheduled = {}
+
+    class FakeDatabase:
+        async def get_pending_phones(self, *sms_ids):
+            return [{"+79999990001", "89999990002"} for _ in sms_ids]
+
+        async def update_sms_status_in_bulk(self, statuses):
+            saved.append(sorted(statuses))
+            return len(statuses)
+
+        async def reschedule_sms_checks(self, sms_checks):
+            rescheduled.update(sms_checks)
+
+    async def flush():
+        collector = StatusReportCollector(FakeDatabase())
+        collector.add("430", "79999990001", 1)
+        collector.add("430", "79999990002", 0)
+        collector.add("430", "79999990003", 1)
+        return await collector.flush(), await collector.flush()
+
+    assert trio.run(flush) == (2, 0)
+    assert saved == [
+        [["430", "+79999990001", "delivered"], ["430", "89999990002", "pending"]]
+    ]
+    assert list(rescheduled) == [("430", "89999990002")]
+
+
+def test_refresher_survives_redis_errors():
+    """Тест обновления статусов: ошибка Redis не останавливает цикл обновления"""
+    calls = []
+
+    class FakeDatabase:
+        async def expire_pending_sms(self):
+            calls.append("expire")
+            if len(calls) == 1:
+                raise ResponseError("BUSY Redis is busy running a script")
+            return 0
+
+        async def get_due_sms_list(self, now):
+            return []
+
+    async def run_refresher():
+        refresher = StatusRefresher(FakeDatabase(), StatusPoller(), interval=10)
+        with trio.move_on_after(15):
+            await refresher.run()
+
+    trio.run(run_refresher, clock=trio.testing.MockClock(autojump_threshold=0))
+
+    assert calls == ["expire", "expire"]
+
+
+def test_refresher_reschedules_sms_without_status():
+    """Тест обновления статусов: SMS, для которых sms-сервис ответил ошибкой или не вернул статус, откладываются,
+    SMS из неудавшегося запроса опрашиваются при следующем обновлении"""
+    rescheduled = {}
+
+    class FakeDatabase:
+        async def expire_pending_sms(self):
+            return 0
+
+        async def get_due_sms_list(self, now):
+            return [
+                ("430", "79999990001", now - 20),
+                ("430", "79999990002", now - 1200),
+                ("431", "79999990003", now - 20),
+            ]
+
+        async def update_sms_status_in_bulk(self, statuses):
+            return 0
+
+        async def reschedule_sms_checks(self, sms_checks):
+            rescheduled.update(sms_checks)
+
+    async def fake_request_statuses(sms_list):
+        if sms_list[0][0] == "431":
+            raise OSError("Connection reset by peer")
+        return [("430", "79999990001", {"error": "no such sms", "error_code": 3})]
+
+    async def refresh():
+        refresher = StatusRefresher(FakeDatabase(), StatusPoller(batch_size=2))
+        return await refresher.refresh()
+
+    with patch("mchs_sms.poller.request_statuses", fake_request_statuses), patch(
+        "mchs_sms.poller.time.time", return_value=100000.0
+    ):
+        assert trio.run(refresh) == 0
+
+    assert rescheduled == {
+        ("430", "79999990001"): 100000.0 + MIN_CHECK_DELAY,
+        ("430", "79999990002"): 100000.0 + 600,
+    }
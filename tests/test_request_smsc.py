@@ -1,7 +1,19 @@
 from random import randint, choice
-from unittest.mock import patch
+from unittest.mock import AsyncMock, patch
+from urllib.parse import parse_qs
 
-from mchs_sms.smsc_api import request_smsc, HttpMethod, SEND_URL
+import asks
+
+from mchs_sms.smsc_api import (
+    request_smsc,
+    request_statuses,
+    smsc_login,
+    smsc_password,
+    smsc_client,
+    SmscClient,
+    HttpMethod,
+    SEND_URL,
+)
 
 
 class MockSuccessResponse:
@@ -26,6 +38,27 @@ class MockSendStatusResponse:
         }
 
 
+class MockBatchStatusResponse:
+    """Пример ответа sms-сервиса на запрос статусов нескольких SMS"""
+
+    status_code = 200
+
+    def __init__(self, params: str):
+        query = parse_qs(params)
+        self.ids = query["id"][0].split(",")
+        self.phones = query["phone"][0].split(",")
+
+    def json(self):
+        return [
+            {
+                "id": int(sms_id),
+                "phone": phone.lstrip("+"),
+                **MockSendStatusResponse.json(),
+            }
+            for sms_id, phone in zip(self.ids, self.phones)
+        ]
+
+
 async def test_success_request_smsc():
     """Тест функции request_smsc, проверяющий на выходе ответ сообщения от sms-сервиса"""
     with patch("asks.post") as mock_function:
@@ -44,3 +77,40 @@ async def test_success_request_smsc():
         )
     assert expected.json() == response.content
     assert expected.status_code == response.status_code
+
+
+async def test_request_statuses_in_batch():
+    """Тест функции request_statuses: статусы нескольких SMS получены одним запросом"""
+    smsc_login.set("test_user")
+    smsc_password.set("test_password")
+    sms_list = [("430", "+79999999999"), ("430", "79999999998"), ("431", "89999999997")]
+    with patch("asks.get") as mock_function:
+        mock_function.side_effect = lambda url, params: MockBatchStatusResponse(params)
+        statuses = await request_statuses(sms_list)
+
+    mock_function.assert_called_once()
+    assert [(sms_id, phone) for sms_id, phone, _ in statuses] == sms_list
+    assert all("status" in sms_status for *_, sms_status in statuses)
+
+
+async def test_request_smsc_uses_pooled_client():
+    """Тест функции request_smsc: при заданном клиенте запрос идёт через его сессию с пулом соединений"""
+    with patch.object(asks.Session, "post", new_callable=AsyncMock) as mock_function:
+        mock_function.return_value = MockSuccessResponse()
+        async with SmscClient(timeout=5) as client:
+            token = smsc_client.set(client)
+            try:
+                response = await request_smsc(
+                    HttpMethod.post,
+                    SEND_URL,
+                    login="test_user",
+                    password="test_password",
+                    payload={"phones": "79999999999", "mes": "Гроза", "valid": 1},
+                )
+            finally:
+                smsc_client.reset(token)
+
+    mock_function.assert_awaited_once()
+    assert mock_function.call_args.kwargs["path"] == SEND_URL
+    assert mock_function.call_args.kwargs["timeout"] == 5
+    assert response.status_code == 200
@@ -0,0 +1,190 @@
+import json
+from unittest.mock import AsyncMock, Mock, patch
+
+import pytest
+import trio
+import trio.testing
+
+from mchs_sms.metrics import (
+    SMSC_CIRCUIT_OPEN_SECONDS,
+    SMSC_CIRCUIT_OPENED,
+    SMSC_REJECTED,
+    SMSC_REQUESTS,
+    SMSC_RETRIES,
+)
+from mchs_sms.smsc_api import (
+    CircuitBreaker,
+    HttpMethod,
+    RetryPolicy,
+    SEND_URL,
+    SmscClient,
+    SmscResponse,
+    SmscServerError,
+    SmscUnavailableError,
+    _parse_response,
+)
+
+PAYLOAD = {"phones": "79999999999", "mes": "Завтра ожидается гроза", "valid": 1}
+
+
+def run_with_mock_clock(async_fn, *args):
+    return trio.run(async_fn, *args, clock=trio.testing.MockClock(autojump_threshold=0))
+
+
+def get_value(metric, *label_values) -> float:
+    return metric._values.get(label_values, 0)
+
+
+def test_client_retries_retryable_errors():
+    """Тест повторов: временная ошибка sms-сервиса повторяется, успешный ответ возвращается"""
+    responses = [
+        OSError("connection reset"),
+        SmscResponse(content={"error": "too many", "error_code": 9}, status_code=200),
+        SmscResponse(content={"id": 430, "cnt": 1}, status_code=200),
+    ]
+
+    async def request():
+        client = SmscClient(retry_policy=RetryPolicy(attempts=5))
+        with patch.object(client, "_request", AsyncMock(side_effect=responses)):
+            return client, await client.request(
+                HttpMethod.post, SEND_URL, payload=PAYLOAD
+            )
+
+    requests, retries = get_value(SMSC_REQUESTS, SEND_URL), get_value(
+        SMSC_RETRIES, SEND_URL
+    )
+    client, response = run_with_mock_clock(request)
+
+    assert response.content == {"id": 430, "cnt": 1}
+    assert get_value(SMSC_REQUESTS, SEND_URL) - requests == 3
+    assert get_value(SMSC_RETRIES, SEND_URL) - retries == 2
+
+
+def test_client_does_not_retry_permanent_errors():
+    """Тест повторов: ошибка в параметрах запроса возвращается без повторов"""
+    error_response = SmscResponse(
+        content={"error": "invalid phone", "error_code": 7}, status_code=200
+    )
+
+    async def request():
+        client = SmscClient()
+        with patch.object(client, "_request", AsyncMock(return_value=error_response)):
+            return client, await client.request(
+                HttpMethod.post, SEND_URL, payload=PAYLOAD
+            )
+
+    retries = get_value(SMSC_RETRIES, SEND_URL)
+    client, response = run_with_mock_clock(request)
+
+    assert response is error_response
+    assert get_value(SMSC_RETRIES, SEND_URL) == retries
+
+
+def test_circuit_breaker_fails_fast_and_recovers():
+    """Тест предохранителя: после серии ошибок запросы отклоняются, по истечении таймаута — пропускаются"""
+
+    async def scenario():
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+        client = SmscClient(retry_policy=RetryPolicy(attempts=3), breaker=breaker)
+        with patch.object(client, "_request", AsyncMock(side_effect=OSError)):
+            with pytest.raises(OSError):
+                await client.request(HttpMethod.post, SEND_URL, payload=PAYLOAD)
+            assert breaker.is_open
+
+            with pytest.raises(SmscUnavailableError):
+                await client.request(HttpMethod.post, SEND_URL, payload=PAYLOAD)
+
+        await trio.sleep(10)
+        success = SmscResponse(content={"id": 430, "cnt": 1}, status_code=200)
+        with patch.object(client, "_request", AsyncMock(return_value=success)):
+            await client.request(HttpMethod.post, SEND_URL, payload=PAYLOAD)
+
+        return client
+
+    opened, rejected, open_seconds = (
+        get_value(SMSC_CIRCUIT_OPENED),
+        get_value(SMSC_REJECTED),
+        get_value(SMSC_CIRCUIT_OPEN_SECONDS),
+    )
+    client = run_with_mock_clock(scenario)
+
+    assert not client.breaker.is_open
+    assert get_value(SMSC_CIRCUIT_OPENED) - opened == 1
+    assert get_value(SMSC_REJECTED) - rejected == 1
+    assert get_value(SMSC_CIRCUIT_OPEN_SECONDS) - open_seconds >= 10
+
+
+def test_circuit_breaker_lets_one_probe_through():
+    """Тест предохранителя: после таймаута проходит один пробный запрос, одновременные с ним отклоняются"""
+    rejected = []
+
+    async def scenario():
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+        client = SmscClient(retry_policy=RetryPolicy(attempts=1), breaker=breaker)
+        with patch.object(client, "_request", AsyncMock(side_effect=OSError)):
+            with pytest.raises(OSError):
+                await client.request(HttpMethod.post, SEND_URL, payload=PAYLOAD)
+        await trio.sleep(10)
+
+        async def slow_request(*args):
+            await trio.sleep(5)
+            return SmscResponse(content={"id": 430, "cnt": 1}, status_code=200)
+
+        async def send():
+            try:
+                await client.request(HttpMethod.post, SEND_URL, payload=PAYLOAD)
+            except SmscUnavailableError:
+                rejected.append(True)
+
+        with patch.object(client, "_request", slow_request):
+            async with trio.open_nursery() as nursery:
+                for _ in range(5):
+                    nursery.start_soon(send)
+        return client
+
+    client = run_with_mock_clock(scenario)
+
+    assert len(rejected) == 4
+    assert not client.breaker.is_open
+
+
+def test_cancelled_probe_releases_circuit_breaker():
+    """Тест предохранителя: отменённый пробный запрос не блокирует следующие"""
+
+    async def scenario():
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+        client = SmscClient(retry_policy=RetryPolicy(attempts=1), breaker=breaker)
+        breaker.record_failure()
+        await trio.sleep(10)
+
+        async def hanging_request(*args):
+            await trio.sleep_forever()
+
+        with patch.object(client, "_request", hanging_request):
+            with trio.move_on_after(1):
+                await client.request(HttpMethod.post, SEND_URL, payload=PAYLOAD)
+        return breaker.is_open, breaker.is_rejecting
+
+    assert run_with_mock_clock(scenario) == (True, False)
+
+
+@pytest.mark.parametrize(
+    "status_code, body",
+    [(502, "<html>Bad Gateway</html>"), (200, "<html>Bad Gateway</html>"), (503, "{}")],
+)
+def test_server_error_responses_are_retried(status_code, body):
+    """Тест повторов: ответ 5xx или не в формате JSON — повторяемая ошибка, а не ValueError"""
+    response = Mock(status_code=status_code, json=lambda: json.loads(body))
+
+    with pytest.raises(SmscServerError):
+        _parse_response(response)
+
+    async def request():
+        client = SmscClient(retry_policy=RetryPolicy(attempts=3))
+        with patch.object(client, "_request", AsyncMock(side_effect=SmscServerError)):
+            await client.request(HttpMethod.post, SEND_URL, payload=PAYLOAD)
+
+    retries = get_value(SMSC_RETRIES, SEND_URL)
+    with pytest.raises(SmscServerError):
+        run_with_mock_clock(request)
+    assert get_value(SMSC_RETRIES, SEND_URL) - retries == 2
@@ -0,0 +1,266 @@
+from unittest.mock import patch
+
+import pytest
+import trio
+import trio.testing
+
+from mchs_sms.phones import get_phones_digest
+from mchs_sms.redis_client import ResponseError
+from mchs_sms.sender import MailingPostponedError, MailingSender, MailingWorker
+from mchs_sms.smsc_api import SmscResponse, SmscServerError, SmscUnavailableError
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.mailings = {}
+        self.chunks = []
+        self.failed_chunks = []
+        self.done_chunks = set()
+        self.acked_jobs = []
+        self.jobs = []
+
+    async def create_sms_mailing(self, sms_id, text, phones_count, chunks_count):
+        self.mailings[sms_id] = (text, phones_count, chunks_count)
+
+    async def add_sms_mailing_chunk(self, sms_id, smsc_id, phones, chunk_index, valid):
+        self.chunks.append((sms_id, smsc_id, phones))
+        self.done_chunks.add(chunk_index)
+
+    async def add_failed_sms_mailing_chunk(self, sms_id, phones_count, chunk_index):
+        self.failed_chunks.append((sms_id, phones_count))
+
+    async def get_done_sms_mailing_chunks(self, sms_id):
+        return self.done_chunks
+
+    async def touch_sms_mailing_job(self, consumer, job_id):
+        pass
+
+    async def ack_sms_mailing_job(self, job_id):
+        self.acked_jobs.append(job_id)
+
+    async def enqueue_sms_mailing_job(self, sms_id, **job):
+        self.jobs.append((f"{len(self.jobs) + 1}-0", {"sms_id": sms_id, **job}))
+
+    async def create_sms_mailing_jobs_group(self):
+        pass
+
+    async def claim_stale_sms_mailing_jobs(self, consumer, min_idle_time):
+        return []
+
+    async def read_sms_mailing_jobs(self, consumer, block=None):
+        jobs, self.jobs = self.jobs, []
+        if not jobs:
+            await trio.sleep(block / 1000)
+        return jobs
+
+
+def test_sender_sends_chunks_under_one_mailing():
+    """Тест отправки частями: каждая часть отправлена отдельным запросом и записана под одной рассылкой"""
+    db = FakeDatabase()
+    phones = [f"7999999{number:04}" for number in range(25)]
+    sent_phones = []
+
+    async def fake_request_smsc(http_method, api_method, *, payload):
+        chunk_phones = payload["phones"].split(",")
+        sent_phones.extend(chunk_phones)
+        if "79999990020" in chunk_phones:
+            return SmscResponse(
+                content={"error": "denied", "error_code": 6}, status_code=200
+            )
+        return SmscResponse(
+            content={"id": len(sent_phones), "cnt": 10}, status_code=200
+        )
+
+    async def send():
+        sender = MailingSender(db, chunk_size=10, concurrency=2)
+        progress = await sender.create_mailing(len(phones), "Завтра гроза")
+        return await sender.send(progress, iter(phones), "Завтра гроза", 1)
+
+    with patch("mchs_sms.sender.request_smsc", fake_request_smsc):
+        progress = trio.run(send)
+
+    assert progress.is_finished
+    assert (progress.chunks_count, progress.chunks_sent, progress.chunks_failed) == (
+        3,
+        2,
+        1,
+    )
+    assert sorted(sent_phones) == phones
+    assert {sms_id for sms_id, *_ in db.chunks} == {progress.sms_id}
+    assert db.failed_chunks == [(progress.sms_id, 5)]
+
+
+def test_sender_skips_done_chunks():
+    """Тест повторной отправки: части, отправленные до сбоя, не отправляются ещё раз"""
+    db = FakeDatabase()
+    phones = [f"7999999{number:04}" for number in range(25)]
+    sent_phones = []
+
+    async def fake_request_smsc(http_method, api_method, *, payload):
+        sent_phones.extend(payload["phones"].split(","))
+        return SmscResponse(content={"id": 430, "cnt": 10}, status_code=200)
+
+    async def send():
+        sender = MailingSender(db, chunk_size=10)
+        progress = await sender.create_mailing(len(phones), "Завтра гроза")
+        return await sender.send(
+            progress, phones, "Завтра гроза", 1, done_chunks={0, 2}
+        )
+
+    with patch("mchs_sms.sender.request_smsc", fake_request_smsc):
+        progress = trio.run(send)
+
+    assert sent_phones == phones[10:20]
+    assert progress.chunks_sent == 1
+
+
+def test_worker_resumes_job():
+    """Тест обработчика очереди: задание упавшего обработчика досылается и подтверждается"""
+    db = FakeDatabase()
+    db.done_chunks = {0}
+    phones = [f"7999999{number:04}" for number in range(25)]
+    sent_phones = []
+
+    async def fake_request_smsc(http_method, api_method, *, payload):
+        sent_phones.extend(payload["phones"].split(","))
+        return SmscResponse(content={"id": 430, "cnt": 10}, status_code=200)
+
+    async def process():
+        worker = MailingWorker(db, MailingSender(db), phones, "worker-1")
+        job = {
+            "sms_id": "1",
+            "text": "Завтра гроза",
+            "valid": "1",
+            "phones_count": "25",
+            "phones_digest": get_phones_digest(phones),
+            "chunk_size": "10",
+        }
+        await worker.process("1-0", job)
+
+    with patch("mchs_sms.sender.request_smsc", fake_request_smsc):
+        trio.run(process)
+
+    assert sorted(sent_phones) == phones[10:]
+    assert db.acked_jobs == ["1-0"]
+
+
+@pytest.mark.parametrize(
+    "outage_error",
+    [
+        SmscUnavailableError("Sms-сервис недоступен, запрос отклонён"),
+        SmscServerError("Ошибка sms-сервиса: статус ответа 503"),
+        SmscResponse(
+            content={"error": "duplicate request", "error_code": 9}, status_code=200
+        ),
+    ],
+)
+def test_worker_keeps_job_during_outage(outage_error):
+    """Тест обработчика очереди: части, не отправленные из-за временной ошибки sms-сервиса, не записываются
+    неудачными, задание не подтверждается и после восстановления сервиса досылается"""
+    db = FakeDatabase()
+    phones = [f"7999999{number:04}" for number in range(25)]
+    outage = [True]
+
+    async def fake_request_smsc(http_method, api_method, *, payload):
+        if outage[0] and "79999990000" not in payload["phones"]:
+            if isinstance(outage_error, SmscResponse):
+                return outage_error
+            raise outage_error
+        return SmscResponse(content={"id": 430, "cnt": 10}, status_code=200)
+
+    async def process():
+        worker = MailingWorker(db, MailingSender(db), phones, "worker-1")
+        job = {
+            "sms_id": "1",
+            "text": "Завтра гроза",
+            "valid": "1",
+            "phones_count": "25",
+            "phones_digest": get_phones_digest(phones),
+            "chunk_size": "10",
+        }
+        with pytest.raises(MailingPostponedError):
+            await worker.process("1-0", job)
+        acked_during_outage = list(db.acked_jobs)
+
+        outage[0] = False
+        await worker.process("1-0", job)
+        return acked_during_outage
+
+    with patch("mchs_sms.sender.request_smsc", fake_request_smsc):
+        acked_during_outage = trio.run(process)
+
+    assert acked_during_outage == []
+    assert db.failed_chunks == []
+    assert sorted(len(chunk_phones) for *_, chunk_phones in db.chunks) == [5, 10, 10]
+    assert db.acked_jobs == ["1-0"]
+
+
+@pytest.mark.parametrize(
+    "job_phones, failed_chunks",
+    [
+        ([f"7999999{number:04}" for number in range(15)], [10, 5]),
+        ([f"7999998{number:04}" for number in range(25)], [10, 10, 5]),
+    ],
+)
+def test_worker_fails_job_with_other_phones(job_phones, failed_chunks):
+    """Тест обработчика очереди: рассылка по другому списку номеров, в том числе той же длины, не отправляется"""
+    db = FakeDatabase()
+    phones = [f"7999999{number:04}" for number in range(25)]
+    sent_phones = []
+
+    async def fake_request_smsc(http_method, api_method, *, payload):
+        sent_phones.extend(payload["phones"].split(","))
+        return SmscResponse(content={"id": 430, "cnt": 10}, status_code=200)
+
+    async def process():
+        worker = MailingWorker(db, MailingSender(db), phones, "worker-1")
+        job = {
+            "sms_id": "1",
+            "text": "Завтра гроза",
+            "valid": "1",
+            "phones_count": str(len(job_phones)),
+            "phones_digest": get_phones_digest(job_phones),
+            "chunk_size": "10",
+        }
+        await worker.process("1-0", job)
+
+    with patch("mchs_sms.sender.request_smsc", fake_request_smsc):
+        trio.run(process)
+
+    assert sent_phones == []
+    assert db.failed_chunks == [("1", count) for count in failed_chunks]
+    assert db.acked_jobs == ["1-0"]
+
+
+def test_worker_survives_failed_job():
+    """Тест обработчика очереди: после ошибки обработки задания обработчик продолжает работу и отправляет следующее"""
+    db = FakeDatabase()
+    phones = [f"7999999{number:04}" for number in range(5)]
+    processed = []
+
+    async def scenario():
+        sender = MailingSender(db)
+        worker = MailingWorker(db, sender, phones, "worker-1")
+        process = worker.process
+
+        async def flaky_process(job_id, job):
+            if not processed:
+                processed.append(job_id)
+                raise ResponseError("OOM command not allowed")
+            processed.append(job_id)
+            await process(job_id, job)
+
+        await sender.enqueue_mailing(phones, "Завтра гроза", 1)
+        await sender.enqueue_mailing(phones, "Завтра гроза", 1)
+        with patch.object(worker, "process", flaky_process):
+            with trio.move_on_after(60):
+                await worker.run()
+
+    async def fake_request_smsc(http_method, api_method, *, payload):
+        return SmscResponse(content={"id": 430, "cnt": 5}, status_code=200)
+
+    with patch("mchs_sms.sender.request_smsc", fake_request_smsc):
+        trio.run(scenario, clock=trio.testing.MockClock(autojump_threshold=0))
+
+    assert processed == ["1-0", "2-0"]
+    assert db.acked_jobs == ["2-0"]
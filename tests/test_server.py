@@ -0,0 +1,36 @@
+import pytest
+from pydantic import ValidationError
+
+from mchs_sms.server import MailingsRequest
+
+
+def test_mailings_request_accepts_next_cursor():
+    """Тест запроса рассылок: курсор из nextCursor ответа принимается"""
+    request = MailingsRequest.model_validate_json(
+        '{"msgType": "LoadOlderMailings", "cursor": "1123131392.734:04406a6ee1c8", "since": 1123000000}'
+    )
+
+    assert (request.cursor, request.since, request.until) == (
+        "1123131392.734:04406a6ee1c8",
+        1123000000,
+        None,
+    )
+
+
+@pytest.mark.parametrize(
+    "fields",
+    [
+        '"cursor": "430"',
+        '"cursor": "latest:430"',
+        '"cursor": "1123131392.734:"',
+        '"cursor": "1123131392.734:sms_mailing"',
+        '"until": "nan"',
+    ],
+)
+def test_mailings_request_rejects_malformed_values(fields):
+    """Тест запроса рассылок: курсор не из nextCursor и нечисловые границы отклоняются при проверке запроса,
+    а не ошибкой Redis"""
+    with pytest.raises(ValidationError):
+        MailingsRequest.model_validate_json(
+            '{"msgType": "LoadOlderMailings", %s}' % fields
+        )
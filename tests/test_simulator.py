@@ -0,0 +1,43 @@
+from mchs_sms.simulator import (
+    SimulatorSettings,
+    SmscSimulator,
+    STATUS_DELIVERED,
+    STATUS_FAILED,
+    STATUS_QUEUED,
+)
+
+
+def test_simulator_statuses_progress_over_time():
+    """Тест имитатора: SMS ожидает отправки, затем получает окончательный статус и больше его не меняет"""
+    simulator = SmscSimulator(
+        SimulatorSettings(delivery_rate=0.5, delivery_time=10), seed=1
+    )
+    response = simulator.send("79999990001,79999990002", now=1000)
+    assert response["cnt"] == 2
+
+    phones = [f"7999999{number:04}" for number in range(100)]
+    sent = [simulator.get_status(response["id"], phone, 1000.5) for phone in phones]
+    finished = [simulator.get_status(response["id"], phone, 2000) for phone in phones]
+
+    assert {sms_status["status"] for sms_status in sent} == {STATUS_QUEUED}
+    assert {sms_status["status"] for sms_status in finished} == {
+        STATUS_DELIVERED,
+        STATUS_FAILED,
+    }
+    assert finished == [
+        simulator.get_status(response["id"], phone, 3000) for phone in phones
+    ]
+    assert "error_code" in simulator.get_status(response["id"] + 1, phones[0])
+
+
+def test_simulator_limits_rate():
+    """Тест имитатора: запросы сверх ограничения в секунду отклоняются до начала следующей секунды"""
+    simulator = SmscSimulator(SimulatorSettings(rate_limit=3))
+
+    assert [simulator.is_rate_limited(10.1) for _ in range(4)] == [
+        False,
+        False,
+        False,
+        True,
+    ]
+    assert not simulator.is_rate_limited(11.2)
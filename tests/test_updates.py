@@ -0,0 +1,106 @@
+import trio
+import trio.testing
+
+from mchs_sms.redis_client import ResponseError
+from mchs_sms.updates import MailingSnapshotCache, MailingUpdatesFeed
+
+
+def test_feed_returns_changes_after_version():
+    """Тест журнала изменений: подписчик получает только рассылки, изменившиеся после его версии"""
+    feed = MailingUpdatesFeed(db=None)
+    feed.add("1")
+    version = feed.version
+    feed.add("2")
+    feed.add("3")
+    feed.add("2")
+
+    assert feed.get_changes(version) == {"2", "3"}
+    assert feed.get_changes(feed.version) == set()
+
+
+def test_feed_requires_snapshot_after_overflow():
+    """Тест журнала изменений: отставший подписчик получает указание запросить полную сводку"""
+    feed = MailingUpdatesFeed(db=None, history_size=2)
+    for sms_id in ("1", "2", "3"):
+        feed.add(sms_id)
+
+    assert feed.get_changes(0) is None
+    assert feed.get_changes(1) == {"2", "3"}
+
+    feed.reset()
+    assert feed.get_changes(3) is None
+
+
+def test_feed_wakes_up_subscribers():
+    """Тест оповещения: подписчик не пропускает изменение, случившееся до начала ожидания"""
+
+    async def add_and_wait():
+        feed = MailingUpdatesFeed(db=None)
+        version = feed.version
+        feed.add("1")
+        with trio.fail_after(1):
+            return await feed.wait_changes(version)
+
+    assert trio.run(add_and_wait) == (1, {"1"})
+
+
+def test_feed_resubscribes_after_redis_error():
+    """Тест подписки на обновления: после ошибки Redis журнал сбрасывается и подписка возобновляется"""
+    subscriptions = []
+
+    class FakeDatabase:
+        async def listen_updates(self):
+            subscriptions.append(len(subscriptions))
+            yield {"sms_id": str(len(subscriptions))}
+            if len(subscriptions) == 1:
+                raise ResponseError("LOADING Redis is loading the dataset in memory")
+            await trio.sleep_forever()
+
+    async def run_feed():
+        feed = MailingUpdatesFeed(FakeDatabase())
+        with trio.move_on_after(5):
+            await feed.run()
+        return feed
+
+    feed = trio.run(run_feed, clock=trio.testing.MockClock(autojump_threshold=0))
+
+    assert subscriptions == [0, 1]
+    assert feed.get_changes(0) is None
+    assert feed.get_changes(feed.version - 1) == {"2"}
+
+
+def test_snapshot_cache_builds_once_for_concurrent_clients():
+    """Тест кэша сводки: одновременные подключения ждут одного построения, изменения и ttl сбрасывают кэш"""
+    builds = []
+
+    async def build():
+        builds.append(len(builds))
+        await trio.sleep(0.1)
+        return {"msgType": "SMSMailingStatus", "SMSMailings": [], "build": len(builds)}
+
+    async def get_snapshots():
+        feed = MailingUpdatesFeed(db=None)
+        cache = MailingSnapshotCache(feed, build, ttl=5)
+        snapshots = []
+
+        async def get():
+            snapshots.append(await cache.get())
+
+        async with trio.open_nursery() as nursery:
+            for _ in range(100):
+                nursery.start_soon(get)
+
+        feed.add("1")
+        snapshots.append(await cache.get())
+        await trio.sleep(5)
+        snapshots.append(await cache.get())
+        return snapshots
+
+    snapshots = trio.run(
+        get_snapshots, clock=trio.testing.MockClock(autojump_threshold=0)
+    )
+
+    assert len(builds) == 3
+    assert len(set(snapshots[:100])) == 1
+    assert snapshots[100][0] == 1
+    assert '"build": 3' in snapshots[-1][1]